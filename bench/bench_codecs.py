@@ -0,0 +1,56 @@
+"""Benchmark the mailbox compression codecs.
+
+Writes the same articles with bodies of random words, which are generated
+beforehand, to a mailbox with every codec of news2mbox, syncing the mailbox
+every `--checkpoint` articles like news2mbox does, and reports the write
+throughput of uncompressed data and the compression ratio.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import text_group
+import news2mbox
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--megabytes", type=float, default=64)
+    parser.add_argument("--size", type=int, default=4000)
+    parser.add_argument("--checkpoint", type=int, default=100)
+    args = parser.parse_args()
+
+    count = int(args.megabytes * 2**20) // args.size
+    articles = list(text_group("g", count, args.size).values())
+    print("%d articles of %d bytes, synced every %d articles" %
+          (count, args.size, args.checkpoint))
+    print("%-8s %10s %10s %10s" % ("codec", "seconds", "MiB/s", "ratio"))
+    outdir = tempfile.mkdtemp()
+    try:
+        for codec in [ None ] + sorted(news2mbox.COMPRESSIONS):
+            config = dict(outdir=outdir, compression=codec)
+            size = 0
+            start = time.perf_counter()
+            with news2mbox.open_mbox(config, "g") as f:
+                for n, lines in enumerate(articles):
+                    size += f.write("<%d@bench>" % n, lines, n)[1]
+                    if n % args.checkpoint == 0:
+                        f.sync()
+            elapsed = time.perf_counter() - start
+            name = f.name
+            print("%-8s %10.2f %10.1f %10.2f" %
+                  (codec or "none", elapsed, size / 2**20 / elapsed,
+                   size / os.path.getsize(name)))
+            os.remove(name)
+    finally:
+        shutil.rmtree(outdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Benchmark the throughput and memory of compacting a large mailbox.
+
+Writes a mailbox of synthetic articles, several GiB by default, whose dates
+are spread evenly over the last 60 days and every 10th of which repeats the
+message ID of an earlier article. Then the mailbox is compacted with
+compact_mbox, once removing the duplicates and once removing the older half
+of the articles. For both passes, the time and the throughput in terms of
+the size of the mailbox before the pass are reported. With --trace-memory,
+the peak of the memory allocated by Python is reported as well, which stays
+bounded as articles are never held in memory as a whole, but tracing slows
+down the passes.
+"""
+import argparse
+import email.utils
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import make_article
+import news2mbox
+
+
+def write_mbox(path, total, size):
+    """Write articles of about `size` bytes to a mailbox of `total` bytes."""
+    pool = [ make_article("g", n, size) for n in range(1, 101) ]
+    count = total // size
+    now = time.time()
+    with news2mbox.MboxWriter(path) as f:
+        for n in range(count):
+            age = (count - n) * 60 * 86400 / count
+            message_id = "<%d@bench>" % (n - 5 if n % 10 == 9 else n)
+            lines = pool[n % len(pool)]
+            lines = lines[:3] + [
+                b"Date: " + email.utils.formatdate(now - age).encode(),
+                b"Message-ID: " + message_id.encode() ] + lines[5:]
+            f.write(message_id, lines, n)
+        f.sync()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--gigabytes", type=float, default=2)
+    parser.add_argument("--size", type=int, default=4000)
+    parser.add_argument("--dir", default=None,
+                        help="directory for the mailbox (default: temporary)")
+    parser.add_argument("--trace-memory", action="store_true")
+    args = parser.parse_args()
+
+    total = int(args.gigabytes * 2**30)
+    print("%.1f GiB in articles of %d bytes" % (total / 2**30, args.size))
+    outdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        path = os.path.join(outdir, "g")
+        write_mbox(path, total, args.size)
+        print("%-10s %10s %10s %10s %12s" % ("pass", "articles", "seconds",
+                                             "MiB/s", "peak MiB"))
+        for name, retention, dedup in [ ("dedup", {}, True),
+                                        ("max_age", dict(max_age=30),
+                                         False) ]:
+            if args.trace_memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            count, kept, before, after = news2mbox.compact_mbox(
+                path, retention, dedup)
+            elapsed = time.perf_counter() - start
+            peak = "-"
+            if args.trace_memory:
+                peak = "%.1f" % (tracemalloc.get_traced_memory()[1] / 2**20)
+                tracemalloc.stop()
+            print("%-10s %10s %10.2f %10.1f %12s" % (
+                name, "%d/%d" % (kept, count), elapsed,
+                before / 2**20 / elapsed, peak))
+    finally:
+        shutil.rmtree(outdir)
+
+
+if __name__ == "__main__":
+    main()
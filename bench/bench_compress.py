@@ -0,0 +1,55 @@
+"""Benchmark NNTP COMPRESS DEFLATE against the fake NNTP server.
+
+Fetches a group with and without compression and reports the bytes sent by
+the server, the time of the whole fetch and the CPU time spent by the
+client decompressing. The bodies of the articles are random words, which
+compress about as well as real text, unlike the repetitive bodies of the
+articles used by the tests.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import FakeNNTPServer, text_group
+from news2mbox import connect, fetch_articles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--articles", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=4000)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Server latency in seconds")
+    args = parser.parse_args()
+
+    groups = { "g" : text_group("g", args.articles, args.size) }
+    print("%d articles of %d bytes" % (args.articles, args.size))
+    print("%-12s %12s %10s %10s %16s" % ("compression", "wire MiB", "ratio",
+                                        "seconds", "inflate seconds"))
+    baseline = None
+    for compress in [ False, True ]:
+        with FakeNNTPServer(groups, latency=args.latency) as server:
+            config = dict(server="127.0.0.1", port=server.port, ssl=False,
+                          compress=compress)
+            with connect(config) as s:
+                s.group("g")
+                start = time.perf_counter()
+                for n, info in fetch_articles(s, range(1, args.articles + 1),
+                                              16):
+                    pass
+                elapsed = time.perf_counter() - start
+                deflate = getattr(s.file, "deflate", None)
+            sent = server.sent
+        baseline = baseline or sent
+        print("%-12s %12.2f %10.2f %10.2f %16.3f" %
+              ("deflate" if compress else "none", sent / 2**20,
+               baseline / sent, elapsed,
+               deflate.seconds if deflate else 0.0))
+
+
+if __name__ == "__main__":
+    main()
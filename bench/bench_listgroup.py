@@ -0,0 +1,75 @@
+"""Benchmark reading a sparse group with and without LISTGROUP.
+
+Reads a group, of which most article numbers were expired or cancelled, from
+the fake NNTP server with injected latency. The number of requests sent to
+the server and the time needed are reported, once with the article numbers
+obtained by LISTGROUP and once requesting every number of the range.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import FakeNNTPServer, synthetic_group
+import news2mbox
+
+
+class RangeConnection(news2mbox.NNTPLibConnection):
+    """Requests every number of the range, as done without LISTGROUP."""
+
+    async def listgroup(self, name, first, last):
+        await self.group(name)
+        return list(range(first, last + 1))
+
+
+def measure(server, connection_class, window):
+    outdir = tempfile.mkdtemp()
+    config = dict(server="127.0.0.1", port=server.port, ssl=False,
+                  outdir=outdir, window=window)
+    try:
+        with news2mbox.connect(config) as s:
+            server.commands.clear()
+            start = time.perf_counter()
+            asyncio.run(news2mbox.read_group(connection_class(s), config, "g",
+                                             {}, open(os.devnull, "w")))
+            elapsed = time.perf_counter() - start
+            commands = dict(server.commands)
+    finally:
+        shutil.rmtree(outdir)
+    return commands, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--range", type=int, default=news2mbox.MAX_ARTICLES)
+    parser.add_argument("--holes", type=float, default=0.8,
+                        help="Fraction of missing article numbers")
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--window", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(1)
+    gaps = [ n for n in range(1, args.range + 1) if rnd.random() < args.holes ]
+    groups = { "g" : synthetic_group("g", args.range, gaps=gaps) }
+    print("%d article numbers, %d missing, %.0f ms latency, window %d" %
+          (args.range, len(gaps), args.latency * 1000, args.window))
+    print("%-10s %10s %10s %10s" % ("method", "requests", "ARTICLE",
+                                    "seconds"))
+    with FakeNNTPServer(groups, latency=args.latency) as server:
+        for name, cls in [ ("range", RangeConnection),
+                           ("listgroup", news2mbox.NNTPLibConnection) ]:
+            commands, elapsed = measure(server, cls, args.window)
+            print("%-10s %10d %10d %10.2f" %
+                  (name, sum(commands.values()), commands.get("ARTICLE", 0),
+                   elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Benchmark the write throughput and disk use of mailboxes and Maildirs.
+
+Writes synthetic articles to several groups in a temporary directory, once
+as mailboxes and once as Maildirs, syncing every 100 articles like the
+checkpoints of a fetch. A share of the articles is cross-posted to all
+groups, these are written once and then duplicated from their location as
+with the configuration key dedup: copied into the other mailboxes, but
+hardlinked into the other Maildirs. The disk use is the number of blocks
+allocated for all files, counting hardlinked files once.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import make_article
+import news2mbox
+
+
+def write_groups(outdir, fmt, groups, articles, size, crossposted):
+    """Write `articles` articles to each of `groups` groups."""
+    config = dict(outdir=outdir, format=fmt)
+    pool = [ make_article("g", n, size) for n in range(1, 101) ]
+    every = round(1 / crossposted) if crossposted else 0
+    locations = {}
+    written = 0
+    for g in range(groups):
+        with news2mbox.open_mbox(config, "g%d" % g) as f:
+            for n in range(articles):
+                message_id = "<%d.%d@bench>" % (g, n)
+                if every and n % every == 0:
+                    message_id = "<%d@bench>" % n
+                    if message_id in locations:
+                        f.duplicate(message_id, locations[message_id], n)
+                        continue
+                lines = pool[n % len(pool)]
+                offset, length = f.write(message_id, lines, n)
+                written += length
+                if every and n % every == 0:
+                    locations[message_id] = f.name, offset, length
+                if n % 100 == 99:
+                    f.sync()
+            f.sync()
+    return written
+
+
+def disk_use(path):
+    seen = set()
+    blocks = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            st = os.stat(os.path.join(root, name))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                blocks += st.st_blocks
+    return blocks * 512
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--groups", type=int, default=4)
+    parser.add_argument("--articles", type=int, default=5000,
+                        help="articles per group")
+    parser.add_argument("--size", type=int, default=4000)
+    parser.add_argument("--crossposted", type=float, default=0.2,
+                        help="share of articles cross-posted to all groups")
+    parser.add_argument("--dir", default=None,
+                        help="directory for the output (default: temporary)")
+    args = parser.parse_args()
+
+    print("%d groups of %d articles of %d bytes, %d%% cross-posted" %
+          (args.groups, args.articles, args.size, args.crossposted * 100))
+    print("%-10s %10s %12s %10s %10s" % ("format", "seconds", "articles/s",
+                                         "MiB/s", "disk MiB"))
+    for fmt in news2mbox.FORMATS:
+        outdir = tempfile.mkdtemp(dir=args.dir)
+        try:
+            start = time.perf_counter()
+            written = write_groups(outdir, fmt, args.groups, args.articles,
+                                   args.size, args.crossposted)
+            elapsed = time.perf_counter() - start
+            print("%-10s %10.2f %12.0f %10.1f %10.1f" % (
+                fmt, elapsed, args.groups * args.articles / elapsed,
+                written / 2**20 / elapsed, disk_use(outdir) / 2**20))
+        finally:
+            shutil.rmtree(outdir)
+
+
+if __name__ == "__main__":
+    main()
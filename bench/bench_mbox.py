@@ -0,0 +1,84 @@
+"""Benchmark the throughput of writing articles to a mailbox.
+
+Writes the same stream of synthetic articles, several GiB by default, to a
+mailbox in a temporary directory, once with the former loop writing every
+line and newline separately to a buffered file, and once with the
+MboxWriter of news2mbox, with and without preallocation. Every 50th article
+contains body lines that must be quoted. The time includes syncing the
+mailbox to disk.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import make_article
+import news2mbox
+
+
+def articles(total, size):
+    """Yield message IDs and lines of articles of about `total` bytes."""
+    pool = [ make_article("g", n, size) for n in range(1, 101) ]
+    for lines in pool[::50]:
+        lines[-1:-1] = [ b"From the body", b">From the body" ]
+    for n in range(total // size):
+        lines = pool[n % len(pool)]
+        yield "<%d@bench>" % n, lines
+
+
+def write_loop(path, total, size):
+    """The former algorithm, writing every line separately."""
+    with open(path, "ab", buffering=2**20) as f:
+        for message_id, lines in articles(total, size):
+            f.write(news2mbox.make_mbox_header(message_id))
+            f.write(b"\n")
+            for line in lines:
+                f.write(line)
+                f.write(b"\n")
+        news2mbox.sync_file(f)
+
+
+def write_mbox(path, total, size, preallocate=0):
+    with news2mbox.MboxWriter(path, preallocate) as f:
+        for message_id, lines in articles(total, size):
+            f.write(message_id, lines)
+        f.sync()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--gigabytes", type=float, default=2)
+    parser.add_argument("--size", type=int, default=4000)
+    parser.add_argument("--dir", default=None,
+                        help="directory for the mailbox (default: temporary)")
+    args = parser.parse_args()
+
+    total = int(args.gigabytes * 2**30)
+    print("%.1f GiB in articles of %d bytes" % (total / 2**30, args.size))
+    print("%-20s %10s %10s" % ("writer", "seconds", "MiB/s"))
+    outdir = tempfile.mkdtemp(dir=args.dir)
+    try:
+        for name, write, kwargs in [
+                ("loop", write_loop, {}),
+                ("MboxWriter", write_mbox, {}),
+                ("MboxWriter+prealloc", write_mbox,
+                 dict(preallocate=64 * 2**20)) ]:
+            path = os.path.join(outdir, "g")
+            start = time.perf_counter()
+            write(path, total, args.size, **kwargs)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(path)
+            os.remove(path)
+            print("%-20s %10.2f %10.1f" % (name, elapsed,
+                                          size / 2**20 / elapsed))
+    finally:
+        shutil.rmtree(outdir)
+
+
+if __name__ == "__main__":
+    main()
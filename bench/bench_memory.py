@@ -0,0 +1,82 @@
+"""Benchmark the peak memory used to read a large group.
+
+Reads a group with 10000 articles from the fake NNTP server and reports the
+peak of the memory allocated by Python while the group is read, once for
+news2mbox, which streams every article to the mailbox, and once for a
+baseline that buffers all lines of the group before writing them, like
+news2mbox did before.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import FakeNNTPServer, synthetic_group
+import news2mbox
+
+
+async def read_group_buffered(conn, config, g, status, out=None):
+    """The former algorithm, collecting all lines before writing them."""
+    count, first, last = await conn.group(g)
+    lines = []
+    articles = conn.articles(range(first, last + 1), 16)
+    async with contextlib.aclosing(articles):
+        async for absnum, info in articles:
+            if info is not None:
+                lines.append(news2mbox.make_mbox_header(info.message_id))
+                lines.extend(info.lines)
+    with open(os.path.join(config["outdir"], g), "ab") as f:
+        for line in lines:
+            f.write(line)
+            f.write(b"\n")
+    status[g] = last
+
+
+def measure(server, read_group):
+    outdir = tempfile.mkdtemp()
+    config = dict(server="127.0.0.1", port=server.port, ssl=False,
+                  outdir=outdir)
+    try:
+        with news2mbox.connect(config) as s:
+            conn = news2mbox.NNTPLibConnection(s)
+            tracemalloc.start()
+            start = time.perf_counter()
+            asyncio.run(read_group(conn, config, "g", {}, open(os.devnull, "w")))
+            elapsed = time.perf_counter() - start
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        size = os.path.getsize(os.path.join(outdir, "g"))
+    finally:
+        shutil.rmtree(outdir)
+    return peak, elapsed, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--articles", type=int, default=10000)
+    parser.add_argument("--size", type=int, default=4000)
+    args = parser.parse_args()
+
+    news2mbox.MAX_ARTICLES = args.articles
+    groups = { "g" : synthetic_group("g", args.articles, args.size) }
+    print("%d articles of %d bytes" % (args.articles, args.size))
+    print("%-10s %12s %10s %12s" % ("algorithm", "peak MiB", "seconds",
+                                    "mbox MiB"))
+    with FakeNNTPServer(groups) as server:
+        for name, read_group in [ ("buffered", read_group_buffered),
+                                  ("streaming", news2mbox.read_group) ]:
+            peak, elapsed, size = measure(server, read_group)
+            print("%-10s %12.2f %10.2f %12.2f" %
+                  (name, peak / 2**20, elapsed, size / 2**20))
+
+
+if __name__ == "__main__":
+    main()
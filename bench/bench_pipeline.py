@@ -0,0 +1,46 @@
+"""Benchmark pipelined ARTICLE retrieval against the fake NNTP server.
+
+Fetches a group from a local fake server with injected latency and reports
+the achieved articles per second for a range of pipeline window sizes.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import FakeNNTPServer, synthetic_group
+from news2mbox import connect, fetch_articles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--articles", type=int, default=200)
+    parser.add_argument("--size", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Server latency in seconds")
+    parser.add_argument("--windows", default="1,2,4,8,16,32,64")
+    args = parser.parse_args()
+
+    groups = { "g" : synthetic_group("g", args.articles, args.size) }
+    print("%d articles of %d bytes, %.0f ms latency" %
+          (args.articles, args.size, args.latency * 1000))
+    print("%8s %10s %14s" % ("window", "seconds", "articles/sec"))
+    with FakeNNTPServer(groups, latency=args.latency) as server:
+        config = dict(server="127.0.0.1", port=server.port, ssl=False)
+        for window in map(int, args.windows.split(",")):
+            with connect(config) as s:
+                s.group("g")
+                start = time.perf_counter()
+                for n, info in fetch_articles(s, range(1, args.articles + 1),
+                                              window):
+                    pass
+                elapsed = time.perf_counter() - start
+            print("%8d %10.2f %14.1f" %
+                  (window, elapsed, args.articles / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""End-to-end benchmark suite of news2mbox against the fake NNTP server.
+
+Every scenario serves synthetic groups from the fake NNTP server and runs
+the news2mbox program as it is run by users, with a configuration directory
+of its own. The articles per second, the bytes per second received, the
+peak resident set size of the program, and the round trips and commands
+seen by the server are reported. Scenarios with `runs` > 1 are repeated
+with the same configuration and status, the last run is reported.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path[:0] = [ os.path.join(os.path.dirname(__file__), "..", d)
+                 for d in ("python", "test") ]
+
+from fakenntp import FakeNNTPServer, synthetic_groups
+
+PROGRAM = os.path.join(os.path.dirname(__file__), "..", "python",
+                       "news2mbox.py")
+
+SCENARIOS = [
+    dict(name="one large group", groups=1, articles=5000, size=4000,
+         options=dict(max_articles=5000)),
+    dict(name="many groups", groups=50, articles=100, size=(500, 8000),
+         options=dict(connections=4)),
+    dict(name="no new articles", groups=200, articles=10, runs=2),
+    dict(name="sparse groups", groups=10, articles=2000, gaps=0.9,
+         options=dict(max_articles=2000)),
+    dict(name="cross-posts", groups=5, articles=500, crossposts=0.5,
+         options=dict(dedup=True)),
+    dict(name="50 ms latency", groups=4, articles=500, latency=0.05,
+         options=dict(connections=2)),
+    dict(name="1 MB/s bandwidth", groups=2, articles=500, size=4000,
+         bandwidth=2**20, max_connections=2, options=dict(connections=2)),
+]
+
+
+def run(scenario, args):
+    names = [ "bench.group%d" % i for i in range(scenario["groups"]) ]
+    groups = synthetic_groups(names, scenario["articles"],
+                              scenario.get("size", 2000),
+                              scenario.get("gaps", 0.0),
+                              scenario.get("crossposts", 0.0))
+    home = tempfile.mkdtemp()
+    try:
+        with FakeNNTPServer(groups, scenario.get("latency", 0.0),
+                            bandwidth=scenario.get("bandwidth"),
+                            max_connections=scenario.get("max_connections")
+                            ) as server:
+            configdir = os.path.join(home, "config")
+            os.mkdir(configdir)
+            config = dict(server="127.0.0.1", port=server.port, ssl=False,
+                          outdir=os.path.join(home, "news"), groups=names,
+                          **scenario.get("options", {}))
+            os.mkdir(config["outdir"])
+            with open(os.path.join(configdir, "config.json"), "w") as f:
+                json.dump(config, f)
+            command = [ sys.executable, PROGRAM, "-c", configdir,
+                        "--engine", args.engine ]
+            env = dict(os.environ, HOME=home,
+                       PYTHONWARNINGS="ignore::DeprecationWarning")
+            for i in range(scenario.get("runs", 1)):
+                with server.lock:
+                    server.commands.clear()
+                    server.sent = server.round_trips = 0
+                start = time.perf_counter()
+                proc = subprocess.Popen(command, env=env,
+                                        stdout=subprocess.DEVNULL)
+                pid, status, usage = os.wait4(proc.pid, 0)
+                proc.returncode = os.waitstatus_to_exitcode(status)
+                elapsed = time.perf_counter() - start
+                if proc.returncode:
+                    raise RuntimeError("%s failed with status %d" %
+                                       (scenario["name"], proc.returncode))
+            return dict(articles=server.commands["ARTICLE"],
+                        seconds=elapsed, sent=server.sent,
+                        rss=usage.ru_maxrss * 1024,
+                        round_trips=server.round_trips,
+                        commands=sum(server.commands.values()))
+    finally:
+        shutil.rmtree(home)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--engine", choices=[ "nntplib", "asyncio" ],
+                        default="nntplib")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    print("%-18s %8s %8s %10s %8s %8s %8s %8s" %
+          ("scenario", "articles", "seconds", "articles/s", "MiB/s",
+           "RSS MiB", "trips", "commands"))
+    results = {}
+    for scenario in SCENARIOS:
+        r = results[scenario["name"]] = run(scenario, args)
+        print("%-18s %8d %8.2f %10.1f %8.2f %8.1f %8d %8d" %
+              (scenario["name"], r["articles"], r["seconds"],
+               r["articles"] / r["seconds"], r["sent"] / 2**20 / r["seconds"],
+               r["rss"] / 2**20, r["round_trips"], r["commands"]))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -35,8 +35,10 @@
 #```
 ##!/usr/bin/env python3
 #```
-#   \ti{news2mbox} is written to work on Python 3. No attempts are made to
-#   provide compabitility with Python 2.
+#   \ti{news2mbox} is written to work on Python 3.10 or newer, it uses
+#   \tc{contextlib.aclosing}, \tc{anext} and the \tc{key} argument of
+#   the \tc{bisect} functions, which were added in this version. No attempts
+#   are made to provide compabitility with Python 2.
 #```
 import argparse
 #```
@@ -56,7 +58,7 @@ import json
 #   side the user need not struggle with another configuration file format, as
 #   JSON is very prominent and widely known.
 #
-#   Besides that, only two other modules are used:
+#   Besides that, only a few other modules of the standard library are used:
 #```
 import os
 import sys
@@ -64,8 +66,54 @@ import time
 #```
 #   The \tc{os} and \tc{sys} module are needed for obvious reasons, the 
 #   \tc{time} module to format time stamps used in converting articles to the 
-#   \ti{mbox} format.\newline
+#   \ti{mbox} format.
 #
+#   Servers can be processed concurrently. For this purpose a thread pool from
+#   \tc{concurrent.futures} is used, output of the workers is collected in
+#   \tc{io} buffers and shared data is protected by \tc{threading} locks.
+#   Pipelined requests are kept in a \tc{collections.deque}, idle connections
+#   in a \tc{queue}. The status database provides a mapping of the
+#   \tc{collections.abc} module. The optional
+#   \ti{asyncio} engine is built on \tc{asyncio} streams, \tc{ssl} and
+#   \tc{netrc} are needed to set up its connections. The index of message IDs
+#   is stored in a \tc{sqlite3} database. Lines of articles that would be
+#   mistaken for \ti{mbox} header lines are found by a regular expression of
+#   the \tc{re} module. The indexes of mailboxes are binary files of
+#   \tc{struct} records with \tc{hashlib} digests of message IDs and dates
+#   parsed by \tc{email.utils}, they are searched with \tc{bisect} in files
+#   mapped to memory by \tc{mmap} and merged with \tc{heapq}. Connections
+#   are compressed with \tc{zlib}, mailboxes with \tc{zlib}, \tc{bz2} or
+#   \tc{lzma}. The daemon is stopped by the termination signals of the
+#   \tc{signal} module. Group patterns are matched with \tc{fnmatch}.
+#```
+import asyncio
+import bisect
+import bz2
+import collections
+import collections.abc
+import concurrent.futures
+import contextlib
+import email.utils
+import errno
+import fcntl
+import fnmatch
+import hashlib
+import heapq
+import io
+import itertools
+import lzma
+import mmap
+import netrc
+import queue
+import re
+import signal
+import socket
+import sqlite3
+import ssl
+import struct
+import threading
+import zlib
+#```
 #
 # \section{Configuration and status files}
 #
@@ -92,7 +140,16 @@ import time
 #  The function \tc{read\_config} parses those configuration files:
 #```
 def read_config(cfg):
-  keywords = [ 'server', 'user', 'password', 'groups', 'outdir', 'ssl' ]
+  keywords = [ 'server', 'port', 'user', 'password', 'groups', 'outdir', 'ssl',
+               'connections', 'window', 'checkpoint', 'cachedir',
+               'active_ttl', 'dedup', 'max_articles', 'backfill', 'batch',
+               'rate', 'bandwidth', 'preallocate', 'index', 'compress',
+               'compression', 'rotate', 'quiet', 'poll_min', 'poll_max',
+               'keepalive', 'filter', 'groups_ttl', 'format', 'retention',
+               'timeout', 'retries', 'backoff' ]
+  group_keywords = [ 'name', 'max_articles', 'backfill', 'batch',
+                     'compression', 'rotate', 'poll_min', 'poll_max',
+                     'filter', 'format', 'retention' ]
 #```
 #  The configuration for every server is stored in an object that can have the
 #  following keys and values:\newline
@@ -100,13 +157,88 @@ def read_config(cfg):
 #  \begin{tabularx}{\linewidth}{lX}
 #   Key & Value \\ \hline 
 #   server & The address of the NNTP server as string. This value is required. \\
+#   port & The port of the NNTP server. The default is 119. \\
 #   user & The user name for the NNTP login as string. \\
 #   password & The password for the NNTP login as string. \\
-#   groups & A list of strings of newsgroup names. This value is required. \\
+#   groups & A list of newsgroups. This value is required. A group is given
+#   by its name, a pattern as described in section \ref{sec:wildmat} or by
+#   an object with the name or pattern as value of the key \ti{name}
+#   and the keys \ti{max\_articles}, \ti{backfill}, \ti{batch},
+#   \ti{compression}, \ti{rotate}, \ti{poll\_min}, \ti{poll\_max},
+#   \ti{filter}, \ti{format} and \ti{retention}, which override the
+#   options of the server for this group. \\
 #   outdir & A directory in which the mbox files are written. If this value is
 #   not given, the directory defaults to \tc{\$HOME/news}. \\
 #   ssl & \ti{false} if no SSL connection to the NNTP server should be used.
 #   The default is \ti{true}. \\
+#   connections & The number of connections opened to the NNTP server to read
+#   several groups in parallel. The default is 1. \\
+#   window & The number of article requests sent to the server without
+#   waiting for the responses, see section \ref{sec:pipelining}. The default
+#   is 16. \\
+#   checkpoint & The number of articles after which the mailbox is synced to
+#   disk and the status is saved, see section \ref{sec:checkpoints}. The
+#   default is 100. \\
+#   cachedir & A directory in which cached data is stored. The default is the
+#   configuration directory. \\
+#   active\_ttl & The number of seconds the last article numbers of the
+#   groups are cached, see section \ref{sec:active}. The default is 0, which
+#   disables the cache. \\
+#   groups\_ttl & The number of seconds the groups matching the patterns in
+#   \ti{groups} are cached, see section \ref{sec:wildmat}. The default is
+#   86400. \\
+#   dedup & \ti{true} if articles already stored in a mailbox are copied
+#   instead of being downloaded again, see section \ref{sec:dedup}. The
+#   default is \ti{false}. \\
+#   max\_articles & The maximal number of articles read per group and run.
+#   The default is 200. \\
+#   backfill & \ti{true} if older articles are not skipped, but read in
+#   several runs of at most \ti{max\_articles} articles, see section
+#   \ref{sec:readgroup}. The default is \ti{false}. \\
+#   batch & The number of article numbers requested in one batch, after
+#   which the status is saved. The default is 1000. \\
+#   rate & The maximal number of articles per second read from the server,
+#   see section \ref{sec:ratelimits}. By default, there is no limit. \\
+#   bandwidth & The maximal number of bytes per second read from the server.
+#   By default, there is no limit. \\
+#   preallocate & The number of bytes reserved on disk at once for the
+#   mailboxes, see section \ref{sec:mboxwriter}. The default is 0, which
+#   disables preallocation. \\
+#   index & \ti{true} if an index of every mailbox is maintained, see
+#   section \ref{sec:mboxindex}. The default is \ti{false}. \\
+#   compress & \ti{true} if the connection is compressed, if the server
+#   supports it, see section \ref{sec:compress}. The default is \ti{false}. \\
+#   compression & The compression of the mailboxes, \ti{gzip}, \ti{bz2} or
+#   \ti{xz}, see section \ref{sec:rotate}. By default, mailboxes are not
+#   compressed. \\
+#   rotate & \ti{month} if a new mailbox is started every month, or the size
+#   in bytes at which a new mailbox is started. By default, mailboxes are not
+#   rotated. \\
+#   format & \ti{maildir} if the articles are written to a Maildir instead
+#   of a mailbox, see section \ref{sec:maildir}. The default is
+#   \ti{mbox}. \\
+#   retention & The limits of the mailboxes applied by the command
+#   \ti{compact}, see section \ref{sec:compact}. By default, mailboxes are
+#   not compacted. \\
+#   quiet & \ti{true} if no status line is printed for every article. The
+#   default is \ti{false}, the argument \tc{--quiet} sets it for all
+#   servers. \\
+#   poll\_min & The shortest interval in seconds at which a group is polled
+#   in daemon mode, see section \ref{sec:daemon}. The default is 60. \\
+#   poll\_max & The longest interval in seconds at which a group is polled
+#   in daemon mode. The default is 3600. \\
+#   keepalive & The number of seconds after which an idle connection is
+#   kept alive in daemon mode. The default is 120. \\
+#   filter & Rules rejecting articles before they are downloaded, see
+#   section \ref{sec:killfile}. By default, no article is rejected. \\
+#   timeout & The number of seconds to wait for the server to accept a
+#   connection or to respond, see section \ref{sec:reconnect}. The default
+#   is 60. \\
+#   retries & The number of times a failed connection is opened again
+#   before the server is given up. The default is 5. \\
+#   backoff & The number of seconds to wait before the connection is opened
+#   again for the first time, the delay is doubled with every further
+#   attempt. The default is 1. \\
 #  \end{tabularx}\newline
 #
 #  First the file is parsed into a JSON data structure:
@@ -144,37 +276,167 @@ def read_config(cfg):
     if not 'groups' in s:
       raise SyntaxError('"groups" missing in configuration %s' % s)
 #```
-#   \item The value for \ti{groups} must be a list of strings. The value of
-#   \ti{ssl} must be a boolean.
+#   \item The value for \ti{groups} must be a list. Each group is either
+#   given by its name or by an object with the name as value of the key
+#   \ti{name} and options for this group only.
 #```
     for key, value in s.items():
       if key == 'groups':
         if not isinstance(value, list):
           raise SyntaxError(
             '"groups" must be a list, but is %s' % value)
+        for group in value:
+          if isinstance(group, dict):
+            if not isinstance(group.get('name'), str):
+              raise SyntaxError('"name" missing in group %s' % group)
+            for k, v in group.items():
+              check_option(k, v, group_keywords, cfg)
+          elif not isinstance(group, str):
+            raise SyntaxError(
+              'A group must be a str or an object, but is %s' % group)
+#```
+#   \item All other values must be valid options as checked by the function
+#   \tc{check\_option} below.
+#```
+      else:
+        check_option(key, value, keywords, cfg)
+#```
+#  \end{enumerate}
+#
+#  Finally the list of valid server configurations is returned:
+#```
+  return servers
 
-      elif key == 'ssl':
-        if not isinstance(value, bool):
-          raise SyntaxError(
-            '"ssl" must be a bool, but is %s' % value)
 #```
-#   \item All other values must be strings.
+#  The function \tc{check\_option} checks the value of an option given by
+#  \tc{key}, which must be one of the \tc{keywords}:
+#
+#  \begin{enumerate}
+#   \item The values of \ti{ssl}, \ti{dedup}, \ti{backfill}, \ti{index},
+#   \ti{compress} and \ti{quiet} must be booleans. The values of
+#   \ti{connections}, \ti{window}, \ti{checkpoint}, \ti{max\_articles} and
+#   \ti{batch} must be positive integers, the value of \ti{port} must be a
+#   valid port number. The values of \ti{preallocate} and \ti{retries}
+#   must be non-negative integers, the values of \ti{active\_ttl} and
+#   \ti{groups\_ttl} non-negative numbers and the values of \ti{rate},
+#   \ti{bandwidth}, \ti{poll\_min}, \ti{poll\_max}, \ti{keepalive},
+#   \ti{timeout} and \ti{backoff} positive numbers. The
+#   value of \ti{compression} must be the name of a codec, the value of
+#   \ti{rotate} either \ti{month} or a positive integer, the value of
+#   \ti{format} either \ti{mbox} or \ti{maildir}. The value of
+#   \ti{filter} must be an object with the keys described in section
+#   \ref{sec:killfile}, the values of which must be valid regular expressions
+#   or positive integers. The value of \ti{retention} must be an object with
+#   the keys described in section \ref{sec:compact}, the values of which
+#   must be positive numbers.
 #```
-      elif key in keywords:
-        if not isinstance(value, str):
+def check_option(key, value, keywords, cfg):
+  if key not in keywords:
+    raise SyntaxError('Unknown key "%s" in %s' % (key, cfg))
+
+  elif key in ('ssl', 'dedup', 'backfill', 'index', 'compress', 'quiet'):
+    if not isinstance(value, bool):
+      raise SyntaxError(
+        '"%s" must be a bool, but is %s' % (key, value))
+
+  elif key in ('connections', 'window', 'checkpoint', 'max_articles',
+               'batch'):
+    if not isinstance(value, int) or isinstance(value, bool) \
+        or value < 1:
+      raise SyntaxError(
+        '"%s" must be a positive int, but is %s' % (key, value))
+
+  elif key in ('preallocate', 'retries'):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+      raise SyntaxError(
+        '"%s" must be a non-negative int, but is %s' % (key, value))
+
+  elif key in ('active_ttl', 'groups_ttl'):
+    if not isinstance(value, (int, float)) or isinstance(value, bool) \
+        or value < 0:
+      raise SyntaxError(
+        '"%s" must be a non-negative number, but is %s' % (key, value))
+
+  elif key in ('rate', 'bandwidth', 'poll_min', 'poll_max', 'keepalive',
+               'timeout', 'backoff'):
+    if not isinstance(value, (int, float)) or isinstance(value, bool) \
+        or value <= 0:
+      raise SyntaxError(
+        '"%s" must be a positive number, but is %s' % (key, value))
+
+  elif key == 'compression':
+    if value not in COMPRESSIONS:
+      raise SyntaxError(
+        '"compression" must be one of %s, but is %s' %
+        (', '.join(sorted(COMPRESSIONS)), value))
+
+  elif key == 'format':
+    if value not in FORMATS:
+      raise SyntaxError(
+        '"format" must be one of %s, but is %s' %
+        (', '.join(FORMATS), value))
+
+  elif key == 'rotate':
+    if value != 'month' and (not isinstance(value, int)
+        or isinstance(value, bool) or value < 1):
+      raise SyntaxError(
+        '"rotate" must be "month" or a positive int, but is %s' % value)
+
+  elif key == 'filter':
+    if not isinstance(value, dict):
+      raise SyntaxError('"filter" must be an object, but is %s' % value)
+    for k, v in value.items():
+      if k not in FILTER_KEYS:
+        raise SyntaxError('Unknown key "%s" in filter %s' % (k, value))
+      if k.startswith('max_'):
+        if not isinstance(v, int) or isinstance(v, bool) or v < 1:
           raise SyntaxError(
-            '"%s" must be a str, but is %s' % (key, value))
+            '"%s" must be a positive int, but is %s' % (k, v))
+      else:
+        try:
+          re.compile(v)
+        except (TypeError, re.error) as e:
+          raise SyntaxError('"%s" must be a regular expression: %s' % (k, e))
+
+  elif key == 'retention':
+    if not isinstance(value, dict):
+      raise SyntaxError('"retention" must be an object, but is %s' % value)
+    for k, v in value.items():
+      if k not in RETENTION_KEYS:
+        raise SyntaxError('Unknown key "%s" in retention %s' % (k, value))
+      if not isinstance(v, (int, float)) or isinstance(v, bool) or v <= 0 \
+          or (k != 'max_age' and not isinstance(v, int)):
+        raise SyntaxError(
+          '"%s" must be a positive number, but is %s' % (k, v))
+
+  elif key == 'port':
+    if not isinstance(value, int) or isinstance(value, bool) \
+        or not 0 < value < 65536:
+      raise SyntaxError(
+        '"port" must be a port number, but is %s' % value)
 #```
-#   \item The object must not contain unknown keywords.
+#   \item All other values must be strings.
 #```
-      else:
-        raise SyntaxError('Unknown key "%s" in %s' % (key, cfg))
+  elif not isinstance(value, str):
+    raise SyntaxError(
+      '"%s" must be a str, but is %s' % (key, value))
 #```
 #  \end{enumerate}
 #
-#  Finally the list of valid server configurations is returned:
+#  The names of the groups of a server configuration are returned by the
+#  function \tc{group\_names}. The function \tc{group\_config} returns the
+#  configuration for a group, with the options given for this group
+#  overriding those of the server.
 #```
-  return servers
+def group_names(config):
+  return [ g['name'] if isinstance(g, dict) else g for g in config['groups'] ]
+
+def group_config(config, g):
+  for group in config.get('groups', ()):
+    if isinstance(group, dict) and group['name'] == g:
+      options = { k : v for k, v in group.items() if k != 'name' }
+      return dict(config, **options)
+  return config
 
 #```
 #  \section{Status file - \tc{status.json}}
@@ -202,8 +464,10 @@ def read_config(cfg):
 #```
 def read_status(statusfile):
 #```
-#  The file is opened and its JSON content is parsed.
+#  The file is opened and its JSON content is parsed. The time this takes
+#  is recorded in the run metrics, see section \ref{sec:stats}.
 #```
+  start = time.perf_counter()
   try:
     with open(statusfile, 'r') as f:
       status = json.load(f)
@@ -225,17 +489,297 @@ def read_status(statusfile):
 #```
   except:
     status = {}
+  finally:
+    stats.add(status_read_seconds=time.perf_counter() - start)
 
   return status
 
 #```
 #  Writing the status file is very straight forward. As the status data is
 #  handled internally its integrity can be assumed. So the status data simply
-#  needs to be dumped as serialized JSON data into the file:
+#  needs to be dumped as serialized JSON data into the file. The keys are
+#  sorted, so the file does not depend on the order in which concurrently
+#  processed groups were finished.\newline
+#
+#  The status file must never be left in a corrupt state, not even when the
+#  program is killed while writing it, as this would lead to all articles
+#  being fetched again. So the data is first written to a temporary file in
+#  the same directory, which is synchronized to disk and then atomically
+#  renamed to the status file. Finally the directory is synchronized, so that
+#  the rename itself is durable.
+#
+#  To make sure data is durably written to disk, files are flushed and
+#  synchronized with the function \tc{sync\_file}:
+#```
+def sync_file(f):
+  f.flush()
+  os.fsync(f.fileno())
+#```
+#  The function \tc{write\_text} writes a text atomically to a file, the
+#  function \tc{write\_json} writes data atomically to a JSON file. They are
+#  also used for other files of \ti{news2mbox}:
+#```
+def write_text(path, text):
+  tmpfile = path + '.tmp'
+  with open(tmpfile, 'w') as f:
+    f.write(text)
+    sync_file(f)
+  os.replace(tmpfile, path)
+  sync_dir(path)
+
+def write_json(path, data):
+  tmpfile = path + '.tmp'
+  with open(tmpfile, 'w') as f:
+    json.dump(data, f, sort_keys=True)
+    sync_file(f)
+  os.replace(tmpfile, path)
+  sync_dir(path)
 #```
+#  The function \tc{sync\_dir} synchronizes the directory containing the
+#  file \tc{path}, so that the creation or renaming of the file is durable.
+#```
+def sync_dir(path):
+  fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
 def write_status(statusfile, status):
-  with open(statusfile, 'w') as f:
-    json.dump(status, f)
+  with stats.timer('status_write_seconds'):
+    write_json(statusfile, status)
+  stats.add(status_writes=1)
+#```
+#  \subsection{Checkpoints}
+#  \label{sec:checkpoints}
+#
+#  Writing the status only at the end of a run would lose the progress of a
+#  run that is killed. Therefore the status is saved at checkpoints while
+#  articles are read. The function \tc{make\_checkpoint} returns a function
+#  that writes the \tc{status} dictionary to the file \tc{statusfile}. It may
+#  be called from several threads at once, the calls are serialized by a
+#  lock. As other threads might add entries to the dictionary while it is
+#  written, a copy of the dictionary is written.
+#
+#  Several processes may share the status file, for instance overlapping
+#  runs or the shards described in section \ref{sec:shards}. Writing the
+#  whole dictionary would undo the updates of the other processes since it
+#  was read. Therefore only the entries changed since the last checkpoint,
+#  as found by a comparison with the dictionary \tc{saved}, are merged into
+#  the current content of the file. The file is locked while it is read and
+#  written by an exclusive lock on the file with the suffix \ti{.lock}.
+#
+#  Conversely, the entries changed by other processes are taken into the
+#  dictionary, unless they were changed here as well, so that a group read
+#  by another process in the meantime is not read again. An entry set while
+#  the file was written is kept.
+#```
+def make_checkpoint(statusfile, status):
+  lock = threading.Lock()
+  saved = dict(status)
+
+  def checkpoint():
+    with lock:
+      current = dict(status)
+      with file_lock(statusfile + '.lock'):
+        merged = dict(saved)
+        merged.update(read_status(statusfile))
+        merged.update((g, n) for g, n in current.items()
+                      if saved.get(g) != n)
+        write_status(statusfile, merged)
+      for g, n in merged.items():
+        if current.get(g) == saved.get(g) != n and \
+            status.get(g) == current.get(g):
+          status[g] = n
+      saved.clear()
+      saved.update(merged)
+
+  return checkpoint
+#```
+#  The function \tc{file\_lock} takes an exclusive advisory lock on the file
+#  \tc{path}, which is created if it does not exist. Unless \tc{blocking}
+#  is set, \tc{None} is returned instead of waiting if the lock is held by
+#  another process, otherwise the file descriptor. The lock is released when
+#  the file is closed.
+#```
+@contextlib.contextmanager
+def file_lock(path, blocking=True):
+  fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+  try:
+    try:
+      fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+      yield None
+    else:
+      yield fd
+  finally:
+    os.close(fd)
+#```
+#  \subsection{The status database}
+#  \label{sec:statusdb}
+#
+#  With thousands of groups, rewriting the whole status file at every
+#  checkpoint is wasteful. Moreover, the status file is keyed by the group
+#  name only, so a group read from two servers has one entry for both. With
+#  the argument \tc{--status-db}, the status is kept in the \ti{SQLite}
+#  database \tc{status.db} in the configuration directory instead. Its table
+#  \tc{status} holds the last article number of every group of every server
+#  and the time of the last successful fetch of the group, also if it had no
+#  new articles. Servers are named by their address and port as in section
+#  \ref{sec:stats}. The metrics of section \ref{sec:stats} are not stored
+#  in the database, as reading articles needs none of them. They are
+#  written for every run with the arguments \tc{--stats-json} and
+#  \tc{--prometheus} instead.
+#
+#  The database is used in the \ti{WAL} mode, in which readers don't block
+#  the writer, and several processes may use it at once, each waiting up to
+#  a minute for the others to finish writing. The class \tc{StatusDB} shares
+#  one connection between all threads, which is protected by a lock. When
+#  the database is created, the status file is migrated into it, which is
+#  noted in the table \tc{meta}: the entry of a group in the status file is
+#  taken for the group on every server configured to read it, also if the
+#  group is given by a pattern as described in section \ref{sec:wildmat}.
+#```
+class StatusDB:
+
+  def __init__(self, path, statusfile=None, configs=()):
+    self.db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                              check_same_thread=False)
+    self.lock = threading.Lock()
+    self.pending = {}
+    self.db.execute('PRAGMA journal_mode = WAL')
+    self.db.execute('PRAGMA synchronous = FULL')
+    self.db.execute('CREATE TABLE IF NOT EXISTS status ('
+                    'server TEXT, grp TEXT, last INTEGER NOT NULL, '
+                    'updated REAL NOT NULL, PRIMARY KEY (server, grp)) '
+                    'WITHOUT ROWID')
+    self.db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                    'key TEXT PRIMARY KEY, value TEXT)')
+    if statusfile:
+      self.migrate(statusfile, configs)
+
+  def migrate(self, statusfile, configs):
+    with self.transaction():
+      if self.db.execute("SELECT 1 FROM meta WHERE key = 'migrated'") \
+          .fetchone():
+        return
+      old = read_status(statusfile)
+      now = time.time()
+      for config in configs:
+        groups = match_groups(config['groups'], old)
+        self.db.executemany(
+          'INSERT OR IGNORE INTO status VALUES (?, ?, ?, ?)',
+          [ (server_name(config), g, old[g], now)
+            for g in group_names(dict(config, groups=groups)) if g in old ])
+      self.db.execute("INSERT INTO meta VALUES ('migrated', ?)",
+                      (statusfile,))
+#```
+#  Writes are done in transactions started with \ti{BEGIN IMMEDIATE}, which
+#  take the write lock of the database at once, so that concurrent
+#  processes wait for each other instead of failing when they commit.
+#```
+  @contextlib.contextmanager
+  def transaction(self):
+    self.db.execute('BEGIN IMMEDIATE')
+    try:
+      yield
+    except BaseException:
+      self.db.execute('ROLLBACK')
+      raise
+    self.db.execute('COMMIT')
+#```
+#  The status of a group is changed in memory first, the dictionary
+#  \tc{pending} holds the changed entries, \tc{None} for a deleted entry.
+#  The method \tc{checkpoint}, which is used as checkpoint function, writes
+#  only the changed entries in a single transaction. Reading an entry that
+#  was not changed queries the database.
+#```
+  def get(self, server, g):
+    with self.lock:
+      if (server, g) in self.pending:
+        return self.pending[server, g]
+      row = self.db.execute(
+        'SELECT last FROM status WHERE server = ? AND grp = ?',
+        (server, g)).fetchone()
+    return row[0] if row else None
+
+  def set(self, server, g, last):
+    with self.lock:
+      self.pending[server, g] = last
+
+  def groups(self, server):
+    with self.lock:
+      groups = { g for g, in self.db.execute(
+        'SELECT grp FROM status WHERE server = ?', (server,)) }
+      for (s, g), last in self.pending.items():
+        if s == server:
+          if last is None:
+            groups.discard(g)
+          else:
+            groups.add(g)
+    return sorted(groups)
+
+  def checkpoint(self):
+    with stats.timer('status_write_seconds'), self.lock:
+      if not self.pending:
+        return
+      now = time.time()
+      with self.transaction():
+        for (server, g), last in self.pending.items():
+          if last is None:
+            self.db.execute('DELETE FROM status WHERE server = ? AND grp = ?',
+                            (server, g))
+          else:
+            self.db.execute(
+              'INSERT INTO status VALUES (?, ?, ?, ?) '
+              'ON CONFLICT (server, grp) DO UPDATE '
+              'SET last = excluded.last, updated = excluded.updated',
+              (server, g, last, now))
+      self.pending.clear()
+    stats.add(status_writes=1)
+
+  def close(self):
+    self.checkpoint()
+    self.db.close()
+#```
+#  The functions reading articles use the status of a server like a
+#  dictionary keyed by group. The method \tc{server} returns such a
+#  dictionary-like view for the server of a configuration, the function
+#  \tc{server\_status} returns the status to be used for a configuration,
+#  which is the status dictionary itself if no database is used.
+#```
+  def server(self, config):
+    return ServerStatus(self, server_name(config))
+
+class ServerStatus(collections.abc.MutableMapping):
+
+  def __init__(self, db, server):
+    self.db = db
+    self.server = server
+
+  def __getitem__(self, g):
+    last = self.db.get(self.server, g)
+    if last is None:
+      raise KeyError(g)
+    return last
+
+  def __setitem__(self, g, last):
+    self.db.set(self.server, g, last)
+
+  def __delitem__(self, g):
+    self[g]
+    self.db.set(self.server, g, None)
+
+  def __iter__(self):
+    return iter(self.db.groups(self.server))
+
+  def __len__(self):
+    return len(self.db.groups(self.server))
+
+def server_status(status, config):
+  if isinstance(status, StatusDB):
+    return status.server(config)
+  return status
 #```
 #  \section{Conversion to the mbox format}
 #
@@ -251,219 +795,3341 @@ def make_mbox_header(message_id):
     message_id.strip('<>'), 
     time.strftime('%a %b %e %H:%M:%S %Z %Y'))).encode()
 #```
-#  \section{Reading articles from the server}
-#  \label{sec:readarticles}
+#  \subsection{Writing mailboxes}
+#  \label{sec:mboxwriter}
 #
-#  The core task of \ti{news2mbox} is reading messges from the NNTP servers and
-#  writing those message into local mailboxes. These functionality is
-#  encapsulated in the function \tc{read\_articles}. The function gets the
-#  argument \tc{config} which is a dictionary obtained from the configuration 
-#  file \tc{config.json} and holds information about a server with connection
-#  information and a list of news groups. The \tc{status} argument is a
-#  dictionary obtained from the file \tc{status.json} holding information to
-#  identify the last article read for each news group.
+#  Lines of an article body starting with \ti{``From ''} would be taken for
+#  the header line of a new message by mail readers. Such lines are quoted
+#  with a \ti{``>''} as in the \ti{mboxrd} format: a \ti{``>''} is prepended
+#  to every line starting with any number of \ti{``>''} followed by
+#  \ti{``From ''}, so the quoting can be reversed. The quoting is done by a
+#  single substitution of a regular expression on the whole article, which
+#  is joined into a single buffer by the function \tc{quote\_article}.
 #```
-def read_articles(config, status):
+FROM_LINE = re.compile(rb'^(>*From )', re.MULTILINE)
+
+def quote_article(lines):
+  data = b'\n'.join(lines)
+  data += b'\n'
+  if b'From ' in data:
+    data = FROM_LINE.sub(rb'>\1', data)
+  return data
 #```
-#  The algorithm works in five steps:
-#  \begin{enumerate}
-#  \item \ti{The connection to the NNTP is established.} The server address,
-#  username and password are taken from the \tc{config} dictionary. Username
-#  and password are optional and can therefore be \tc{None}. Depending on the 
-#  configuration an SSL connection is established.
+#  Mailboxes are written by an \tc{MboxWriter}. An article is joined to a
+#  single buffer and written together with its header line by one
+#  \tc{os.writev} system call, there is no need for a write buffer. The
+#  method \tc{write} writes an article given by its lines, the method
+#  \tc{copy} an article that was already quoted, as read from a mailbox, and
+#  the method \tc{duplicate} the article at a location recorded by the
+#  message ID index described in section \ref{sec:dedup}. All of them
+#  return the offset and length of the article in the mailbox. With
+#  \tc{index}, the article and its \tc{number} are recorded in the index of
+#  the mailbox described in section \ref{sec:mboxindex}.
+#
+#  With \tc{preallocate}, disk space is reserved in chunks of this number of
+#  bytes by \tc{os.posix\_fallocate}, which avoids fragmentation of large
+#  mailboxes. As this extends the file, the articles are written to the end
+#  of the data instead of being appended, and the file is truncated to the
+#  data when it is closed. A run that is killed leaves the reserved space
+#  filled with null bytes at the end of the file, they are removed when the
+#  file is opened again. Platforms without \tc{os.posix\_fallocate} don't
+#  preallocate.
 #```
-  with nntplib.NNTP(config['server']) as s:
-    if config['ssl']:
-      s.starttls()
-    s.login(user=config.get('user'), password=config.get('password'))
+class MboxWriter:
+
+  def __init__(self, name, preallocate=0, index=False):
+    self.name = name
+    if not hasattr(os, 'posix_fallocate'):
+      preallocate = 0
+    self.preallocate = preallocate
+    if preallocate:
+      self.fd = os.open(name, os.O_RDWR | os.O_CREAT, 0o666)
+      self.end = self.reserved = self.trim()
+    else:
+      self.fd = os.open(name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+      self.end = os.lseek(self.fd, 0, os.SEEK_END)
+    self.index = None
+    if index:
+      try:
+        self.index = IndexWriter(name, self.end)
+      except BaseException:
+        os.close(self.fd)
+        raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
 
+  def trim(self):
+    end = os.lseek(self.fd, 0, os.SEEK_END)
+    size = end
+    while end:
+      start = max(0, end - 2**16)
+      data = os.pread(self.fd, end - start, start).rstrip(b'\0')
+      if data:
+        end = start + len(data)
+        break
+      end = start
+    if end < size:
+      os.ftruncate(self.fd, end)
+    return end
+
+  def write(self, message_id, lines, number=0):
+    return self.copy(message_id, quote_article(lines), number)
+
+  def copy(self, message_id, data, number=0):
+    header = make_mbox_header(message_id) + b'\n'
+    self.writev([ header, data ])
+    offset = self.end - len(data)
+    if self.index is not None:
+      self.index.add(message_id, number, offset, data)
+    return offset, len(data)
+
+  def duplicate(self, message_id, location, number=0):
+    return self.copy(message_id, read_location(location), number)
 #```
-#  The following steps are done for each news group configured.
+#  The method \tc{writev} writes a list of buffers at the end of the data,
+#  system calls writing only a part of the buffers are repeated for the
+#  rest.
 #```
-    for g in config['groups']:
+  def writev(self, buffers):
+    size = sum(len(b) for b in buffers)
+    if self.preallocate and self.end + size > self.reserved:
+      length = max(size, self.preallocate)
+      os.posix_fallocate(self.fd, self.end, length)
+      self.reserved = self.end + length
+    while buffers:
+      if self.preallocate:
+        n = os.pwritev(self.fd, buffers, self.end)
+      else:
+        n = os.writev(self.fd, buffers)
+      self.end += n
+      while buffers and n >= len(buffers[0]):
+        n -= len(buffers.pop(0))
+      if n:
+        buffers[0] = memoryview(buffers[0])[n:]
 #```
-#  \item \ti{The range of article numbers to be read is determined.} For this 
-#  purpose, the last available article number is obtained from the server.
+#  Writes are not buffered, so there is nothing to flush but the index. With
+#  the methods \tc{flush} and \tc{fileno} the mailbox can be synchronized to
+#  disk by \tc{sync\_file} like a file object, which is done by the method
+#  \tc{sync}.
 #```
-      resp, count, first, last, name = s.group(g)
-      last = int(last)
+  def flush(self):
+    if self.index is not None:
+      self.index.flush()
+
+  def fileno(self):
+    return self.fd
+
+  def sync(self):
+    sync_file(self)
+
+  def close(self):
+    if self.fd < 0:
+      return
+    try:
+      if self.preallocate:
+        os.ftruncate(self.fd, self.end)
+      if self.index is not None:
+        self.index.close()
+    finally:
+      os.close(self.fd)
+      self.fd = -1
 #```
-#  The number of the first article to be read is set to the number of the last 
-#  article for this news group. This information is obtained from the status
-#  dictionary. The number is set to 0 if no status information is available for
-#  this group. As a hard coded limit, at most 200 articles can be read, so the 
-#  upper limit for the number of the first article is \ti{last - 200}. One is
-#  added to obtain the number of the first unread articles. This turns the
-#  default 0 into 1, as by the standard article numbers start with 1.
+#  \subsection{Indexes of mailboxes}
+#  \label{sec:mboxindex}
+#
+#  To find a single message, a mailbox would have to be read from the
+#  start. With the configuration key \ti{index}, an index of every mailbox
+#  is maintained in a file with the suffix \ti{.idx} next to it. It starts
+#  with the eight bytes of \tc{INDEX\_MAGIC}, followed by a record of fixed
+#  size for every message, in the order of the messages in the mailbox: the
+#  SHA-1 digest of the message ID, the article number, the offset and length
+#  of the article in the mailbox and the date of the article in seconds
+#  since the epoch.
+#
+#  Messages are appended in the order of their article numbers, so a record
+#  is found by its number with a binary search. To find a record by its
+#  message ID, a second file with the suffix \ti{.ids} holds pairs of the
+#  digest and the position of the record, sorted by the digest. Its header
+#  contains the number of records covered by the file, records appended
+#  later are searched linearly.
 #```
-      first = max(status.get(g, 0), last-200) + 1
+INDEX_MAGIC = b'N2MBIDX1'
+INDEX_RECORD = struct.Struct('<20sQQIq')
+IDS_HEADER = struct.Struct('<8sQ')
+IDS_MAGIC = b'N2MBIDS1'
+IDS_RECORD = struct.Struct('<20sI')
+
+def message_key(message_id):
+  if isinstance(message_id, str):
+    message_id = message_id.encode('utf-8', 'surrogateescape')
+  return hashlib.sha1(message_id.strip()).digest()
 #```
-#   Calculating the number of all articles that will be read is trivial. This
-#   number is used to print status information.
+#  The function \tc{index\_record} returns the record of an article, which
+#  is given by the bytes of its \tc{header}. Missing message IDs are taken
+#  from the header, missing article numbers from the \ti{Xref} header for
+#  the \tc{group}, as it is the case for mailboxes that are indexed
+#  afterwards. Values that are not found are set to 0.
 #```
-      no_articles = last - first + 1
+INDEX_HEADER = re.compile(rb'^(Message-ID|Date|Xref):[ \t]*(.*?)[ \t\r]*$',
+                          re.MULTILINE | re.IGNORECASE)
+
+def index_record(header, offset, length, message_id=None, number=None,
+                 group=None):
+  fields = {}
+  for m in INDEX_HEADER.finditer(header):
+    fields.setdefault(m.group(1).lower(), m.group(2))
+  if message_id is None:
+    message_id = fields.get(b'message-id', b'')
+  if number is None:
+    number = 0
+    for xref in fields.get(b'xref', b'').split()[1:]:
+      name, sep, n = xref.rpartition(b':')
+      if name.decode('utf-8', 'replace') == group and n.isdigit():
+        number = int(n)
+  try:
+    date = int(email.utils.parsedate_to_datetime(
+      fields[b'date'].decode('latin-1')).timestamp())
+  except (KeyError, TypeError, ValueError, IndexError, OverflowError):
+    date = 0
+  return INDEX_RECORD.pack(message_key(message_id), number, offset, length,
+                           date)
 #```
-#  The status information printed is modeled after the output of the famous
-#  \ti{fetchmail} utility.
+#  The function \tc{scan\_mbox} yields the records of the messages of a
+#  mailbox starting between the offsets \tc{start} and \tc{end}. The mailbox
+#  is read line by line, only the header of the current message is held in
+#  memory. As lines starting with \ti{``From ''} are quoted, every such line
+#  starts a new message. The article numbers are taken from the \ti{Xref}
+#  headers for the group of the mailbox, whose name is the name of the file
+#  without the suffix of a rotated mailbox described in section
+#  \ref{sec:rotate}, for instance \ti{comp.lang.c} for
+#  \ti{comp.lang.c.2026-10.mbox} or \ti{comp.lang.c.0002.mbox}.
 #```
-      if no_articles:
-        print('%d articles for %s at %s.' % 
-          (no_articles, g, config['server']))
-      else:
-        print('%s: No new articles for %s at %s' % 
-          (PROGRAM, g, config['server']))
+ROTATED_SUFFIX = re.compile(r'\.(\d{4}-\d{2}|\d{4,})\.mbox$')
 
+def scan_mbox(name, start, end):
+  group = ROTATED_SUFFIX.sub('', os.path.basename(name))
+  header = offset = None
+  pos = start
+  with open(name, 'rb') as f:
+    f.seek(start)
+    for line in f:
+      if pos >= end:
+        break
+      if line.startswith(b'From '):
+        if offset is not None:
+          yield index_record(b''.join(header), offset, pos - offset,
+                             group=group)
+        header = []
+        offset = pos + len(line)
+      elif header is not None and header[-1:] != [ b'\n' ]:
+        header.append(line)
+      pos += len(line)
+  if offset is not None:
+    yield index_record(b''.join(header), offset, min(pos, end) - offset,
+                       group=group)
 #```
-#  \item \ti{Articles are read from the server.} The articles are stored line
-#  wise in a list of lines.
+#  An index is written by an \tc{IndexWriter}, which is used by the
+#  \tc{MboxWriter}. When it is opened, it makes sure that the index matches
+#  the mailbox, which ends at the offset \tc{end}: records of messages that
+#  were not completely written to the mailbox by a killed run are removed,
+#  messages of the mailbox that are missing in the index are added by
+#  scanning the mailbox. This way, an index is built from scratch for
+#  mailboxes that had no index before.
 #```
-      lines = []
+class IndexWriter:
+
+  def __init__(self, mbox, end):
+    self.mbox = mbox
+    self.f = open(mbox + '.idx', 'ab+')
+    size = self.f.seek(0, os.SEEK_END)
+    self.f.seek(0)
+    if size < len(INDEX_MAGIC) or \
+        self.f.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+      self.f.truncate(0)
+      self.f.write(INDEX_MAGIC)
+      size = len(INDEX_MAGIC)
+    self.count = (size - len(INDEX_MAGIC)) // INDEX_RECORD.size
+    indexed = 0
+    while self.count:
+      self.f.seek(len(INDEX_MAGIC) + (self.count - 1) * INDEX_RECORD.size)
+      key, number, offset, length, date = \
+        INDEX_RECORD.unpack(self.f.read(INDEX_RECORD.size))
+      if offset + length <= end:
+        indexed = offset + length
+        break
+      self.count -= 1
+    self.f.truncate(len(INDEX_MAGIC) + self.count * INDEX_RECORD.size)
+    self.buffer = bytearray()
+    for record in scan_mbox(mbox, indexed, end):
+      self.append(record)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
 #```
-#  The main loop reading articles loops over two values: \tc{relnum} denotes
-#  the relative number of the article, starting with 1, \tc{absnum} denots the
-#  article number as known to the server, from \tc{first} to \tc{last}.
+#  Records are collected in a buffer, which is written by the method
+#  \tc{flush}. The \tc{MboxWriter} flushes the index whenever the mailbox is
+#  synchronized to disk. The index itself is not synchronized, as it can be
+#  restored from the mailbox.
 #```
-      for relnum, absnum in enumerate(range(first, last + 1), 1):
+  def append(self, record):
+    self.buffer += record
+    self.count += 1
+    if len(self.buffer) >= 2**16:
+      self.flush()
+
+  def add(self, message_id, number, offset, data):
+    end = data.find(b'\n\n')
+    self.append(index_record(data[:end] if end >= 0 else data, offset,
+                             len(data), message_id, number))
+
+  def flush(self):
+    self.f.write(self.buffer)
+    self.f.flush()
+    del self.buffer[:]
 #```
-#  It is then tried to read a article from the server. If this fails, the
-#  status information line is ended with the string \ti{not found} and the next
-#  article number is processed.
+#  When the index is closed, the new records are merged into the file of
+#  message IDs by the function \tc{merge\_index}.
 #```
-        print('reading article %s: %d of %d ' % 
-          (g, relnum, no_articles), end='')
-        try:
-            resp, info = s.article(absnum)
-        except nntplib.NNTPError:
-            print('not found.')
-            continue
+  def close(self):
+    if self.f.closed:
+      return
+    try:
+      self.flush()
+    finally:
+      self.f.close()
+    merge_index(self.mbox)
 #```
-#  If a article is read, first a header for this article is appended to the
-#  list of lines. Then the lines of the article are stored as is and the status
-#  line is ended with the string \ti{flushed}.
-#
-#  Here it is to be noted that all article lines obtained via the NNTP server
-#  are handled as byte sequences and are never decoded.
+#  Indexes are read by an \tc{MboxIndex}, which maps the mailbox and its
+#  index files into memory with \tc{mmap}. The method \tc{get} returns the
+#  article with the given number or message ID, with the quoting of lines
+#  starting with \ti{``From ''} reversed, or \tc{None} if there is no such
+#  article. Only the pages of the files holding the records visited by the
+#  binary search and the article itself are read.
 #```
-        lines.append(make_mbox_header(info.message_id))
-        lines.extend(info.lines)
-        print('flushed')
+FROM_QUOTED = re.compile(rb'^>(>*From )', re.MULTILINE)
+
+class MboxIndex:
+
+  def __init__(self, mbox):
+    self.files = []
+    try:
+      self.mbox = self.map(mbox)
+      self.idx = self.map(mbox + '.idx')
+      if self.idx[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+        raise ValueError('%s.idx is not an index' % mbox)
+      self.count = (len(self.idx) - len(INDEX_MAGIC)) // INDEX_RECORD.size
+      try:
+        self.ids = self.map(mbox + '.ids')
+        magic, self.covered = IDS_HEADER.unpack_from(self.ids)
+      except (FileNotFoundError, struct.error):
+        self.ids, magic = b'', None
+      if magic != IDS_MAGIC or self.covered > self.count:
+        self.ids, self.covered = b'', 0
+      self.entries = max(0, len(self.ids) - IDS_HEADER.size) // \
+        IDS_RECORD.size
+    except BaseException:
+      self.close()
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def map(self, name):
+    f = open(name, 'rb')
+    self.files.append(f)
+    if os.fstat(f.fileno()).st_size == 0:
+      return b''
+    m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    self.files.append(m)
+    return m
+
+  def close(self):
+    while self.files:
+      self.files.pop().close()
+
+  def record(self, i):
+    return INDEX_RECORD.unpack_from(self.idx,
+                                    len(INDEX_MAGIC) + i * INDEX_RECORD.size)
+
+  def entry(self, i):
+    return IDS_RECORD.unpack_from(self.ids,
+                                  IDS_HEADER.size + i * IDS_RECORD.size)
+
+  def find_number(self, number):
+    i = bisect.bisect_left(range(self.count), number,
+                           key=lambda i: self.record(i)[1])
+    if i < self.count and self.record(i)[1] == number:
+      return self.record(i)
+    return None
+
+  def find_id(self, message_id):
+    key = message_key(message_id)
+    i = bisect.bisect_left(range(self.entries), key,
+                           key=lambda i: self.entry(i)[0])
+    if i < self.entries and self.entry(i)[0] == key:
+      return self.record(self.entry(i)[1])
+    for i in range(self.covered, self.count):
+      if self.record(i)[0] == key:
+        return self.record(i)
+    return None
+
+  def get(self, key):
+    if isinstance(key, int):
+      record = self.find_number(key)
+    else:
+      record = self.find_id(key)
+    if record is None or record[2] + record[3] > len(self.mbox):
+      return None
+    return FROM_QUOTED.sub(rb'\1', self.mbox[record[2]:record[2] + record[3]])
 #```
-#  \item \ti{The mailbox file is written.} Then all the lines are appended to 
-#  the mailbox file in the destined output directory. For performance reasons, 
-#  this is done in a verbose \tc{for} loop to avoid all string concantenation.
+#  The function \tc{merge\_index} merges the records that are not yet
+#  covered by the file of message IDs into this file. The new pairs are
+#  sorted and merged with the sorted pairs of the file into a new file,
+#  which replaces the old one.
 #```
-      with open(os.path.join(config['outdir'], g), 'ab') as f:
-        for line in lines:
-          f.write(line)
-          f.write('\n'.encode())
-
+def merge_index(mbox):
+  with MboxIndex(mbox) as index:
+    if index.covered == index.count and index.ids:
+      return
+    new = sorted((index.record(i)[0], i)
+                 for i in range(index.covered, index.count))
+    old = (index.entry(i) for i in range(index.entries))
+    with open(mbox + '.ids.tmp', 'wb') as f:
+      f.write(IDS_HEADER.pack(IDS_MAGIC, index.count))
+      for entry in heapq.merge(old, new):
+        f.write(IDS_RECORD.pack(*entry))
+  os.replace(mbox + '.ids.tmp', mbox + '.ids')
 #```
-#  \item \ti{The status information is updated.} The entry for this newsgroup in 
-#  the status dictionary set to the number of the last article that was read
-#  for this group.
+#  The function \tc{rebuild\_index} builds the index of a mailbox from
+#  scratch by a scan of the whole mailbox.
 #```
-      status[g] = last
+def rebuild_index(mbox):
+  for suffix in ('.idx', '.ids'):
+    with contextlib.suppress(FileNotFoundError):
+      os.remove(mbox + suffix)
+  IndexWriter(mbox, os.path.getsize(mbox)).close()
 #```
-#  \end{enumerate}
-#
-#  \section{Program invocation and usage}
-#
-#  \subsection{Command line arguments}
-#  \label{sec:argparser}
+#  \subsection{Compressed and rotated mailboxes}
+#  \label{sec:rotate}
 #
-#  The program name and the program version are set here.
+#  Mailboxes of busy groups grow large. With the configuration key
+#  \ti{compression}, mailboxes are compressed with one of the codecs of the
+#  dictionary \tc{COMPRESSIONS}, which maps their names to the suffix of the
+#  file name and a function creating a compressor. All of them allow
+#  several compressed members in one file, which are decompressed as if
+#  they were one: \ti{gzip} members, \ti{bzip2} and \ti{xz} streams.
 #```
-PROGRAM = 'news2mbox'
-VERSION = '0.1'
+COMPRESSIONS = {
+  'gzip' : ('.gz', lambda: zlib.compressobj(wbits=zlib.MAX_WBITS + 16)),
+  'bz2' : ('.bz2', bz2.BZ2Compressor),
+  'xz' : ('.xz', lzma.LZMACompressor),
+}
 #```
-#  The function \tc{parse\_arguments} creates an argument parser and parses
-#  command line arguments. Currently
-#  three arguments are supported: \tc{-c} for specifing a configuration
-#  directory, \tc{--version} for printing version information and the
-#  \tc{--help} provided by the \tc{argparse} module.\newline
+#  A compressed mailbox is written by a \tc{CompressedMboxWriter}, which has
+#  the same interface as the \tc{MboxWriter}. Articles are compressed as
+#  they are written, whenever the mailbox is synchronized to disk by the
+#  method \tc{sync}, the current member is finished. Locations of articles
+#  in compressed mailboxes are not known, so \tc{None} is returned as
+#  offset, and they are neither indexed nor preallocated.
 #
-#  Here it is to be noted that the configuration directory is set to the
-#  default value \tc{\$HOME/.news2box} if none is given by the user.
+#  A member that is not finished because the run is killed could not be
+#  followed by further members. Therefore the size of the file up to the
+#  last finished member is kept in a marker file with the suffix
+#  \ti{.synced} while the mailbox is open, and the file is truncated to
+#  this size when it is opened again. The marker is removed when the mailbox
+#  is closed.
 #```
-def parse_arguments():
-  parser = argparse.ArgumentParser(prog=PROGRAM)
+class CompressedMboxWriter:
 
-  parser.add_argument('-c', '--config-dir',
-    dest='configdir',
-    default=os.path.join(os.environ['HOME'], '.%s' % PROGRAM),
-    help='Directory where configuration and status files are stored')
-  parser.add_argument('--version',
-    action='store_true',
-    dest='version',
-    default=False,
-    help='Display version information')
-  
-  return parser.parse_args()
+  def __init__(self, name, compression):
+    self.name = name
+    self.marker = name + '.synced'
+    self.make_compressor = COMPRESSIONS[compression][1]
+    self.compressor = None
+    self.fd = os.open(name, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o666)
+    try:
+      self.end = os.lseek(self.fd, 0, os.SEEK_END)
+      try:
+        with open(self.marker, 'r') as f:
+          synced = int(f.read())
+        if synced < self.end:
+          os.ftruncate(self.fd, synced)
+          self.end = synced
+      except (FileNotFoundError, ValueError):
+        pass
+      self.mark()
+      sync_dir(name)
+    except BaseException:
+      os.close(self.fd)
+      raise
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def mark(self):
+    fd = os.open(self.marker, os.O_WRONLY | os.O_CREAT, 0o666)
+    try:
+      os.pwrite(fd, b'%20d' % self.end, 0)
+      os.fsync(fd)
+    finally:
+      os.close(fd)
+
+  def write(self, message_id, lines, number=0):
+    return self.copy(message_id, quote_article(lines), number)
+
+  def copy(self, message_id, data, number=0):
+    if self.compressor is None:
+      self.compressor = self.make_compressor()
+    self.append(self.compressor.compress(make_mbox_header(message_id) + b'\n'))
+    self.append(self.compressor.compress(data))
+    return None, len(data)
+
+  def duplicate(self, message_id, location, number=0):
+    return self.copy(message_id, read_location(location), number)
+
+  def append(self, data):
+    while data:
+      n = os.write(self.fd, data)
+      self.end += n
+      data = data[n:]
+
+  def sync(self):
+    if self.compressor is not None:
+      self.append(self.compressor.flush())
+      self.compressor = None
+    os.fsync(self.fd)
+    self.mark()
+
+  def close(self):
+    if self.fd < 0:
+      return
+    try:
+      self.sync()
+      os.remove(self.marker)
+    finally:
+      os.close(self.fd)
+      self.fd = -1
 #```
-#  \subsection{Main program loop}
+#  With the configuration key \ti{rotate}, a group is written to a new
+#  mailbox every month or whenever the mailbox has reached the given size in
+#  bytes. The function \tc{mbox\_name} returns the name of the mailbox the
+#  articles of group \tc{g} are currently written to. Without compression
+#  and rotation, it is simply named after the group. Otherwise the suffix
+#  \ti{.mbox} is appended, preceded by the month or the number of the part
+#  and followed by the suffix of the compression, for instance
+#  \ti{comp.lang.c.2026-10.mbox.gz}. The last part is used until it is
+#  full.
 #```
-if __name__ == '__main__':      
+def mbox_name(config, g):
+  base = os.path.join(config['outdir'], g)
+  compression, rotate = config.get('compression'), config.get('rotate')
+  if not compression and not rotate:
+    return base
+  suffix = '.mbox' + (COMPRESSIONS[compression][0] if compression else '')
+  if not rotate:
+    return base + suffix
+  if rotate == 'month':
+    return '%s.%s%s' % (base, time.strftime('%Y-%m'), suffix)
+  prefix = g + '.'
+  parts = [ name[len(prefix):-len(suffix)]
+            for name in os.listdir(config['outdir'])
+            if name.startswith(prefix) and name.endswith(suffix) ]
+  part = max([ int(p) for p in parts if p.isdigit() ], default=1)
+  name = '%s.%04d%s' % (base, part, suffix)
+  if os.path.exists(name) and os.path.getsize(name) >= rotate:
+    name = '%s.%04d%s' % (base, part + 1, suffix)
+  return name
 #```
-#  The main program involves four steps:
-#
-#  \begin{enumerate}
-#   \item \ti{Arguments are parsed.} The parsing is done by the function
-#   \tc{parse\_arguments} described in section \ref{sec:argparser}. If the
-#   version argument is given, the version information is printed and then the
-#   program exits.
+#  The function \tc{open\_mbox} opens the current mailbox of a group with the
+#  writer for the configuration, or the Maildir of the group described in
+#  section \ref{sec:maildir}. The function \tc{mbox\_full} returns
+#  \tc{True} if the mailbox \tc{f} is to be replaced by a new one, which is
+#  never the case for a Maildir.
 #```
-  args = parse_arguments()
+def open_mbox(config, g):
+  if config.get('format') == 'maildir':
+    return MaildirWriter(os.path.join(config['outdir'], g))
+  name = mbox_name(config, g)
+  if config.get('compression'):
+    return CompressedMboxWriter(name, config['compression'])
+  return MboxWriter(name, config.get('preallocate', 0),
+                    config.get('index', False))
 
-  if args.version:
-    print('This is %s version %s' % (PROGRAM, VERSION))
-    sys.exit(0)
+def mbox_full(config, g, f):
+  if config.get('format') == 'maildir':
+    return False
+  rotate = config.get('rotate')
+  if rotate == 'month':
+    return mbox_name(config, g) != f.name
+  return bool(rotate) and f.end >= rotate
 #```
-#  \item \ti{Status and configuration files are read.} In this step paths to
-#  the status and configuration file are created. The files are located in the
-#  configuration directory, the status file is called \tc{status.json} and  
-#  the configuration file is called \tc{config.json}. \newline
+#  \subsection{Maildirs}
+#  \label{sec:maildir}
 #
-#  The files are then read via the functions \tc{read\_status} which is
-#  described in section \ref{sec:readstatus} and \tc{read\_configs} which is
-#  described in section \ref{sec:readconfigs}. 
+#  With the configuration key \ti{format} set to \ti{maildir}, the articles
+#  of a group are written to a Maildir named after the group instead of a
+#  mailbox, one file per article. A file is created in the subdirectory
+#  \ti{tmp} and renamed to the subdirectory \ti{new} when it is complete,
+#  so mail readers never see partial articles. As the name of every file is
+#  unique, several processes can write to the same Maildir without locks.
+#  Articles are stored as is, there is no header line and no quoting.
+#  Compression, rotation, preallocation and mailbox indexes don't apply to
+#  Maildirs.
 #```
-  statusfile = os.path.join(args.configdir, 'status.json')
-  configfile = os.path.join(args.configdir, 'config.json')
-  status = read_status(statusfile)
-  configs = read_config(configfile)
+FORMATS = [ 'mbox', 'maildir' ]
 #```
-#  \item \ti{Read articles for each server.} Then follows the loop over the
-#  list of server configurations.
+#  Unique file names are made of the time, the process ID, a counter and the
+#  host name, as recommended by the Maildir specification.
 #```
-  try:
-    for config in configs:
+maildir_counter = itertools.count()
+
+def maildir_name():
+  t = time.time()
+  host = socket.gethostname().replace('/', r'\057').replace(':', r'\072')
+  return '%d.M%dP%dQ%d.%s' % (int(t), int(t % 1 * 1e6), os.getpid(),
+                              next(maildir_counter), host)
 #```
-#  Here some default configuration values are set. If not output directory is
-#  specified in the configuration, it is set to \tc{\$HOME/news}. Environment
-#  variables used in this configuration property are replaced by their values.
+#  A Maildir is written by a \tc{MaildirWriter}, which has the same
+#  interface as the \tc{MboxWriter}. The attribute \tc{name} is the name
+#  the article written last has in \ti{new}, which is recorded in the
+#  message ID index, the offset returned is always 0. To avoid a
+#  synchronization of every single article, the files are kept in \ti{tmp}
+#  until the method \tc{sync} is called at the next checkpoint, which
+#  synchronizes all of them to disk before they are renamed, and then the
+#  directory \ti{new}. Files left in \ti{tmp} by a run that was killed are
+#  removed when the Maildir is opened again after \tc{MAILDIR\_TMP\_AGE}
+#  seconds, as the specification suggests.
 #```
-      config['outdir'] = os.path.expandvars(
-              config.get('outdir', '$HOME/news'))
+MAILDIR_TMP_AGE = 36 * 3600
+
+class MaildirWriter:
+
+  def __init__(self, path):
+    self.path = path
+    self.name = None
+    self.pending = []
+    for d in ('tmp', 'new', 'cur'):
+      os.makedirs(os.path.join(path, d), exist_ok=True)
+    tmp = os.path.join(path, 'tmp')
+    for entry in os.scandir(tmp):
+      with contextlib.suppress(OSError):
+        if entry.stat().st_mtime < time.time() - MAILDIR_TMP_AGE:
+          os.remove(entry.path)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, message_id, lines, number=0):
+    data = b'\n'.join(lines)
+    data += b'\n'
+    return self.deliver(data)
+
+  def copy(self, message_id, data, number=0):
+    return self.deliver(FROM_QUOTED.sub(rb'\1', data))
 #```
-#  SSL usage is turned on if no other information is specified in the
-#  configuration.
+#  A duplicate of an article in another Maildir is not stored again, but
+#  linked into this one. Only if this is not possible, for instance
+#  because the Maildirs are on different file systems, the article is
+#  copied.
 #```
-      if not 'ssl' in config:
-        config['ssl'] = True
+  def duplicate(self, message_id, location, number=0):
+    if is_maildir_file(location[0]):
+      name = maildir_name()
+      try:
+        os.link(location[0], os.path.join(self.path, 'tmp', name))
+      except OSError:
+        pass
+      else:
+        return self.delivered(name, location[2])
+    return self.deliver(read_location(location, quoted=False))
+
+  def deliver(self, data):
+    name = maildir_name()
+    fd = os.open(os.path.join(self.path, 'tmp', name),
+                 os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+      view = memoryview(data)
+      while view:
+        view = view[os.write(fd, view):]
+    finally:
+      os.close(fd)
+    return self.delivered(name, len(data))
+
+  def delivered(self, name, length):
+    self.pending.append(name)
+    self.name = os.path.join(self.path, 'new', name)
+    return 0, length
+
+  def sync(self):
+    if not self.pending:
+      return
+    for name in self.pending:
+      fd = os.open(os.path.join(self.path, 'tmp', name), os.O_RDONLY)
+      try:
+        os.fsync(fd)
+      finally:
+        os.close(fd)
+    for name in self.pending:
+      os.rename(os.path.join(self.path, 'tmp', name),
+                os.path.join(self.path, 'new', name))
+    self.pending = []
+    sync_dir(self.name)
+
+  def close(self):
+    self.sync()
 #```
-#  Finally the articles for the configuration are read via the function
-#  \tc{read\_articles} described in section \ref{sec:readarticles}.
+#  The function \tc{is\_maildir\_file} returns \tc{True} if \tc{path} is
+#  the file of an article in a Maildir. The function \tc{read\_location}
+#  reads the article at a location recorded in the message ID index from a
+#  mailbox or a Maildir. The article is returned quoted for a mailbox or as
+#  is for a Maildir, depending on \tc{quoted}.
 #```
-      read_articles(config, status)
+def is_maildir_file(path):
+  d = os.path.dirname(os.path.abspath(path))
+  return os.path.basename(d) in ('new', 'cur') \
+    and os.path.isdir(os.path.join(os.path.dirname(d), 'tmp'))
+
+def read_location(location, quoted=True):
+  data = MessageIndex.read(*location)
+  if is_maildir_file(location[0]):
+    return FROM_LINE.sub(rb'>\1', data) if quoted else data
+  return data if quoted else FROM_QUOTED.sub(rb'\1', data)
 #```
-#  \item \ti{Write status information.} The function \tc{read\_message} updates
-#  the information in the \tc{status} dictionary. This information is written
-#  back into the status file for the use by future invocations of 
-#  \ti{news2mbox}. This is done via the function \tc{write\_status} describes
-#  in section \ref{sec:readstatus}.
+#  \subsection{Compacting mailboxes}
+#  \label{sec:compact}
+#
+#  Mailboxes only grow, which slows down mail readers and backups. The
+#  command \ti{compact} removes old articles from the mailboxes of the
+#  configured groups according to the configuration key \ti{retention},
+#  which can be given for a server or a group. It is an object with the
+#  following keys:\newline
+#
+#  \begin{tabularx}{\linewidth}{lX}
+#   Key & Value \\ \hline
+#   max\_age & The age in days after which an article is removed, taken
+#   from its \ti{Date} header. \\
+#   max\_messages & The number of articles kept. \\
+#   max\_bytes & The size in bytes the mailbox is reduced to. \\
+#  \end{tabularx}\newline
+#
+#  The oldest articles are removed first, which are the first articles of
+#  the mailbox. With the argument \tc{--dedup}, all but the first article
+#  with the same message ID are removed as well. Only mailboxes that are
+#  neither compressed nor rotated are compacted.
 #```
-  finally:
-    write_status(statusfile, status)
+RETENTION_KEYS = [ 'max_age', 'max_messages', 'max_bytes' ]
+#```
+#  A mailbox is compacted by the function \tc{compact\_mbox}, which writes
+#  the articles to be kept to a new file that replaces the mailbox. The
+#  mailbox is mapped into memory and the boundaries of the articles are
+#  found by searching for the header lines, so the articles are never held
+#  in memory as a whole, consecutive articles are written to the new file in
+#  chunks of \tc{COMPACT\_CHUNK} bytes. The mailbox is read twice: the
+#  articles that survive their age and the removal of duplicates are
+#  counted first, the surplus of the limits is removed from their start
+#  while they are written. Only the duplicates need memory, a hash of 8 bytes
+#  for every message ID. If all articles are kept, the mailbox is left as it
+#  is. The numbers of articles and the sizes before and after are returned.
+#
+#  The articles of a mailbox written by \ti{news2mbox} start with a header
+#  line created by \tc{make\_mbox\_header}, which is searched for by the
+#  generator \tc{mbox\_messages}. It yields the start and the end of every
+#  article including its header line. The function \tc{message\_header}
+#  returns the header of an article, the functions \tc{header\_date} and
+#  \tc{header\_message\_id} the time of the \ti{Date} header and the
+#  message ID found there, or \tc{None}.
+#```
+COMPACT_CHUNK = 2**24
+MESSAGE_ID_HEADER = re.compile(rb'^message-id:[ \t]*(\S+)', re.M | re.I)
+DATE_HEADER = re.compile(rb'^date:[ \t]*(.*)', re.M | re.I)
+
+def mbox_messages(mm):
+  start = 0
+  while start < len(mm):
+    end = mm.find(b'\nFrom ', start) + 1 or len(mm)
+    yield start, end
+    start = end
+
+def message_header(mm, start, end):
+  head = mm.find(b'\n', start, end) + 1
+  body = mm.find(b'\n\n', head - 1, end)
+  return mm[head:body + 1 if body >= 0 else end]
+
+def header_date(header):
+  match = DATE_HEADER.search(header)
+  date = match and email.utils.parsedate_tz(match[1].decode('latin-1'))
+  return date and email.utils.mktime_tz(date)
+
+def header_message_id(header):
+  match = MESSAGE_ID_HEADER.search(header)
+  return match and match[1]
+
+def compact_mbox(mbox, retention, dedup=False):
+  max_age = retention.get('max_age')
+  oldest = time.time() - max_age * 86400 if max_age else None
+  with open(mbox, 'rb') as f:
+    before = os.fstat(f.fileno()).st_size
+    if not before:
+      return 0, 0, 0, 0
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+      def messages():
+        seen = set()
+        for start, end in mbox_messages(mm):
+          if oldest is None and not dedup:
+            yield start, end, True
+            continue
+          header = message_header(mm, start, end)
+          if oldest is not None and (header_date(header) or oldest) < oldest:
+            yield start, end, False
+            continue
+          key = dedup and header_message_id(header)
+          if key:
+            key = hashlib.blake2b(key, digest_size=8).digest()
+            if key in seen:
+              yield start, end, False
+              continue
+            seen.add(key)
+          yield start, end, True
+
+      total = count = size = 0
+      for start, end, keep in messages():
+        total += 1
+        if keep:
+          count += 1
+          size += end - start
+      surplus = count - retention.get('max_messages', count)
+      excess = size - retention.get('max_bytes', size)
+      if count == total and surplus <= 0 and excess <= 0:
+        return total, total, before, before
+#```
+#  The articles to be kept are written to a temporary file, which is
+#  synchronized to disk and renamed to the mailbox. Runs of consecutive
+#  articles are written at once.
+#```
+      kept = 0
+      tmpfile = mbox + '.compact'
+      with open(tmpfile, 'wb') as out:
+        run = [ 0, 0 ]
+        for start, end, keep in messages():
+          if not keep:
+            continue
+          if surplus > 0 or excess > 0:
+            surplus -= 1
+            excess -= end - start
+            continue
+          kept += 1
+          if start != run[1]:
+            copy_range(mm, out, *run)
+            run[0] = start
+          run[1] = end
+        copy_range(mm, out, *run)
+        os.fchmod(out.fileno(), os.fstat(f.fileno()).st_mode & 0o7777)
+        sync_file(out)
+        after = out.tell()
+  os.replace(tmpfile, mbox)
+  sync_dir(mbox)
+  if os.path.exists(mbox + '.idx'):
+    rebuild_index(mbox)
+  return total, kept, before, after
+
+def copy_range(mm, out, start, end):
+  for offset in range(start, end, COMPACT_CHUNK):
+    out.write(mm[offset:min(end, offset + COMPACT_CHUNK)])
+#```
+#  The function \tc{compact\_group} compacts the mailbox of the group
+#  \tc{g}. The lock of the group described in section
+#  \ref{sec:grouplocks} is held meanwhile, so articles are not written to
+#  the mailbox while it is replaced, a compaction waits for the group to be
+#  read and vice versa. The time this takes and the bytes freed are added
+#  to the metrics of the group, see section \ref{sec:stats}.
+#```
+def compact_group(config, g, dedup=False, out=None):
+  config = group_config(config, g)
+  retention = config.get('retention', {})
+  if not retention and not dedup:
+    return
+  if config.get('format') == 'maildir' or config.get('compression') \
+      or config.get('rotate'):
+    print('%s: The mailbox of %s cannot be compacted' % (PROGRAM, g),
+          file=out)
+    return
+  mbox = mbox_name(config, g)
+  if not os.path.exists(mbox):
+    return
+  start = time.perf_counter()
+  with file_lock(lock_path(config, g)):
+    total, kept, before, after = compact_mbox(mbox, retention, dedup)
+  stats.add(config, g, compact_seconds=time.perf_counter() - start,
+            compact_bytes_freed=before - after)
+  print('%d of %d articles kept for %s, %d bytes freed.' %
+        (kept, total, g, before - after), file=out)
+#```
+#  \section{Reading articles from the server}
+#  \label{sec:readarticles}
+#
+#  The core task of \ti{news2mbox} is reading messges from the NNTP servers and
+#  writing those message into local mailboxes. These functionality is
+#  encapsulated in the function \tc{read\_articles}. The function gets the
+#  argument \tc{config} which is a dictionary obtained from the configuration 
+#  file \tc{config.json} and holds information about a server with connection
+#  information and a list of news groups. The \tc{status} argument is a
+#  dictionary obtained from the file \tc{status.json} holding information to
+#  identify the last article read for each news group. All status information
+#  is printed to the file object \tc{out}, which defaults to standard output.
+#
+#  \subsection{Connecting to the server}
+#
+#  The function \tc{connect} establishes a connection to the NNTP server. The
+#  server address, port, username and password are taken from the
+#  \tc{config} dictionary. Username and password are optional and can
+#  therefore be \tc{None}. Depending on the configuration an SSL connection is
+#  established, compression is negotiated as described in section
+#  \ref{sec:compress}. If the login fails, the connection is closed again
+#  before the error is passed on. The socket is given the timeout of the
+#  configuration key \ti{timeout}, see section \ref{sec:reconnect}.
+#```
+def connect(config):
+  s = nntplib.NNTP(config['server'], config.get('port', nntplib.NNTP_PORT),
+                   timeout=config.get('timeout', TIMEOUT))
+  try:
+    if config['ssl']:
+      s.starttls()
+    s.login(user=config.get('user'), password=config.get('password'))
+    if config.get('compress'):
+      start_compression(s, config)
+  except:
+    with s:
+      raise
+  return s
+#```
+#  \subsection{Compression}
+#  \label{sec:compress}
+#
+#  Articles are plain text and compress very well. With the configuration key
+#  \ti{compress}, compression of the connection is negotiated with the
+#  \ti{COMPRESS DEFLATE} command of RFC 8054 after the login. From then on,
+#  the data sent in both directions is compressed with the \ti{deflate}
+#  algorithm without a header. Every command and response is terminated by a
+#  sync flush, so it can be decompressed as soon as it arrives.\newline
+#
+#  An object of the class \tc{Deflate} holds the state of the compression
+#  of a connection. Received data is passed to the method \tc{feed}, the
+#  method \tc{readline} returns the next decompressed line or \tc{None} if
+#  more data is needed, the line is truncated to \tc{size} bytes like
+#  \tc{readline} of files does. Data to be sent is compressed by the method
+#  \tc{compress}, the method \tc{flush} returns the rest of the compressed
+#  data. The number of bytes received and decompressed and the time spent
+#  decompressing are counted. When the connection is closed, the method
+#  \tc{record} adds them to the metrics of the server configuration
+#  \tc{config} described in section \ref{sec:stats} as
+#  \ti{compressed\_bytes}, \ti{decompressed\_bytes} and
+#  \ti{decompress\_seconds}, so the compression ratio and its cost can be
+#  seen for every run.
+#```
+class Deflate:
+
+  def __init__(self, config=None):
+    self.config = config
+    self.recorded = False
+    self.compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    self.decompressor = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+    self.buffer = bytearray()
+    self.received = 0
+    self.decompressed = 0
+    self.seconds = 0.0
+
+  def feed(self, data):
+    self.received += len(data)
+    start = time.perf_counter()
+    data = self.decompressor.decompress(data)
+    self.seconds += time.perf_counter() - start
+    self.decompressed += len(data)
+    self.buffer += data
+
+  def readline(self, size=-1):
+    end = self.buffer.find(b'\n') + 1
+    if not end:
+      if size < 0 or len(self.buffer) < size:
+        return None
+      end = size
+    elif 0 <= size < end:
+      end = size
+    line = bytes(self.buffer[:end])
+    del self.buffer[:end]
+    return line
+
+  def compress(self, data):
+    return self.compressor.compress(data)
+
+  def flush(self):
+    return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+  def record(self):
+    if self.config is None or self.recorded:
+      return
+    self.recorded = True
+    stats.add(self.config, compressed_bytes=self.received,
+              decompressed_bytes=self.decompressed,
+              decompress_seconds=self.seconds)
+#```
+#  For \tc{nntplib}, the file object of the connection is replaced by a
+#  \tc{DeflateFile}, which provides the methods \tc{nntplib} and
+#  \tc{fetch\_articles} use. The metrics are recorded when \tc{nntplib}
+#  closes it.
+#```
+class DeflateFile:
+
+  def __init__(self, file, config=None):
+    self.file = file
+    self.deflate = Deflate(config)
+
+  def readline(self, size=-1):
+    while True:
+      line = self.deflate.readline(size)
+      if line is not None:
+        return line
+      data = self.file.read1(2**16)
+      if not data:
+        return self.deflate.readline(len(self.deflate.buffer))
+      self.deflate.feed(data)
+
+  def write(self, data):
+    self.file.write(self.deflate.compress(data))
+
+  def flush(self):
+    self.file.write(self.deflate.flush())
+    self.file.flush()
+
+  def close(self):
+    self.deflate.record()
+    self.file.close()
+#```
+#  The function \tc{start\_compression} negotiates compression for the
+#  \tc{nntplib} connection \tc{s}. If the server does not advertise the
+#  capability or refuses the command, the connection is used uncompressed.
+#```
+def start_compression(s, config=None):
+  if 'DEFLATE' not in s.getcapabilities().get('COMPRESS', []):
+    return False
+  try:
+    resp = s._shortcmd('COMPRESS DEFLATE')
+  except nntplib.NNTPError:
+    return False
+  if not resp.startswith('206'):
+    return False
+  s.file = DeflateFile(s.file, config)
+  return True
+#```
+#  \subsection{Pipelined retrieval of articles}
+#  \label{sec:pipelining}
+#
+#  Waiting for the response to every \ti{ARTICLE} command before the next
+#  command is sent costs a full round trip per article. RFC 3977 (section
+#  3.5) allows clients to pipeline commands, so the function
+#  \tc{fetch\_articles} keeps a window of up to \tc{window} \ti{ARTICLE}
+#  commands in flight on the connection \tc{s} and parses the responses as
+#  they stream back. It is a generator yielding a tuple of the article number
+#  and an \tc{nntplib.ArticleInfo} object for every number in \tc{numbers},
+#  in the given order.\newline
+#
+#  \tc{nntplib} has no support for pipelining, so its internal methods for
+#  reading responses are used. The commands of a window are written without
+#  flushing, so that they are sent to the server in as few packets as
+#  possible.
+#```
+def fetch_articles(s, numbers, window):
+  pending = collections.deque()
+  try:
+    for absnum in numbers:
+      s.file.write(('ARTICLE %d\r\n' % absnum).encode())
+      pending.append(absnum)
+      if len(pending) >= window:
+        s.file.flush()
+        yield receive_article(s, pending.popleft())
+    s.file.flush()
+    while pending:
+      yield receive_article(s, pending.popleft())
+#```
+#  If the caller stops consuming articles before all responses were read, the
+#  outstanding responses are read and discarded. Otherwise the responses would
+#  be mistaken for the responses to subsequent commands.
+#```
+  except GeneratorExit:
+    s.file.flush()
+    while pending:
+      receive_article(s, pending.popleft())
+    raise
+#```
+#  A response is read by the function \tc{receive\_article}. An article
+#  that can not be obtained, that is a \ti{420 no current article}, \ti{423
+#  no article with that number} or \ti{430 no such article} response, is
+#  reported as \tc{None}. As the error response consists of a single line,
+#  the connection stays in sync. Any other error, like the response
+#  \ti{400} of a server ending the session, aborts the retrieval, so the
+#  article is not taken for missing but requested again, see section
+#  \ref{sec:reconnect}.
+#```
+MISSING_ARTICLE = ('420', '423', '430')
+
+def receive_article(s, absnum):
+  try:
+    resp, lines = s._getlongresp()
+  except nntplib.NNTPTemporaryError as e:
+    if not str(e.response).startswith(MISSING_ARTICLE):
+      raise
+    return absnum, None
+  resp, number, message_id = s._statparse(resp)
+  return absnum, nntplib.ArticleInfo(number, message_id, lines)
+#```
+#  \subsection{Connection objects}
+#  \label{sec:connections}
+#
+#  Articles can be read with two engines: the default engine uses
+#  \tc{nntplib}, the \ti{asyncio} engine described in section
+#  \ref{sec:asyncio} implements the needed parts of the NNTP protocol on top
+#  of \tc{asyncio} streams. The articles of a group are read by one and the
+#  same function for both engines, which is written as coroutine. It uses a
+#  connection object with the following coroutine methods:
+#
+#  \begin{tabularx}{\linewidth}{lX}
+#   Method & Meaning \\ \hline
+#   group(name) & Select a group, returns a tuple of the estimated number of
+#   articles, the first and the last article number. \\
+#   listgroup(name, first, last) & Select a group and return the list of
+#   numbers of the articles in a range that actually exist, see section
+#   \ref{sec:listgroup}. \\
+#   active(groups) & Returns a dictionary with the last article number of
+#   all existing groups of the list \tc{groups}, as obtained by
+#   \ti{LIST ACTIVE}. \\
+#   over(first, last) & Returns the overview information for a range of
+#   articles like \tc{nntplib.NNTP.over}, an empty list if there are no
+#   articles in the range. \\
+#   articles(numbers, window) & An asynchronous generator of articles as
+#   described in section \ref{sec:pipelining}. \\
+#   date() & Sends a \ti{DATE} command, which keeps an idle connection
+#   alive, see section \ref{sec:daemon}. \\
+#   quit() & Closes the connection. \\
+#  \end{tabularx}\newline
+#
+#  The method \tc{close}, which is no coroutine, closes a failed connection
+#  without sending \ti{QUIT}.
+#
+#  For the \tc{nntplib} engine the class \tc{NNTPLibConnection} wraps an
+#  \tc{nntplib.NNTP} object. Its methods block, so it is used with one event
+#  loop per thread, on which the coroutines simply run to completion.
+#  \tc{nntplib} has no method for \ti{LISTGROUP} with a range, so the command
+#  is sent with an internal method.
+#
+#  A range without any articles, which is common in groups with expired
+#  articles, is answered to \ti{OVER} with the response \ti{423} (RFC 3977,
+#  section 8.3.2) instead of an empty list. The function
+#  \tc{no\_articles\_in\_range} recognizes this error.
+#```
+def no_articles_in_range(e):
+  return str(e.response).startswith('423')
+
+class NNTPLibConnection:
+
+  def __init__(self, s):
+    self.s = s
+
+  async def group(self, name):
+    resp, count, first, last, name = self.s.group(name)
+    return count, first, last
+
+  async def listgroup(self, name, first, last):
+    try:
+      resp, lines = self.s._longcmdstring(
+        'LISTGROUP %s %d-%d' % (name, first, last))
+    except nntplib.NNTPPermanentError:
+      await self.group(name)
+      return list(range(first, last + 1))
+    return [ int(l) for l in lines ]
+
+  async def active(self, groups):
+    last = {}
+    for pattern in wildmats(groups):
+      resp, infos = self.s.list(pattern)
+      for info in infos:
+        last[info.group] = int(info.last)
+    return last
+
+  async def over(self, first, last):
+    try:
+      resp, overviews = self.s.over((first, last))
+    except nntplib.NNTPTemporaryError as e:
+      if not no_articles_in_range(e):
+        raise
+      return []
+    return overviews
+
+  async def articles(self, numbers, window):
+    with contextlib.closing(fetch_articles(self.s, numbers, window)) as arts:
+      for article in arts:
+        yield article
+
+  async def date(self):
+    self.s.date()
+
+  async def quit(self):
+    with self.s:
+      pass
+
+  def close(self):
+    self.s._close()
+#```
+#  \subsection{High-water marks of all groups}
+#  \label{sec:active}
+#
+#  For most groups there are no new articles in most runs. Instead of
+#  entering every group to find out its last article number, the last
+#  article numbers of all configured groups are requested at once with
+#  \ti{LIST ACTIVE} (RFC 3977, section 7.6.3). The argument of this command is
+#  a wildmat, a comma separated list of patterns, which in this case are
+#  simply the names of the groups. A command line must not exceed 512
+#  octets, so the function \tc{wildmats} splits the list of groups into
+#  wildmats of at most \tc{size} octets.
+#```
+def wildmats(groups, size=497):
+  pattern = ''
+  for g in groups:
+    if pattern and len(pattern) + len(g) + 1 > size:
+      yield pattern
+      pattern = ''
+    pattern = pattern + ',' + g if pattern else g
+  if pattern:
+    yield pattern
+#```
+#  A group is up to date if its last article number is known and it is not
+#  larger than the number of the last article read. It is smaller if the
+#  server lost articles or renumbered the group, then the articles up to the
+#  number read before are not read again.
+#```
+def up_to_date(status, g, last):
+  return last is not None and status.get(g, -1) >= last
+#```
+#  The coroutine \tc{read\_active} returns a dictionary holding the last
+#  article number for every configured group, or \tc{None} for groups the
+#  server does not know. If the server does not support \ti{LIST ACTIVE} with
+#  a wildmat, the dictionary is empty and the groups are entered as usual.
+#
+#  With the configuration key \ti{active\_ttl} the result is cached in the
+#  directory \ti{cachedir} for the given number of seconds. As long as the
+#  cache is fresh, the server is not asked at all, so runs without new
+#  articles don't even connect to the server.
+#```
+async def read_active(conn, config):
+  try:
+    last = await conn.active(group_names(config))
+  except nntplib.NNTPError:
+    return {}
+  active = { g : last.get(g) for g in group_names(config) }
+  if config.get('active_ttl'):
+    os.makedirs(config['cachedir'], exist_ok=True)
+    write_json(active_cachefile(config),
+               { 'time' : time.time(), 'groups' : active })
+  return active
+#```
+#  The cache file of a server is named after the server and the port. It is
+#  only used if it is fresh and covers all configured groups.
+#```
+def active_cachefile(config):
+  return os.path.join(config['cachedir'], 'active-%s-%d.json' %
+    (config['server'], config.get('port', nntplib.NNTP_PORT)))
+
+def cached_active(config):
+  ttl = config.get('active_ttl')
+  if not ttl:
+    return None
+  try:
+    with open(active_cachefile(config), 'r') as f:
+      cache = json.load(f)
+    if time.time() - cache['time'] < ttl and \
+        all(g in cache['groups'] for g in group_names(config)):
+      return cache['groups']
+  except (OSError, ValueError, KeyError, TypeError):
+    pass
+  return None
+#```
+#  \subsection{Group patterns}
+#  \label{sec:wildmat}
+#
+#  Instead of listing hundreds of groups of a hierarchy one by one, the
+#  groups of a configuration can be given by wildmats (RFC 3977, section
+#  4), such as \ti{comp.lang.*}. A pattern starting with \ti{!} excludes
+#  the matching groups. As in a wildmat, the last entry matching a group
+#  decides, so \ti{[ ``comp.lang.*'', ``!comp.lang.java*'' ]} subscribes to
+#  all groups of \ti{comp.lang} except those about Java. The options of a
+#  group object with a pattern as name apply to all matching groups.
+#
+#  The function \tc{is\_wildmat} tells whether a group entry is a pattern,
+#  the function \tc{match\_groups} returns the entries of the groups
+#  \tc{names} that are subscribed to by the group entries \tc{entries},
+#  each entry of a group object being named after the group. Entries
+#  which are not patterns are always included, unless they are excluded
+#  by a later pattern.
+#```
+def is_wildmat(name):
+  return name.startswith('!') or any(c in name for c in '*?[')
+
+def match_groups(entries, names):
+  patterns = [ e['name'] if isinstance(e, dict) else e for e in entries ]
+  names = set(names).union(p for p in patterns if not is_wildmat(p))
+  groups = []
+  for g in sorted(names):
+    entry = None
+    for e, p in zip(entries, patterns):
+      if fnmatch.fnmatchcase(g, p[1:] if p.startswith('!') else p):
+        entry = None if p.startswith('!') else e
+    if isinstance(entry, dict):
+      groups.append(dict(entry, name=g))
+    elif entry is not None:
+      groups.append(g)
+  return groups
+#```
+#  The patterns are expanded against the groups of the server by the
+#  function \tc{expand\_groups}, which replaces the group entries of the
+#  configuration by the entries of the matching groups. Configurations
+#  without patterns are left unchanged.
+#
+#  The names of the groups matching the patterns are requested with
+#  \ti{LIST ACTIVE} and the patterns as wildmat, so the server sends only
+#  the matching part of the active list, which is cached in the directory
+#  \ti{cachedir}. The cache is used as is for \ti{groups\_ttl} seconds.
+#  After that, instead of requesting the list again, only the groups created
+#  since the list was last updated are requested with \ti{NEWGROUPS} (RFC
+#  3977, section 7.3). The time of the last update is taken a minute
+#  earlier, so groups created while the list was requested are not missed.
+#  The whole list is requested again only if the patterns change.
+#
+#  A failed connection is opened again as described in section
+#  \ref{sec:reconnect}. If the server can not be reached at all, the
+#  outdated list in the cache is used, if there is one for the same patterns.
+#  Otherwise the error is passed on.
+#```
+GROUPS_TTL = 24 * 3600
+
+def expand_groups(config):
+  patterns = [ e['name'] if isinstance(e, dict) else e
+               for e in config['groups'] ]
+  if not any(is_wildmat(p) for p in patterns):
+    return
+  wanted = [ p for p in patterns if not p.startswith('!') ]
+  cachefile = os.path.join(config['cachedir'], 'newsgroups-%s-%d.json' %
+    (config['server'], config.get('port', nntplib.NNTP_PORT)))
+  try:
+    with open(cachefile, 'r') as f:
+      cache = json.load(f)
+    if cache['patterns'] != wanted:
+      cache = None
+  except (OSError, ValueError, KeyError, TypeError):
+    cache = None
+  if cache is None or \
+      time.time() - cache['time'] >= config.get('groups_ttl', GROUPS_TTL):
+    now = time.time() - 60
+    try:
+      groups = with_reconnects(config,
+                               lambda: server_groups(config, wanted, cache))
+    except SERVER_ERRORS as e:
+      if cache is None:
+        raise
+      print('%s: Using the cached groups of %s: %s' %
+            (PROGRAM, config['server'], describe_error(e)),
+            file=sys.stderr, flush=True)
+    else:
+      cache = { 'patterns' : wanted, 'groups' : groups, 'time' : now }
+      os.makedirs(config['cachedir'], exist_ok=True)
+      write_json(cachefile, cache)
+  config['groups'] = match_groups(config['groups'], cache['groups'])
+#```
+#  The function \tc{server\_groups} requests the groups matching the
+#  patterns \tc{wanted} via a new connection, all of them if there is no
+#  \tc{cache}, otherwise only the new groups, which are added to the cached
+#  ones.
+#```
+def server_groups(config, wanted, cache):
+  s = connect(config)
+  try:
+    if cache is None:
+      return list_groups(s, wanted)
+    return sorted(set(cache['groups']).union(
+      g for g in new_groups(s, cache['time'])
+      if any(fnmatch.fnmatchcase(g, p) for p in wanted)))
+  finally:
+    with s:
+      pass
+#```
+#  The function \tc{list\_groups} returns the names of the groups matching
+#  the \tc{patterns}. If the server does not support \ti{LIST ACTIVE} with a
+#  wildmat, the whole list is requested and matched locally. The function
+#  \tc{new\_groups} returns the names of the groups created since the time
+#  \tc{since}. \tc{nntplib} sends \ti{NEWGROUPS} with the local time of the
+#  server, so the command is sent with an internal method and the time in
+#  GMT.
+#```
+def list_groups(s, patterns):
+  names = set()
+  try:
+    for pattern in wildmats(patterns):
+      resp, infos = s.list(pattern)
+      names.update(info.group for info in infos)
+  except nntplib.NNTPPermanentError:
+    resp, infos = s.list()
+    names = { info.group for info in infos
+              if any(fnmatch.fnmatchcase(info.group, p) for p in patterns) }
+  return sorted(names)
+
+def new_groups(s, since):
+  resp, lines = s._longcmdstring(
+    time.strftime('NEWGROUPS %Y%m%d %H%M%S GMT', time.gmtime(since)))
+  return [ line.split()[0] for line in lines if line.strip() ]
+#```
+#  \subsection{Avoiding duplicate downloads of cross-posted articles}
+#  \label{sec:dedup}
+#
+#  Articles cross-posted to several subscribed groups would be downloaded
+#  once for every group. With the configuration key \ti{dedup}, the location
+#  of every article written to a mailbox is recorded in an index, which maps
+#  the message ID of the article to the mailbox file, the offset and the
+#  length of the article lines. When an article with a known message ID is
+#  encountered again, it is copied from the local mailbox instead, or linked
+#  if both groups are written to Maildirs.\newline
+#
+#  The index is kept in the SQLite database \tc{msgid.db} in the
+#  \ti{cachedir}. Entries older than \tc{DEDUP\_MAX\_AGE} seconds are evicted
+#  and at most \tc{DEDUP\_MAX\_ENTRIES} entries are kept, so the index stays
+#  compact.
+#```
+DEDUP_MAX_AGE = 30 * 24 * 3600
+DEDUP_MAX_ENTRIES = 1000000
+#```
+#  The class \tc{MessageIndex} implements the index. The database is opened
+#  in WAL mode and the table is created if it does not exist yet. Then the
+#  old entries are evicted. As the index is shared by all threads, access to
+#  the database is serialized by a lock.
+#```
+class MessageIndex:
+
+  def __init__(self, path):
+    self.lock = threading.Lock()
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    with self.lock, self.db:
+      self.db.execute('PRAGMA journal_mode=WAL')
+      self.db.execute('CREATE TABLE IF NOT EXISTS articles ('
+        'message_id TEXT PRIMARY KEY, path TEXT, offset INTEGER, '
+        'length INTEGER, time REAL) WITHOUT ROWID')
+      self.db.execute('CREATE INDEX IF NOT EXISTS articles_time '
+        'ON articles (time)')
+      self.db.execute('DELETE FROM articles WHERE time < ?',
+        (time.time() - DEDUP_MAX_AGE,))
+      self.db.execute('DELETE FROM articles WHERE message_id IN ('
+        'SELECT message_id FROM articles ORDER BY time DESC '
+        'LIMIT -1 OFFSET ?)', (DEDUP_MAX_ENTRIES,))
+#```
+#  New entries are added with \tc{add} and made persistent with
+#  \tc{commit}, which is done at every checkpoint and after every group.
+#```
+  def add(self, message_id, path, offset, length):
+    with self.lock:
+      self.db.execute('INSERT OR REPLACE INTO articles VALUES (?, ?, ?, ?, ?)',
+        (message_id, os.path.abspath(path), offset, length, time.time()))
+
+  def commit(self):
+    with self.lock:
+      self.db.commit()
+#```
+#  The method \tc{lookup} returns the location of an article as a tuple of
+#  path, offset and length, or \tc{None} if the message ID is unknown. The
+#  mailbox might have been changed since the entry was recorded, so the
+#  location is only returned if the header of the article found there
+#  carries the message ID. The \ti{Message-ID} header is parsed by the
+#  function \tc{header\_message\_id} of section \ref{sec:compact}, which
+#  matches the name regardless of case and allows any whitespace before the
+#  value.
+#```
+  def lookup(self, message_id):
+    with self.lock:
+      row = self.db.execute('SELECT path, offset, length FROM articles '
+        'WHERE message_id = ?', (message_id,)).fetchone()
+    if row is None:
+      return None
+    try:
+      head = self.read(row[0], row[1], min(row[2], 65536))
+    except OSError:
+      return None
+    header = head.split(b'\n\n', 1)[0]
+    if header_message_id(header) != message_id.encode():
+      return None
+    return row
+#```
+#  The method \tc{read} reads the lines of an article from a mailbox.
+#```
+  @staticmethod
+  def read(path, offset, length):
+    with open(path, 'rb') as f:
+      f.seek(offset)
+      data = f.read(length)
+    if len(data) != length:
+      raise OSError('%s is truncated' % path)
+    return data
+#```
+#  There is one index per cache directory, which is opened when it is used
+#  for the first time by the function \tc{message\_index}.
+#```
+message_indexes = {}
+message_indexes_lock = threading.Lock()
+
+def message_index(config):
+  path = os.path.join(config['cachedir'], 'msgid.db')
+  with message_indexes_lock:
+    if path not in message_indexes:
+      os.makedirs(config['cachedir'], exist_ok=True)
+      message_indexes[path] = MessageIndex(path)
+    return message_indexes[path]
+#```
+#  \subsection{Kill files}
+#  \label{sec:killfile}
+#
+#  In many groups most articles are spam or binaries nobody reads. The
+#  configuration key \ti{filter}, which can be given for a server or a
+#  group, holds rules rejecting such articles before they are downloaded.
+#  The rules are checked against the overview information of the articles,
+#  which is requested for a whole batch at once, and only articles passing
+#  all rules are requested from the server. A filter is an object with the
+#  following keys:\newline
+#
+#  \begin{tabularx}{\linewidth}{lX}
+#   Key & Value \\ \hline
+#   from & A regular expression, articles with a matching sender are
+#   rejected. \\
+#   subject & A regular expression, articles with a matching subject are
+#   rejected. \\
+#   newsgroups & A regular expression, articles cross-posted to a matching
+#   group are rejected. \\
+#   max\_bytes & Articles with more bytes are rejected. \\
+#   max\_crossposts & Articles cross-posted to more groups are rejected. \\
+#  \end{tabularx}\newline
+#
+#  The groups of an article are taken from its \ti{Xref} header, which most
+#  servers include in the overview information. For servers that don't, the
+#  rules \ti{newsgroups} and \ti{max\_crossposts} reject no article.
+#  Encoded words in the sender and subject are decoded before they are
+#  matched.
+#```
+FILTER_KEYS = [ 'from', 'subject', 'newsgroups', 'max_bytes',
+                'max_crossposts' ]
+#```
+#  The class \tc{KillFilter} compiles the rules of a filter once for every
+#  group that is read. The method \tc{check} returns the key of the first
+#  rule that rejects an article with the overview information \tc{fields},
+#  or \tc{None} if the article passes.
+#```
+class KillFilter:
+
+  def __init__(self, rules):
+    self.patterns = [ (key, re.compile(rules[key]))
+                      for key in ('from', 'subject', 'newsgroups')
+                      if key in rules ]
+    self.max_bytes = rules.get('max_bytes')
+    self.max_crossposts = rules.get('max_crossposts')
+
+  def check(self, fields):
+    groups = [ entry.rpartition(':')[0]
+               for entry in (fields.get('xref') or '').split()[1:] ]
+    for key, pattern in self.patterns:
+      if key == 'newsgroups':
+        if any(pattern.search(g) for g in groups):
+          return key
+      elif pattern.search(nntplib.decode_header(fields.get(key) or '')):
+        return key
+    if self.max_bytes is not None and \
+        int(fields.get(':bytes') or 0) > self.max_bytes:
+      return 'max_bytes'
+    if self.max_crossposts is not None and \
+        len(groups) > self.max_crossposts:
+      return 'max_crossposts'
+    return None
+#```
+#  \subsection{Rate limits}
+#  \label{sec:ratelimits}
+#
+#  Servers often limit the number of articles or bytes an account may
+#  download per day. With the configuration keys \ti{rate} and
+#  \ti{bandwidth}, the download is slowed down to the given number of
+#  articles or bytes per second. A \tc{RateLimiter} hands out \tc{amount}
+#  units at the given \tc{rate}, the coroutine \tc{wait} sleeps until the
+#  units are available. Amounts may be charged after they were used, the
+#  next caller then waits for them.
+#```
+class RateLimiter:
+
+  def __init__(self, rate):
+    self.interval = 1 / rate
+    self.next = time.monotonic()
+    self.lock = threading.Lock()
+
+  async def wait(self, amount=1):
+    with self.lock:
+      now = time.monotonic()
+      delay = self.next - now
+      self.next = max(self.next, now) + amount * self.interval
+    if delay > 0:
+      await asyncio.sleep(delay)
+#```
+#  The limits apply to a server as a whole, so all connections and
+#  configurations for a server share one limiter per key, which is created
+#  by the function \tc{rate\_limiter} when it is used for the first time. The
+#  function returns \tc{None} if the limit is not configured.
+#```
+rate_limiters = {}
+rate_limiters_lock = threading.Lock()
+
+def rate_limiter(config, key):
+  rate = config.get(key)
+  if not rate:
+    return None
+  server = config['server'], config.get('port'), key, rate
+  with rate_limiters_lock:
+    if server not in rate_limiters:
+      rate_limiters[server] = RateLimiter(rate)
+    return rate_limiters[server]
+#```
+#  \subsection{Run metrics}
+#  \label{sec:stats}
+#
+#  To find out where the time of a slow run goes, \ti{news2mbox} records
+#  metrics of every run in the object \tc{stats}. They are kept in three
+#  levels: totals of the run, such as the time spent reading and writing the
+#  status file, metrics of every server, such as the time spent connecting,
+#  and metrics of every group of a server, such as the number of articles
+#  read and the time spent transferring and writing them. Times are given in
+#  seconds and keys of times end with \ti{\_seconds}.
+#
+#  The method \tc{add} adds values to the metrics of a group, a server or
+#  the run, depending on whether a configuration \tc{config} and a group
+#  \tc{g} are given. As metrics are added from several threads, this is
+#  done under a lock. Code reading articles adds its metrics once per group,
+#  not once per article. The method \tc{timer} returns a context manager
+#  adding the time spent in its body.
+#```
+class Stats:
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.clear()
+
+  def clear(self):
+    self.totals = collections.Counter()
+    self.servers = {}
+    self.groups = {}
+
+  def add(self, config=None, g=None, **values):
+    with self.lock:
+      if config is None:
+        counter = self.totals
+      elif g is None:
+        counter = self.servers.setdefault(server_name(config),
+                                          collections.Counter())
+      else:
+        counter = self.groups.setdefault((server_name(config), g),
+                                         collections.Counter())
+      counter.update(values)
+
+  @contextlib.contextmanager
+  def timer(self, key, config=None, g=None):
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.add(config, g, **{ key : time.perf_counter() - start })
+#```
+#  The method \tc{summary} returns the metrics as nested dictionaries,
+#  which are written to the file given with the argument \tc{--stats-json}.
+#```
+  def summary(self):
+    with self.lock:
+      servers = { s : dict(c, groups={}) for s, c in self.servers.items() }
+      for (s, g), c in self.groups.items():
+        servers.setdefault(s, { 'groups' : {} })['groups'][g] = dict(c)
+      return dict(self.totals, time=time.time(), servers=servers)
+#```
+#  The method \tc{prometheus} returns the metrics in the text format of
+#  \ti{Prometheus}, which is written to the file given with the argument
+#  \tc{--prometheus}, a file for the textfile collector of the
+#  \ti{node\_exporter}. All metrics are gauges describing the last run,
+#  their names are prefixed with the program name and the level, the
+#  server and group are given as labels.
+#```
+  def prometheus(self):
+    metrics = collections.defaultdict(list)
+    summary = self.summary()
+    for key, value in summary.items():
+      if key not in ('time', 'servers'):
+        metrics[key].append(('', value))
+    metrics['last_run_timestamp_seconds'].append(('', summary['time']))
+    for s, server in summary['servers'].items():
+      for key, value in server.items():
+        if key != 'groups':
+          metrics['server_' + key].append((labels(server=s), value))
+      for g, group in server['groups'].items():
+        for key, value in group.items():
+          metrics['group_' + key].append((labels(server=s, group=g), value))
+    lines = []
+    for key in sorted(metrics):
+      name = '%s_%s' % (PROGRAM, key)
+      lines.append('# TYPE %s gauge\n' % name)
+      for label, value in sorted(metrics[key]):
+        lines.append('%s%s %s\n' % (name, label, value))
+    return ''.join(lines)
+
+stats = Stats()
+#```
+#  Servers are named by their address and, if it is configured, their port.
+#  The function \tc{labels} formats the labels of a metric, escaping the
+#  values as required by the text format.
+#```
+def server_name(config):
+  if config.get('port'):
+    return '%s:%d' % (config['server'], config['port'])
+  return config['server']
+
+def labels(**values):
+  return '{%s}' % ','.join(
+    '%s="%s"' % (k, v.replace('\\', '\\\\').replace('"', '\\"')
+                      .replace('\n', '\\n'))
+    for k, v in sorted(values.items()))
+#```
+#  \subsection{Reading the articles of a group}
+#  \label{sec:readgroup}
+#
+#  The following constants are the default number of articles read per group
+#  and run and the default number of article numbers read per batch.
+#```
+MAX_ARTICLES = 200
+BATCH_SIZE = 1000
+#```
+#  The coroutine \tc{fetch\_group} reads the new articles of the news group
+#  \tc{g} via the connection object \tc{conn}, while the group is locked
+#  as described in section \ref{sec:grouplocks}. The optional function
+#  \tc{checkpoint} is called to save the status. The algorithm works in three
+#  steps:
+#```
+async def fetch_group(conn, config, g, status, out=None, checkpoint=None,
+                      last=None):
+#```
+#  \begin{enumerate}
+#  \item \ti{The range of article numbers to be read is determined.} For this 
+#  purpose, the last available article number is needed. It may be given as
+#  argument \tc{last}, which was obtained from the active list of the server
+#  as described in section \ref{sec:active}. If this number shows that there
+#  are no new articles, nothing needs to be done and the group is not
+#  entered at all, \tc{conn} can be \tc{None} in this case. The status
+#  entry is set again nevertheless, which changes nothing in a status
+#  dictionary, but records the time of the fetch in the status database of
+#  section \ref{sec:statusdb}. If \tc{last} is not given, it is obtained
+#  from the server. Options given for this group override the options of
+#  the server.
+#
+#  The metrics of the group described in section \ref{sec:stats} are
+#  collected in the counter \tc{counts}: the time spent selecting the group
+#  and the range of articles, transferring the articles and writing and
+#  syncing the mailbox, the number of round trips, of articles read,
+#  missing, copied and filtered and of bytes received. The bytes of an
+#  article are counted as its lines with their CRLF line endings, as sent by
+#  the server, not as written to the mailbox, which adds a header line and
+#  may store the article compressed or not at all.
+#```
+  config = group_config(config, g)
+  if up_to_date(status, g, last):
+    print('%s: No new articles for %s at %s' %
+      (PROGRAM, g, config['server']), file=out)
+    status[g] = status[g]
+    return 0
+  start = time.perf_counter()
+  counts = collections.Counter()
+  selected = last is None
+  if selected:
+    count, low, last = await conn.group(g)
+    counts['round_trips'] += 1
+  last = int(last)
+  max_articles = config.get('max_articles', MAX_ARTICLES)
+  counts['select_seconds'] += time.perf_counter() - start
+#```
+#  The number of the first article to be read is set to the number of the last 
+#  article for this news group. This information is obtained from the status
+#  dictionary. The number is set to 0 if no status information is available for
+#  this group. By default, at most \ti{max\_articles} articles are read, so the
+#  upper limit for the number of the first article is
+#  \ti{last - max\_articles}. One is added to obtain the number of the first
+#  unread articles. This turns the default 0 into 1, as by the standard
+#  article numbers start with 1. Older articles are skipped for good.
+#
+#  In \ti{backfill} mode no article is skipped. Reading starts with the
+#  first unread article that is still available on the server, which is
+#  given by the low water mark of the group, and ends after at most
+#  \ti{max\_articles} articles. The status entry is set to the end of this
+#  range, so the next run continues where this run stopped, and a large
+#  backlog is read over several runs.
+#```
+  if config.get('backfill'):
+    if not selected:
+      count, low, last = await conn.group(g)
+      counts['round_trips'] += 1
+      selected = True
+    first = max(status.get(g, 0) + 1, int(low))
+    last = min(last, first + max_articles - 1)
+  else:
+    first = max(status.get(g, 0), last - max_articles) + 1
+#```
+#  \item \ti{Articles are read from the server and written to the mailbox.}
+#  The mailbox file in the destined output directory is opened for appending
+#  by the function \tc{open\_mbox}, see sections \ref{sec:mboxwriter} and
+#  \ref{sec:rotate}. Every article is
+#  written to the mailbox as soon as it arrives, so at no time more than a
+#  single article is held in memory, regardless of the number of new
+#  articles in the group. The variable \tc{done} holds
+#  the number of the last article that was processed, \tc{total} the number
+#  of articles found. The mailbox is synced by the function \tc{sync}, which
+#  records the time this takes. The metrics are added by the function
+#  \tc{record} when the mailbox is closed, also if an error occurs.
+#```
+  index = message_index(config) if config.get('dedup') else None
+  killfile = KillFilter(config['filter']) if config.get('filter') else None
+  rate = rate_limiter(config, 'rate')
+  bandwidth = rate_limiter(config, 'bandwidth')
+  window = config.get('window', 16)
+  verbose = not config.get('quiet')
+  done = None
+  total = 0
+
+  def sync():
+    t = time.perf_counter()
+    f.sync()
+    counts['sync_seconds'] += time.perf_counter() - t
+
+  def record():
+    counts['seconds'] += time.perf_counter() - start
+    stats.add(config, g, **counts)
+
+  with contextlib.ExitStack() as mailboxes:
+    mailboxes.callback(record)
+    f = mailboxes.enter_context(open_mbox(config, g))
+    try:
+#```
+#  The range is processed in batches of at most \ti{batch} article numbers,
+#  so the lists of numbers held in memory are bounded even if a large
+#  range is read in backfill mode.
+#```
+      batch = config.get('batch', BATCH_SIZE)
+      for lo in range(first, last + 1, batch):
+        hi = min(lo + batch - 1, last)
+#```
+#  Before a batch is read, the mailbox is replaced by a new one if it is
+#  to be rotated, see section \ref{sec:rotate}.
+#```
+        if mbox_full(config, g, f):
+          f.close()
+          f = mailboxes.enter_context(open_mbox(config, g))
+#```
+#  \label{sec:listgroup}
+#  In groups with many expired or cancelled articles, most numbers of the
+#  range don't refer to an article. Instead of requesting each number and
+#  paying a round trip for every missing article, the numbers of the
+#  articles that actually exist are obtained with a single \ti{LISTGROUP}
+#  command with the range as argument (RFC 3977, section 6.1.2). Servers not
+#  supporting this command respond with an error, in this case all numbers of
+#  the range are requested. Servers might ignore the range, so the numbers
+#  are restricted to the range.
+#  As \ti{LISTGROUP} selects the group, the articles can be requested
+#  afterwards even if no \ti{GROUP} command was sent.
+#
+#  If duplicates are to be avoided as described in section \ref{sec:dedup},
+#  the overview information of the range is requested instead, which
+#  provides the message IDs as well. Articles with a message ID that was seen
+#  before are copied from the local mailboxes instead of being fetched again.
+#  Their locations are stored in the dictionary \tc{copies}.
+#
+#  The overview information is requested as well if articles are filtered
+#  as described in section \ref{sec:killfile}. Rejected articles are left
+#  out of the numbers to be read and counted per rule.
+#```
+        t = time.perf_counter()
+        copies = {}
+        filtered = 0
+        if index is not None or killfile is not None:
+          if not selected:
+            await conn.group(g)
+            counts['round_trips'] += 1
+            selected = True
+          numbers = []
+          for n, fields in await conn.over(lo, hi):
+            if lo <= n <= hi:
+              rule = killfile.check(fields) if killfile else None
+              if rule:
+                filtered += 1
+                counts['filtered_' + rule] += 1
+                continue
+              numbers.append(n)
+              if index is None:
+                continue
+              message_id = fields.get('message-id', '')
+              location = index.lookup(message_id)
+              if location:
+                copies[n] = message_id, location
+          counts['filtered'] += filtered
+        else:
+          numbers = [ n for n in await conn.listgroup(g, lo, hi)
+                      if lo <= n <= hi ]
+        counts['round_trips'] += 1
+        counts['select_seconds'] += time.perf_counter() - t
+#```
+#   The number of all articles of the batch is used to print status
+#   information. The status information printed is modeled after the output
+#   of the famous \ti{fetchmail} utility.
+#```
+        no_articles = len(numbers)
+        total += no_articles
+        if no_articles:
+          print('%d articles for %s at %s.' % 
+            (no_articles, g, config['server']), file=out)
+        if filtered:
+          print('%d articles filtered for %s at %s.' %
+            (filtered, g, config['server']), file=out)
+#```
+#  The main loop reading articles loops over two values: \tc{relnum} denotes
+#  the relative number of the article, starting with 1, \tc{info} holds the
+#  article with the next number of \tc{numbers} as known to the server. The
+#  articles are pipelined as described in section \ref{sec:pipelining}.
+#  Articles to be copied are not requested from the server, all other
+#  articles are taken from the pipeline in the order of \tc{numbers}. With
+#  a full pipeline, a round trip is needed for every \ti{window} articles.
+#  The status line of every article is only printed if the configuration
+#  key \ti{quiet} is not set.
+#```
+        requested = [ n for n in numbers if n not in copies ]
+        counts['round_trips'] += -(-len(requested) // window)
+        articles = conn.articles(requested, window)
+        async with contextlib.aclosing(articles):
+          for relnum, absnum in enumerate(numbers, 1):
+            if verbose:
+              print('reading article %s: %d of %d ' %
+                (g, relnum, no_articles), end='', file=out)
+#```
+#  A copied article is written by the method \tc{duplicate} of the writer,
+#  and the status line is ended with the string \ti{copied}.
+#```
+            if absnum in copies:
+              message_id, location = copies[absnum]
+              t = time.perf_counter()
+              f.duplicate(message_id, location, absnum)
+              counts['write_seconds'] += time.perf_counter() - t
+              counts['copied'] += 1
+              if verbose:
+                print('copied', file=out)
+              done = absnum
+              continue
+#```
+#  Before an article is taken from the pipeline, the rate limits described
+#  in section \ref{sec:ratelimits} are awaited.
+#```
+            if rate:
+              await rate.wait()
+            t = time.perf_counter()
+            absnum, info = await anext(articles)
+            counts['transfer_seconds'] += time.perf_counter() - t
+#```
+#  If an article could not be read from the server, for instance because it
+#  expired in the meantime, the status information line is ended with the
+#  string \ti{not found} and the next article number is processed.
+#```
+            if info is None:
+              counts['missing'] += 1
+              if verbose:
+                print('not found.', file=out)
+#```
+#  If a article is read, it is written to the mailbox with a header line
+#  and the status line is ended with the string \ti{flushed}.
+#
+#  Here it is to be noted that all article lines obtained via the NNTP server
+#  are handled as byte sequences and are never decoded. The location of the
+#  article in the mailbox is recorded in the message ID index.
+#```
+            else:
+              t = time.perf_counter()
+              offset, length = f.write(info.message_id, info.lines, absnum)
+              counts['write_seconds'] += time.perf_counter() - t
+              counts['articles'] += 1
+              counts['bytes'] += sum(len(line) + 2 for line in info.lines)
+              if index is not None and offset is not None:
+                index.add(info.message_id, f.name, offset, length)
+              if bandwidth:
+                await bandwidth.wait(length)
+              if verbose:
+                print('flushed', file=out)
+            done = absnum
+#```
+#  \item \ti{The status information is updated.} Every \ti{checkpoint}
+#  articles, the mailbox is flushed to disk and the entry for this newsgroup
+#  in the status dictionary is set to the number of the last processed
+#  article. The status is then saved via the function \tc{checkpoint}, see
+#  section \ref{sec:checkpoints}. So the status entry never refers to an
+#  article that is not durably written to the mailbox, and an interrupted run
+#  resumes exactly where it stopped.
+#```
+            if checkpoint and relnum % config.get('checkpoint', 100) == 0:
+              sync()
+              status[g] = done
+              checkpoint()
+              if index is not None:
+                index.commit()
+#```
+#  After each batch but the last one, the status is saved as well. The entry
+#  is set to the end of the batch, as missing articles need not be
+#  requested again.
+#```
+        if checkpoint and hi < last:
+          sync()
+          done = status[g] = hi
+          checkpoint()
+          if index is not None:
+            index.commit()
+#```
+#  If reading the group is aborted, the articles written so far are flushed
+#  to disk as well and the status entry is updated accordingly before the
+#  error is passed on.
+#```
+    except BaseException:
+      if done is not None:
+        sync()
+        status[g] = done
+      raise
+    finally:
+      if index is not None:
+        index.commit()
+    sync()
+  if not total:
+    print('%s: No new articles for %s at %s' % 
+      (PROGRAM, g, config['server']), file=out)
+#```
+#  Finally the entry is set to the number of the last article that was
+#  requested for this group, as articles missing at the end of the range
+#  need not be requested again. The entry is never decreased, also if the
+#  last article number of the server is smaller. The number of articles
+#  found is returned.
+#```
+  status[g] = max(last, status.get(g, 0))
+  if checkpoint:
+    checkpoint()
+  return total
+#```
+#  \end{enumerate}
+#
+#  \subsection{Locking groups}
+#  \label{sec:grouplocks}
+#
+#  Two processes appending to the same mailbox at once, for instance
+#  overlapping runs started by \ti{cron}, would write every article twice.
+#  Therefore a group is only read while an exclusive lock on the file
+#  \ti{.\$group.lock} in the output directory is held. The coroutine
+#  \tc{read\_group} takes the lock and reads the group by
+#  \tc{fetch\_group}. If the lock is held by another process, which is
+#  reading the group right now, the group is skipped. The lock is not needed
+#  if there are no new articles.
+#
+#  The status of a process is read when it starts, so the entry of a group
+#  read by another process in the meantime would be outdated. Therefore the
+#  status is saved by \tc{checkpoint} once the lock is taken, which takes
+#  the entries changed by other processes as described in section
+#  \ref{sec:checkpoints}. The status database of section
+#  \ref{sec:statusdb} is queried for every entry anyway. The lock file is
+#  only used for locking, the status alone tells which articles were read,
+#  so resetting the status entry of a group is enough to read it again.
+#```
+async def read_group(conn, config, g, status, out=None, checkpoint=None,
+                     last=None):
+  if up_to_date(status, g, last):
+    return await fetch_group(conn, config, g, status, out, checkpoint, last)
+  with lock_group(config, g) as locked:
+    if not locked:
+      print('%s: %s is locked by another process' % (PROGRAM, g), file=out)
+      return 0
+    if checkpoint:
+      checkpoint()
+    return await fetch_group(conn, config, g, status, out, checkpoint, last)
+
+@contextlib.contextmanager
+def lock_group(config, g):
+  with file_lock(lock_path(config, g), blocking=False) as fd:
+    yield fd is not None
+#```
+#  The function \tc{lock\_path} returns the name of the lock file of a
+#  group, the function \tc{locked\_groups} the names of the groups with a
+#  lock file in the output directory, which are all groups read so far.
+#```
+def lock_path(config, g):
+  return os.path.join(config['outdir'], '.%s.lock' % g)
+
+def locked_groups(config):
+  try:
+    names = os.listdir(config['outdir'])
+  except FileNotFoundError:
+    return []
+  return [ name[1:-5] for name in names
+           if name.startswith('.') and name.endswith('.lock') ]
+#```
+#  \subsection{Reconnecting}
+#  \label{sec:reconnect}
+#
+#  Connections to news servers break, they are reset by the server or by
+#  network equipment in between, and a server may stop responding
+#  altogether. Every connection is therefore opened with a timeout, which
+#  is given by the configuration key \ti{timeout}. With the \tc{nntplib}
+#  engine, the timeout applies to every operation on the socket, with the
+#  \ti{asyncio} engine to establishing the connection and to every
+#  response.\newline
+#
+#  If a connection fails, it is discarded and a new connection is opened.
+#  The group that was being read is entered again and reading continues
+#  after the last article that was written to the mailbox, as
+#  \tc{fetch\_group} syncs the mailbox and updates the status entry when it
+#  is aborted. Before the connection is opened again, the reader waits for
+#  \ti{backoff} seconds, a delay which is doubled with every further
+#  failure up to \tc{BACKOFF\_MAX} seconds. After \ti{retries} failures in
+#  a row the error is passed on. A failure after articles were read
+#  mid-group starts a new series of failures, so a long group is read to the
+#  end over a connection that breaks every now and then.
+#```
+TIMEOUT = 60
+RETRIES = 5
+BACKOFF = 1
+BACKOFF_MAX = 300
+#```
+#  The function \tc{connection\_failed} tells whether an error is caused by
+#  a failed connection, which is worth opening again: a network error, a
+#  timeout, the connection closed by the server, a garbled response, or the
+#  response \ti{400}, with which a server refuses or ends a session
+#  (RFC 3977, section 5.1). Other errors, such as an unknown group or an
+#  error writing the mailbox, are passed on immediately.
+#```
+def connection_failed(e):
+  if isinstance(e, nntplib.NNTPTemporaryError):
+    return str(e.response).startswith('400')
+  if isinstance(e, OSError):
+    return isinstance(e, (ConnectionError, TimeoutError, socket.gaierror)) or \
+           e.errno in (errno.EHOSTUNREACH, errno.ENETUNREACH, errno.ENETDOWN)
+  return isinstance(e, (EOFError, nntplib.NNTPProtocolError))
+#```
+#  The function \tc{describe\_error} returns the message of an error for
+#  the log, or the name of its class if the message is empty, like for the
+#  \tc{EOFError} of a connection closed by the server. The generator
+#  \tc{backoff\_delays} yields the delays before the connection is opened
+#  again.
+#```
+def describe_error(e):
+  return str(e) or type(e).__name__
+
+def backoff_delays(config):
+  delay = config.get('backoff', BACKOFF)
+  for i in range(config.get('retries', RETRIES)):
+    yield min(delay, BACKOFF_MAX)
+    delay *= 2
+#```
+#  The function \tc{report\_reconnect} reports a failed connection, which
+#  is opened again after \tc{delay} seconds, and counts the reconnection in
+#  the metrics of the server. The function \tc{with\_reconnects} calls the
+#  function \tc{attempt}, which opens a connection of its own, until it
+#  does not fail for a failed connection or the retries are used up.
+#```
+def report_reconnect(config, e, delay):
+  print('%s: Connection to %s failed: %s, reconnecting in %g seconds' %
+        (PROGRAM, config['server'], describe_error(e), delay),
+        file=sys.stderr, flush=True)
+  stats.add(config, reconnects=1)
+
+def with_reconnects(config, attempt):
+  delays = backoff_delays(config)
+  while True:
+    try:
+      return attempt()
+    except Exception as e:
+      if not connection_failed(e):
+        raise
+      delay = next(delays, None)
+      if delay is None:
+        raise
+      report_reconnect(config, e, delay)
+      time.sleep(delay)
+#```
+#  \subsection{Reading the articles of a server}
+#
+#  Most servers allow several connections per account. The configuration key
+#  \ti{connections} gives the number of connections \tc{read\_articles} opens
+#  to a server. The connections are kept in a pool: the function
+#  \tc{acquire} takes an idle connection from the pool or opens a new one,
+#  after a group was read successfully the connection is put back into the
+#  pool. So the login is done only once per connection. A failed connection
+#  is closed and removed from the pool by the function \tc{discard}. The
+#  number of connections and the time spent opening them, reading the
+#  active list and processing the server as a whole are added to the metrics
+#  of the server.
+#```
+def read_articles(config, status, out=None, checkpoint=None):
+  start = time.perf_counter()
+  status = server_status(status, config)
+  opened = []
+  idle = queue.SimpleQueue()
+  lock = threading.Lock()
+
+  def acquire():
+    try:
+      return idle.get_nowait()
+    except queue.Empty:
+      with stats.timer('connect_seconds', config):
+        conn = NNTPLibConnection(connect(config))
+      stats.add(config, connections=1)
+      with lock:
+        opened.append(conn)
+      return conn
+
+  def discard(conn):
+    with lock:
+      opened.remove(conn)
+    conn.close()
+#```
+#  The function \tc{reconnecting} calls the function \tc{read} with a
+#  connection from the pool and reconnects as described in section
+#  \ref{sec:reconnect} if the connection fails. If \tc{read} reads the
+#  group \tc{g} and the group has no new articles, no connection is
+#  acquired. The reconnections are counted in the metrics of the server.
+#```
+  def reconnecting(read, g=None):
+    delays = backoff_delays(config)
+    while True:
+      conn = None
+      done = status.get(g) if g is not None else None
+      try:
+        if g is None or not up_to_date(status, g, active.get(g)):
+          conn = acquire()
+        result = read(conn)
+      except Exception as e:
+        if not connection_failed(e):
+          raise
+        if conn is not None:
+          discard(conn)
+        if g is not None and status.get(g) != done:
+          delays = backoff_delays(config)
+        delay = next(delays, None)
+        if delay is None:
+          raise
+        report_reconnect(config, e, delay)
+        time.sleep(delay)
+        continue
+      if conn is not None:
+        idle.put(conn)
+      return result
+#```
+#  Before reading the groups, the last article numbers of all groups are
+#  determined with the function \tc{read\_active} described in section
+#  \ref{sec:active}. A group is only entered, and a connection is only
+#  acquired for it, if it has new articles.
+#```
+  def read(g, out):
+    reconnecting(lambda conn: asyncio.run(
+      read_group(conn, config, g, status, out, checkpoint, active.get(g))), g)
+
+  try:
+    active = cached_active(config)
+    if active is None:
+      with stats.timer('active_seconds', config):
+        active = reconnecting(
+          lambda conn: asyncio.run(read_active(conn, config)))
+#```
+#  If only one connection is configured, the groups are read one after
+#  another via this single connection.
+#```
+    groups = group_names(config)
+    connections = min(config.get('connections', 1), len(groups))
+    if connections <= 1:
+      for g in groups:
+        read(g, out)
+      return
+#```
+#  Otherwise the groups are spread over a pool of threads, which is as large
+#  as the pool of connections. Each group is read completely via one
+#  connection, this way every mailbox still receives its articles in the
+#  order of the article numbers. The status entries written by the threads
+#  belong to different groups and don't interfere, the function
+#  \tc{checkpoint} must be safe to be called from several threads. As in
+#  section \ref{sec:concurrent}, the output of every group is buffered and
+#  printed in the order of the groups.
+#```
+    def read_buffered(g):
+      buf = io.StringIO()
+      read(g, buf)
+      return buf.getvalue()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=connections) as pool:
+      for result in pool.map(read_buffered, groups):
+        print(result, end='', file=out)
+#```
+#  Finally all connections of the pool are closed.
+#```
+  finally:
+    for conn in opened:
+      asyncio.run(conn.quit())
+    stats.add(config, seconds=time.perf_counter() - start)
+#```
+#  A server that fails must not keep the other servers from being read.
+#  Errors of the network and of the NNTP protocol, which remain after
+#  reconnecting, as well as errors writing the mailboxes are therefore
+#  caught for every server configuration. The function
+#  \tc{report\_failure} reports the error, then the next configuration is
+#  processed, and in the end the program exits with status 1. Other errors
+#  abort the program.
+#```
+SERVER_ERRORS = (OSError, EOFError, nntplib.NNTPError)
+
+def report_failure(config, e):
+  print('%s: Reading from %s failed: %s' %
+        (PROGRAM, config['server'], describe_error(e)),
+        file=sys.stderr, flush=True)
+#```
+#  \subsection{Concurrent processing of servers}
+#  \label{sec:concurrent}
+#
+#  Fetching articles is dominated by network latency, so one slow server
+#  would hold up all the others if servers were processed one after another.
+#  The function \tc{read\_articles\_concurrently} therefore processes the
+#  list of server configurations \tc{configs} with a pool of \tc{jobs}
+#  threads. The result has to be identical to a sequential run, which leads to
+#  three requirements:
+#
+#  \begin{enumerate}
+#  \item Two configurations sharing a news group write to the same mailbox and
+#  the same entry of the status dictionary. Such configurations are put into
+#  the same partition, the configurations of one partition are processed by one
+#  worker in their original order. Hence every worker writes only to its own
+#  mailbox files.
+#  \item Each worker operates on a private copy of the status dictionary. The
+#  entries for the groups of a configuration are merged back into the shared
+#  \tc{status} dictionary under a lock at every checkpoint and as soon as the
+#  configuration is processed, also when an error occurred.
+#  \item The output of every configuration is collected in a buffer. The
+#  buffers are printed in the order of the configurations.
+#  \end{enumerate}
+#
+#  The partitions are determined by merging the partitions of all
+#  configurations that share a group:
+#```
+def partition_configs(configs):
+  partitions = []
+  for i, config in enumerate(configs):
+    groups = set(group_names(config))
+    partition = [ i ]
+    for p in [ p for p in partitions
+               if any(groups.intersection(group_names(configs[j]))
+                      for j in p) ]:
+      partitions.remove(p)
+      partition.extend(p)
+    partitions.append(partition)
+  return [ [ configs[i] for i in sorted(p) ] for p in partitions ]
+#```
+#  Every partition is processed by the function \tc{read\_partition}. For
+#  every configuration there is a future, which receives the output of the
+#  configuration along with the error of a failed server, if any. Any other
+#  error is passed to the futures of the configuration and of the remaining
+#  configurations of the partition, which are not processed, just like in a
+#  sequential run. The status database of section \ref{sec:statusdb}
+#  can be shared by the threads, so no private copy is made of it.
+#  Otherwise the entries of the private copy are merged into the status at
+#  every checkpoint, and the entries the checkpoint took from other
+#  processes are copied back.
+#```
+def read_partition(partition, futures, status, lock, checkpoint=None):
+  if isinstance(status, StatusDB):
+    local = status
+  else:
+    with lock:
+      local = dict(status)
+  for i, config in enumerate(partition):
+    out = io.StringIO()
+    error = None
+
+    def merge():
+      if local is status:
+        return
+      with lock:
+        for g in group_names(config):
+          if g in local:
+            status[g] = local[g]
+
+    def save():
+      merge()
+      with lock:
+        saved = { g : status.get(g) for g in group_names(config) }
+      checkpoint()
+      with lock:
+        for g, last in saved.items():
+          if status.get(g) != last and local.get(g) == last:
+            local[g] = status[g]
+
+    try:
+      read_articles(config, local, out, save if checkpoint else None)
+    except SERVER_ERRORS as e:
+      error = e
+    except BaseException as e:
+      for c in partition[i:]:
+        futures[id(c)].set_exception(e)
+      return
+    finally:
+      merge()
+    futures[id(config)].set_result((out.getvalue(), error))
+#```
+#  The function \tc{read\_articles\_concurrently} submits the partitions to
+#  the thread pool and prints the outputs as they become available, failed
+#  servers are reported after their output. The number of failed servers is
+#  returned. Any other error, the first in the order of the configurations,
+#  is raised again after the output of all previous configurations was
+#  printed.
+#```
+def read_articles_concurrently(configs, status, jobs, checkpoint=None):
+  lock = threading.Lock()
+  futures = { id(c) : concurrent.futures.Future() for c in configs }
+  failed = 0
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+    for partition in partition_configs(configs):
+      pool.submit(read_partition, partition, futures, status, lock,
+                  checkpoint)
+    for config in configs:
+      output, error = futures[id(config)].result()
+      print(output, end='')
+      if error is not None:
+        report_failure(config, error)
+        failed += 1
+  return failed
+#```
+#  \subsection{Shards}
+#  \label{sec:shards}
+#
+#  To spread the groups over several processes or machines sharing the
+#  output directory and the status, every process is started with the
+#  argument \tc{--shard i/N} and reads only the groups of shard \ti{i} of
+#  \ti{N}. A group is assigned to a shard by the CRC-32 checksum of the
+#  server and the group name, so every process finds the same shards
+#  without any coordination, and the shards stay the same when groups are
+#  added or removed. The group locks described in section
+#  \ref{sec:grouplocks} keep processes with different shards, for instance
+#  while \ti{N} is being changed, from reading a group twice at once.
+#
+#  The function \tc{parse\_shard} parses the argument, the function
+#  \tc{shard\_groups} returns the entries of the groups of a configuration
+#  that belong to the shard.
+#```
+def parse_shard(value):
+  try:
+    i, n = [ int(v) for v in value.split('/') ]
+  except ValueError:
+    raise argparse.ArgumentTypeError('"%s" is not of the form i/N' % value)
+  if not 1 <= i <= n:
+    raise argparse.ArgumentTypeError(
+      'the shard must be between 1 and %d, but is %d' % (n, i))
+  return i, n
+
+def in_shard(config, g, shard):
+  key = '%s %s' % (server_name(config), g)
+  return zlib.crc32(key.encode()) % shard[1] == shard[0] - 1
+
+def shard_groups(config, shard):
+  return [ e for e, g in zip(config['groups'], group_names(config))
+           if in_shard(config, g, shard) ]
+#```
+#  \subsection{The asyncio engine}
+#  \label{sec:asyncio}
+#
+#  With hundreds of groups on many servers, a thread per connection becomes
+#  expensive. The \ti{asyncio} engine, which is selected with the
+#  \tc{--engine asyncio} argument, runs all servers, groups and article
+#  requests as coroutines on a single event loop.
+#
+#  The class \tc{AsyncNNTPConnection} is a connection object as described in
+#  section \ref{sec:connections}. It implements the parts of the NNTP protocol
+#  needed by \ti{news2mbox} on top of \tc{asyncio} streams. Responses are
+#  checked like \tc{nntplib} does it and errors are reported with the
+#  exception classes of \tc{nntplib}.
+#```
+class AsyncNNTPConnection:
+
+  def __init__(self, reader, writer, timeout=None):
+    self.reader = reader
+    self.writer = writer
+    self.timeout = timeout
+    self.deflate = None
+    self.overview_fmt = None
+#```
+#  Reading a line from the server raises \tc{EOFError} when the connection is
+#  closed. The terminating CRLF is removed. On a compressed connection, the
+#  lines are read from the \tc{Deflate} object described in section
+#  \ref{sec:compress}, which is fed with the data from the server.
+#```
+  async def getline(self):
+    if self.deflate is None:
+      line = await self.reader.readline()
+    else:
+      line = self.deflate.readline()
+      while line is None:
+        data = await self.reader.read(2**16)
+        if not data:
+          line = self.deflate.readline(len(self.deflate.buffer))
+        else:
+          self.deflate.feed(data)
+          line = self.deflate.readline()
+    if not line:
+      raise EOFError
+    if line[-2:] == b'\r\n':
+      return line[:-2]
+    return line.rstrip(b'\r\n')
+#```
+#  A response line is decoded and its status code is checked. The method
+#  \tc{getlongresp} additionally reads the following lines of a multi-line
+#  response up to the terminating dot and undoes the dot-stuffing. If a
+#  response does not arrive within the timeout of the connection, the
+#  builtin \tc{TimeoutError} is raised like for the sockets of
+#  \tc{nntplib}, see section \ref{sec:reconnect}.
+#```
+  async def getresp(self):
+    return await self.timed(self.readresp())
+
+  async def getlongresp(self):
+    return await self.timed(self.readlongresp())
+
+  async def timed(self, coro):
+    try:
+      return await asyncio.wait_for(coro, self.timeout)
+    except asyncio.TimeoutError:
+      raise TimeoutError('timed out') from None
+
+  async def readresp(self):
+    resp = (await self.getline()).decode(nntplib.NNTP.encoding,
+                                         nntplib.NNTP.errors)
+    if resp[:1] == '4':
+      raise nntplib.NNTPTemporaryError(resp)
+    if resp[:1] == '5':
+      raise nntplib.NNTPPermanentError(resp)
+    if resp[:1] not in '123':
+      raise nntplib.NNTPProtocolError(resp)
+    return resp
+
+  async def readlongresp(self):
+    resp = await self.readresp()
+    lines = []
+    while True:
+      line = await self.getline()
+      if line == b'.':
+        return resp, lines
+      if line.startswith(b'..'):
+        line = line[1:]
+      lines.append(line)
+
+  def putcmd(self, line):
+    data = line.encode(nntplib.NNTP.encoding, nntplib.NNTP.errors) + b'\r\n'
+    if self.deflate is not None:
+      data = self.deflate.compress(data)
+    self.writer.write(data)
+
+  async def drain(self):
+    if self.deflate is not None:
+      self.writer.write(self.deflate.flush())
+    await self.writer.drain()
+
+  async def shortcmd(self, line):
+    self.putcmd(line)
+    await self.drain()
+    return await self.getresp()
+
+  async def longcmd(self, line):
+    self.putcmd(line)
+    await self.drain()
+    return await self.getlongresp()
+#```
+#  The coroutine \tc{open} establishes and authenticates a connection in the
+#  same way as the function \tc{connect} does for \tc{nntplib}, with the
+#  timeout of the configuration: TLS is negotiated via \ti{STARTTLS} with
+#  the same SSL context \tc{nntplib} uses and the credentials are taken
+#  from the configuration or, like \tc{nntplib} does it, from the
+#  \tc{\~{}/.netrc} file. Compression is started as described in section
+#  \ref{sec:compress}.
+#```
+  @classmethod
+  async def open(cls, config):
+    timeout = config.get('timeout', TIMEOUT)
+    try:
+      reader, writer = await asyncio.wait_for(asyncio.open_connection(
+        config['server'], config.get('port', nntplib.NNTP_PORT),
+        limit=2**20), timeout)
+    except asyncio.TimeoutError:
+      raise TimeoutError('timed out') from None
+    conn = cls(reader, writer, timeout)
+    try:
+      await conn.getresp()
+      if config['ssl']:
+        await conn.shortcmd('STARTTLS')
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        await writer.start_tls(context, server_hostname=config['server'])
+      user, password = config.get('user'), config.get('password')
+      if not user:
+        try:
+          auth = netrc.netrc().authenticators(config['server'])
+          if auth:
+            user, password = auth[0], auth[2]
+        except OSError:
+          pass
+      if user:
+        resp = await conn.shortcmd('AUTHINFO USER ' + user)
+        if resp.startswith('381'):
+          if not password:
+            raise nntplib.NNTPReplyError(resp)
+          await conn.shortcmd('AUTHINFO PASS ' + password)
+      if config.get('compress'):
+        await conn.start_compression(config)
+    except:
+      writer.close()
+      raise
+    return conn
+
+#```
+#  Compression is negotiated like by the function \tc{start\_compression}.
+#```
+  async def start_compression(self, config=None):
+    resp, lines = await self.longcmd('CAPABILITIES')
+    if not any(l.split()[:1] == [ b'COMPRESS' ] and b'DEFLATE' in l.split()
+               for l in lines):
+      return False
+    try:
+      resp = await self.shortcmd('COMPRESS DEFLATE')
+    except nntplib.NNTPError:
+      return False
+    if not resp.startswith('206'):
+      return False
+    self.deflate = Deflate(config)
+    return True
+
+  async def group(self, name):
+    resp = await self.shortcmd('GROUP ' + name)
+    if not resp.startswith('211'):
+      raise nntplib.NNTPReplyError(resp)
+    words = resp.split()
+    return int(words[1]), int(words[2]), int(words[3])
+
+  async def listgroup(self, name, first, last):
+    try:
+      resp, lines = await self.longcmd(
+        'LISTGROUP %s %d-%d' % (name, first, last))
+    except nntplib.NNTPPermanentError:
+      await self.group(name)
+      return list(range(first, last + 1))
+    return [ int(l) for l in lines ]
+
+  async def active(self, groups):
+    last = {}
+    for pattern in wildmats(groups):
+      resp, lines = await self.longcmd('LIST ACTIVE ' + pattern)
+      for line in lines:
+        words = line.decode(nntplib.NNTP.encoding, nntplib.NNTP.errors).split()
+        last[words[0]] = int(words[1])
+    return last
+#```
+#  The overview format is requested once per connection, the overview lines
+#  are parsed with the same helper functions \tc{nntplib} uses.
+#```
+  async def over(self, first, last):
+    if self.overview_fmt is None:
+      try:
+        resp, lines = await self.longcmd('LIST OVERVIEW.FMT')
+        self.overview_fmt = nntplib._parse_overview_fmt(
+          [ l.decode(nntplib.NNTP.encoding, nntplib.NNTP.errors)
+            for l in lines ])
+      except nntplib.NNTPPermanentError:
+        self.overview_fmt = nntplib._DEFAULT_OVERVIEW_FMT[:]
+    try:
+      resp, lines = await self.longcmd('OVER %d-%d' % (first, last))
+    except nntplib.NNTPTemporaryError as e:
+      if not no_articles_in_range(e):
+        raise
+      return []
+    return nntplib._parse_overview(
+      [ l.decode(nntplib.NNTP.encoding, nntplib.NNTP.errors) for l in lines ],
+      self.overview_fmt)
+#```
+#  Articles are pipelined exactly like in the function \tc{fetch\_articles}
+#  of section \ref{sec:pipelining}.
+#```
+  async def articles(self, numbers, window):
+    pending = collections.deque()
+    try:
+      for absnum in numbers:
+        self.putcmd('ARTICLE %d' % absnum)
+        pending.append(absnum)
+        if len(pending) >= window:
+          await self.drain()
+          yield await self.receive_article(pending.popleft())
+      await self.drain()
+      while pending:
+        yield await self.receive_article(pending.popleft())
+    except GeneratorExit:
+      await self.drain()
+      while pending:
+        await self.receive_article(pending.popleft())
+      raise
+
+  async def receive_article(self, absnum):
+    try:
+      resp, lines = await self.getlongresp()
+    except nntplib.NNTPTemporaryError as e:
+      if not str(e.response).startswith(MISSING_ARTICLE):
+        raise
+      return absnum, None
+    words = resp.split()
+    return absnum, nntplib.ArticleInfo(int(words[1]), words[2], lines)
+
+  async def date(self):
+    resp = await self.shortcmd('DATE')
+    if not resp.startswith('111'):
+      raise nntplib.NNTPReplyError(resp)
+
+  async def quit(self):
+    try:
+      await self.shortcmd('QUIT')
+    except (OSError, EOFError, nntplib.NNTPError):
+      pass
+    finally:
+      self.close()
+
+  def close(self):
+    if self.deflate is not None:
+      self.deflate.record()
+    self.writer.close()
+#```
+#  The coroutine \tc{read\_server\_async} is the counterpart of the function
+#  \tc{read\_articles}. The groups of the server are read by
+#  \ti{connections} worker coroutines, which take the next group from a
+#  common iterator. The connections are pooled and groups without new
+#  articles are skipped just like in \tc{read\_articles}, failed
+#  connections are opened again by the coroutine \tc{reconnecting} just like
+#  by the function of the same name. The output of every group is buffered
+#  and printed in the order of the groups. A worker stops at the first
+#  error, the error of the first failed group is raised after the output of
+#  the previous groups was printed. The same metrics of the server are
+#  recorded.
+#```
+async def read_server_async(config, status, out=None, checkpoint=None):
+  start = time.perf_counter()
+  status = server_status(status, config)
+  groups = list(enumerate(group_names(config)))
+  todo = iter(groups)
+  bufs = [ io.StringIO() for g in groups ]
+  errors = {}
+  opened = []
+  idle = []
+
+  async def acquire():
+    if idle:
+      return idle.pop()
+    with stats.timer('connect_seconds', config):
+      conn = await AsyncNNTPConnection.open(config)
+    stats.add(config, connections=1)
+    opened.append(conn)
+    return conn
+
+  async def reconnecting(read, g=None):
+    delays = backoff_delays(config)
+    while True:
+      conn = None
+      done = status.get(g) if g is not None else None
+      try:
+        if g is None or not up_to_date(status, g, active.get(g)):
+          conn = await acquire()
+        result = await read(conn)
+      except Exception as e:
+        if not connection_failed(e):
+          raise
+        if conn is not None:
+          opened.remove(conn)
+          conn.close()
+        if g is not None and status.get(g) != done:
+          delays = backoff_delays(config)
+        delay = next(delays, None)
+        if delay is None:
+          raise
+        report_reconnect(config, e, delay)
+        await asyncio.sleep(delay)
+        continue
+      if conn is not None:
+        idle.append(conn)
+      return result
+
+  async def worker():
+    for i, g in todo:
+      try:
+        await reconnecting(
+          lambda conn: read_group(conn, config, g, status, bufs[i],
+                                  checkpoint, active.get(g)), g)
+      except Exception as e:
+        errors[i] = e
+        return
+
+  try:
+    active = cached_active(config)
+    if active is None:
+      with stats.timer('active_seconds', config):
+        active = await reconnecting(lambda conn: read_active(conn, config))
+    connections = max(min(config.get('connections', 1), len(groups)), 1)
+    await asyncio.gather(*[ worker() for i in range(connections) ])
+  finally:
+    for conn in opened:
+      await conn.quit()
+    stats.add(config, seconds=time.perf_counter() - start)
+  for i, g in groups:
+    print(bufs[i].getvalue(), end='', file=out)
+    if i in errors:
+      raise errors[i]
+#```
+#  The coroutine \tc{read\_articles\_async} processes all configurations at
+#  once. As in section \ref{sec:concurrent}, configurations sharing a group
+#  are processed one after another and the output is printed in the order of
+#  the configurations, failed servers are reported and counted like by
+#  \tc{read\_articles\_concurrently}. As all coroutines run in a single
+#  thread, they can share the \tc{status} dictionary without any locking.
+#```
+async def read_articles_async(configs, status, checkpoint=None):
+  loop = asyncio.get_running_loop()
+  futures = { id(c) : loop.create_future() for c in configs }
+  failed = 0
+
+  async def read_partition_async(partition):
+    for i, config in enumerate(partition):
+      out = io.StringIO()
+      error = None
+      try:
+        await read_server_async(config, status, out, checkpoint)
+      except SERVER_ERRORS as e:
+        error = e
+      except Exception as e:
+        for c in partition[i:]:
+          futures[id(c)].set_exception(e)
+        return
+      futures[id(config)].set_result((out.getvalue(), error))
+
+  tasks = [ asyncio.ensure_future(read_partition_async(p))
+            for p in partition_configs(configs) ]
+  try:
+    for config in configs:
+      output, error = await futures[id(config)]
+      print(output, end='')
+      if error is not None:
+        report_failure(config, error)
+        failed += 1
+    return failed
+  finally:
+    await asyncio.gather(*tasks)
+    for f in futures.values():
+      if f.done() and not f.cancelled():
+        f.exception()
+#```
+#  \subsection{Daemon mode}
+#  \label{sec:daemon}
+#
+#  Run from \ti{cron}, every run of \ti{news2mbox} pays for starting the
+#  program and for connecting and logging in to every server, although most
+#  groups have no new articles. With the argument \tc{--daemon}, the program
+#  keeps running on the \ti{asyncio} engine and keeps one connection to every
+#  server open. Every group is polled on its own schedule, which adapts to
+#  the rate at which articles are posted to the group: if a poll found new
+#  articles, the interval until the next poll is halved, otherwise it is
+#  doubled, within the bounds given by the configuration keys
+#  \ti{poll\_min} and \ti{poll\_max}. So busy groups are polled often and
+#  dead groups rarely. The following constants are the defaults of these
+#  keys and of the key \ti{keepalive}.
+#```
+POLL_MIN = 60
+POLL_MAX = 3600
+KEEPALIVE = 120
+#```
+#  The coroutine \tc{poll\_server} polls the groups of the server
+#  configuration \tc{config} until the event \tc{stopping} is set. The
+#  dictionaries \tc{due} and \tc{interval} hold the time of the next poll and
+#  the current interval of every group, all groups are polled at once
+#  after the start.
+#```
+async def poll_server(config, status, checkpoint, stopping, locks):
+  status = server_status(status, config)
+  groups = group_names(config)
+  due = dict.fromkeys(groups, time.monotonic())
+  interval = { g : group_config(config, g).get('poll_min', POLL_MIN)
+               for g in groups }
+  keepalive = config.get('keepalive', KEEPALIVE)
+  retry = config.get('poll_min', POLL_MIN)
+  conn = None
+  used = time.monotonic()
+  try:
+    while not stopping.is_set():
+      now = time.monotonic()
+      ready = [ g for g in groups if due[g] <= now ]
+      try:
+#```
+#  When groups are due, the connection is opened if there is none, and the
+#  last article numbers of all due groups are requested at once with
+#  \ti{LIST ACTIVE} as described in section \ref{sec:active}. Then the due
+#  groups are read by the coroutine \tc{read\_group}, which saves the
+#  status at checkpoints and after every group with new articles. A group
+#  shared with another server configuration is read by one configuration at
+#  a time, which is ensured by the \tc{asyncio} lock of the group in the
+#  dictionary \tc{locks}. The output of a poll is only printed if the poll
+#  found new articles. An error of a group that is not caused by a failed
+#  connection as described in section \ref{sec:reconnect}, for instance
+#  the response \ti{411} to a group the server does not carry, is reported
+#  and the group is polled again as if it had no new articles.
+#```
+        if ready:
+          if conn is None:
+            with stats.timer('connect_seconds', config):
+              conn = await AsyncNNTPConnection.open(config)
+            stats.add(config, connections=1)
+          try:
+            last = await conn.active(ready)
+          except nntplib.NNTPPermanentError:
+            last = {}
+          for g in ready:
+            options = group_config(config, g)
+            out = io.StringIO()
+            async with locks[g]:
+              try:
+                found = await read_group(conn, config, g, status, out,
+                                         checkpoint, last.get(g))
+              except SERVER_ERRORS as e:
+                if connection_failed(e):
+                  raise
+                print('%s: %s at %s: %s' %
+                      (PROGRAM, g, config['server'], describe_error(e)),
+                      file=sys.stderr, flush=True)
+                found = 0
+            if found:
+              print(out.getvalue(), end='', flush=True)
+              interval[g] = max(interval[g] / 2,
+                                options.get('poll_min', POLL_MIN))
+            else:
+              interval[g] = min(interval[g] * 2,
+                                options.get('poll_max', POLL_MAX))
+            due[g] = time.monotonic() + interval[g]
+          retry = config.get('poll_min', POLL_MIN)
+#```
+#  Servers close connections that are idle for some time. If no group is
+#  due, but the connection was not used for \ti{keepalive} seconds, a
+#  \ti{DATE} command is sent to keep it alive. Any response will do, also
+#  the error of a server not supporting this command. Otherwise the coroutine
+#  sleeps until the next group is due, the connection needs to be kept
+#  alive or the daemon is stopped.
+#```
+        elif conn is not None and now >= used + keepalive:
+          with contextlib.suppress(nntplib.NNTPPermanentError):
+            await conn.date()
+        else:
+          wakeup = min(due.values())
+          if conn is not None:
+            wakeup = min(wakeup, used + keepalive)
+          try:
+            await asyncio.wait_for(stopping.wait(), wakeup - now)
+          except asyncio.TimeoutError:
+            pass
+          continue
+        used = time.monotonic()
+#```
+#  If the connection fails, it is closed and the groups that were not polled
+#  are polled again after a delay, in which a new connection is opened. The
+#  delay starts with \ti{poll\_min} seconds and is doubled with every
+#  failure in a row, up to \ti{poll\_max} seconds. This includes the
+#  errors \tc{SERVER\_ERRORS} of section \ref{sec:reconnect} raised while
+#  opening the connection, for instance if the server rejects the greeting
+#  or the login with a permanent error, so that such a server does not stop
+#  the daemon and the other servers are still polled.
+#```
+      except SERVER_ERRORS as e:
+        print('%s: Connection to %s failed: %s, retrying in %g seconds' %
+              (PROGRAM, config['server'], describe_error(e), retry),
+              file=sys.stderr, flush=True)
+        if conn is not None:
+          conn.close()
+          conn = None
+        now = time.monotonic()
+        for g in groups:
+          if due[g] <= now:
+            due[g] = now + retry
+        retry = min(retry * 2, config.get('poll_max', POLL_MAX))
+#```
+#  When the daemon is stopped, the connection is closed.
+#```
+  finally:
+    if conn is not None:
+      await conn.quit()
+#```
+#  The coroutine \tc{run\_daemon} polls all server configurations
+#  concurrently until the program receives the signal \ti{SIGINT} or
+#  \ti{SIGTERM}, or until the event \tc{stopping} is set.
+#```
+async def run_daemon(configs, status, checkpoint=None, stopping=None):
+  if stopping is None:
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+      loop.add_signal_handler(signum, stopping.set)
+  locks = collections.defaultdict(asyncio.Lock)
+  await asyncio.gather(*[ poll_server(config, status, checkpoint, stopping,
+                                      locks)
+                          for config in configs ])
+#```
+#  \section{Program invocation and usage}
+#
+#  \subsection{Command line arguments}
+#  \label{sec:argparser}
+#
+#  The program name and the program version are set here.
+#```
+PROGRAM = 'news2mbox'
+VERSION = '0.1'
+#```
+#  The function \tc{parse\_arguments} creates an argument parser and parses
+#  command line arguments. The following arguments are supported:
+#
+#  \begin{tabularx}{\linewidth}{lX}
+#   Argument & Meaning \\ \hline
+#   -c, --config-dir & The configuration directory. \\
+#   -j, --jobs & The number of server configurations processed concurrently,
+#   see section \ref{sec:concurrent}. The default is 1. \\
+#   --engine & The engine used to read articles, either \ti{nntplib} or
+#   \ti{asyncio}, see section \ref{sec:asyncio}. The default is
+#   \ti{nntplib}. The \ti{asyncio} engine processes all configurations
+#   concurrently, \tc{--jobs} is ignored. \\
+#   --status-db & Keep the status in a database instead of the status
+#   file, see section \ref{sec:statusdb}. \\
+#   --shard & Read only the groups of shard \ti{i} of \ti{N}, given as
+#   \ti{i/N}, see section \ref{sec:shards}. \\
+#   --daemon & Keep running and poll the groups on their own schedules
+#   until the program is terminated, see section \ref{sec:daemon}. \\
+#   -q, --quiet & Print no status line for every article. \\
+#   --stats-json & A file to which the metrics of the run are written as
+#   JSON, see section \ref{sec:stats}. \\
+#   --prometheus & A file to which the metrics of the run are written for
+#   the textfile collector of \ti{Prometheus}. \\
+#   --version & Print version information. \\
+#   --help & Print usage information, as provided by the \tc{argparse} module.
+#  \end{tabularx}\newline
+#
+#  Without a command, the articles of all configured groups are read. The
+#  following commands work on indexed mailboxes, see section
+#  \ref{sec:mboxindex}:\newline
+#
+#  \begin{tabularx}{\linewidth}{lX}
+#   Command & Meaning \\ \hline
+#   get \ti{mbox} \ti{key} & Print the article of the mailbox with the
+#   given article number or message ID. \\
+#   reindex \ti{mbox} \ldots & Build the indexes of the mailboxes from
+#   scratch. \\
+#  \end{tabularx}\newline
+#
+#  The command \ti{compact} \ti{group} \ldots compacts the mailboxes of
+#  the given configured groups, or of all of them, as described in section
+#  \ref{sec:compact}. With the argument \tc{--dedup}, duplicate articles are
+#  removed.
+#
+#  Here it is to be noted that the configuration directory is set to the
+#  default value \tc{\$HOME/.news2box} if none is given by the user.
+#```
+def parse_arguments():
+  parser = argparse.ArgumentParser(prog=PROGRAM)
+
+  parser.add_argument('-c', '--config-dir',
+    dest='configdir',
+    default=os.path.join(os.environ['HOME'], '.%s' % PROGRAM),
+    help='Directory where configuration and status files are stored')
+  parser.add_argument('-j', '--jobs',
+    dest='jobs',
+    type=int,
+    default=1,
+    help='Number of server configurations processed concurrently')
+  parser.add_argument('--engine',
+    dest='engine',
+    choices=[ 'nntplib', 'asyncio' ],
+    default='nntplib',
+    help='Engine used to read articles')
+  parser.add_argument('--status-db',
+    action='store_true',
+    dest='status_db',
+    default=False,
+    help='Keep the status in the database status.db')
+  parser.add_argument('--shard',
+    dest='shard',
+    type=parse_shard,
+    metavar='i/N',
+    help='Read only the groups of shard i of N')
+  parser.add_argument('--daemon',
+    action='store_true',
+    dest='daemon',
+    default=False,
+    help='Keep running and poll the groups until terminated')
+  parser.add_argument('-q', '--quiet',
+    action='store_true',
+    dest='quiet',
+    default=False,
+    help='Print no status line for every article')
+  parser.add_argument('--stats-json',
+    dest='stats_json',
+    metavar='FILE',
+    help='File to which the metrics of the run are written as JSON')
+  parser.add_argument('--prometheus',
+    dest='prometheus',
+    metavar='FILE',
+    help='File to which the metrics of the run are written for Prometheus')
+  parser.add_argument('--version',
+    action='store_true',
+    dest='version',
+    default=False,
+    help='Display version information')
+
+  commands = parser.add_subparsers(dest='command', metavar='command')
+  get = commands.add_parser('get',
+    help='Print an article of an indexed mailbox')
+  get.add_argument('mbox',
+    help='The mailbox')
+  get.add_argument('key',
+    help='The article number or message ID of the article')
+  reindex = commands.add_parser('reindex',
+    help='Build the indexes of mailboxes from scratch')
+  reindex.add_argument('mbox',
+    nargs='+',
+    help='The mailboxes')
+  compact = commands.add_parser('compact',
+    help='Remove old articles from the mailboxes of the configured groups')
+  compact.add_argument('--dedup',
+    action='store_true',
+    dest='dedup',
+    default=False,
+    help='Remove duplicate articles as well')
+  compact.add_argument('groups',
+    nargs='*',
+    help='The groups, by default all configured groups')
+
+  args = parser.parse_args()
+  if args.jobs < 1:
+    parser.error('--jobs must be at least 1')
+  return args
+#```
+#  \subsection{Main program loop}
+#```
+if __name__ == '__main__':      
+#```
+#  The main program involves four steps:
+#
+#  \begin{enumerate}
+#   \item \ti{Arguments are parsed.} The parsing is done by the function
+#   \tc{parse\_arguments} described in section \ref{sec:argparser}. If the
+#   version argument is given, the version information is printed and then the
+#   program exits.
+#```
+  args = parse_arguments()
+
+  if args.version:
+    print('This is %s version %s' % (PROGRAM, VERSION))
+    sys.exit(0)
+#```
+#  The commands working on indexed mailboxes are executed and the program
+#  exits. An article key consisting of digits is taken as article number,
+#  any other key as message ID, the angle brackets of which may be omitted.
+#```
+  try:
+    if args.command == 'get':
+      if args.key.isdigit():
+        key = int(args.key)
+      else:
+        key = '<%s>' % args.key.strip('<>')
+      with MboxIndex(args.mbox) as index:
+        article = index.get(key)
+      if article is None:
+        print('%s: No article %s in %s' % (PROGRAM, args.key, args.mbox),
+              file=sys.stderr)
+        sys.exit(1)
+      sys.stdout.buffer.write(article)
+      sys.exit(0)
+    elif args.command == 'reindex':
+      for mbox in args.mbox:
+        rebuild_index(mbox)
+      sys.exit(0)
+  except (OSError, ValueError) as e:
+    print('%s: %s' % (PROGRAM, e), file=sys.stderr)
+    sys.exit(1)
+#```
+#  \item \ti{Status and configuration files are read.} In this step paths to
+#  the status and configuration file are created. The files are located in the
+#  configuration directory, the status file is called \tc{status.json} and  
+#  the configuration file is called \tc{config.json}. \newline
+#
+#  The files are then read via the functions \tc{read\_status} which is
+#  described in section \ref{sec:readstatus} and \tc{read\_configs} which is
+#  described in section \ref{sec:readconfigs}. The run metrics described in
+#  section \ref{sec:stats} include the time of the whole run.
+#
+#  With the argument \tc{--status-db}, the status is kept in the database
+#  \tc{status.db} described in section \ref{sec:statusdb} instead, into
+#  which the status file is migrated when it is created.
+#```
+  start = time.perf_counter()
+  statusfile = os.path.join(args.configdir, 'status.json')
+  configfile = os.path.join(args.configdir, 'config.json')
+  configs = read_config(configfile)
+  if args.status_db:
+    status = StatusDB(os.path.join(args.configdir, 'status.db'), statusfile,
+                      configs)
+    checkpoint = status.checkpoint
+  else:
+    status = read_status(statusfile)
+    checkpoint = make_checkpoint(statusfile, status)
+#```
+#  \item \ti{Read articles for each server.} Then follows the loop over the
+#  list of server configurations. The number of failed servers is counted
+#  in \tc{failed}.
+#```
+  failed = 0
+  try:
+    for config in configs:
+#```
+#  Here some default configuration values are set. If not output directory is
+#  specified in the configuration, it is set to \tc{\$HOME/news}. Environment
+#  variables used in this configuration property are replaced by their values.
+#```
+      config['outdir'] = os.path.expandvars(
+              config.get('outdir', '$HOME/news'))
+#```
+#  Cached data is stored in the configuration directory, if no other
+#  directory is configured.
+#```
+      config['cachedir'] = os.path.expandvars(
+              config.get('cachedir', args.configdir))
+#```
+#  SSL usage is turned on if no other information is specified in the
+#  configuration.
+#```
+      if not 'ssl' in config:
+        config['ssl'] = True
+#```
+#  The argument \tc{--quiet} suppresses the status lines of the articles for
+#  all configurations.
+#```
+      if args.quiet:
+        config['quiet'] = True
+#```
+#  Group patterns are expanded as described in section \ref{sec:wildmat}.
+#  If this fails, the server is reported as failed and left out.
+#  The command \ti{compact} works on the groups read so far, patterns are
+#  matched against the groups with a lock file instead, and only the groups
+#  given as arguments are kept.
+#```
+      if args.command == 'compact':
+        config['groups'] = match_groups(config['groups'],
+                                        locked_groups(config))
+        if args.groups:
+          config['groups'] = [ e for e, g in zip(config['groups'],
+                                                 group_names(config))
+                               if g in args.groups ]
+      else:
+        try:
+          expand_groups(config)
+        except SERVER_ERRORS as e:
+          report_failure(config, e)
+          failed += 1
+          config['groups'] = []
+#```
+#  With the argument \tc{--shard}, only the groups of the shard are kept as
+#  described in section \ref{sec:shards}, configurations without any of
+#  them are left out.
+#```
+      if args.shard:
+        config['groups'] = shard_groups(config, args.shard)
+    configs = [ config for config in configs if config['groups'] ]
+#```
+#  Finally the articles for the configurations are read via the function
+#  \tc{read\_articles} described in section \ref{sec:readarticles}. If more
+#  than one job is requested, this is done concurrently by the function
+#  \tc{read\_articles\_concurrently} described in section
+#  \ref{sec:concurrent}. The \ti{asyncio} engine reads all configurations
+#  via \tc{read\_articles\_async} described in section \ref{sec:asyncio}.
+#  In all cases the status is saved at checkpoints as described in section
+#  \ref{sec:checkpoints}. In daemon mode, the configurations are polled by
+#  \tc{run\_daemon} described in section \ref{sec:daemon}. The command
+#  \ti{compact} compacts the mailboxes by \tc{compact\_group} described in
+#  section \ref{sec:compact} instead. Servers that fail are reported and
+#  counted as described in section \ref{sec:readarticles}, the other
+#  servers are read nevertheless.
+#```
+    if args.command == 'compact':
+      for config in configs:
+        for g in group_names(config):
+          compact_group(config, g, args.dedup)
+    elif args.daemon:
+      asyncio.run(run_daemon(configs, status, checkpoint))
+    elif args.engine == 'asyncio':
+      failed = asyncio.run(read_articles_async(configs, status, checkpoint))
+    elif args.jobs > 1:
+      failed = read_articles_concurrently(configs, status, args.jobs,
+                                          checkpoint)
+    else:
+      for config in configs:
+        try:
+          read_articles(config, status, checkpoint=checkpoint)
+        except SERVER_ERRORS as e:
+          report_failure(config, e)
+          failed += 1
+#```
+#  \item \ti{Write status information.} The function \tc{read\_message} updates
+#  the information in the \tc{status} dictionary. This information is written
+#  back into the status file for the use by future invocations of 
+#  \ti{news2mbox}. This is done by a last checkpoint, which merges the
+#  changes into the status file as described in section
+#  \ref{sec:checkpoints}. The status database is closed, which
+#  writes the changed entries. Then the metrics of the run are written, also
+#  if the run failed.
+#```
+  finally:
+    if args.status_db:
+      status.close()
+    else:
+      checkpoint()
+    stats.add(seconds=time.perf_counter() - start)
+    if args.stats_json:
+      write_json(args.stats_json, stats.summary())
+    if args.prometheus:
+      write_text(args.prometheus, stats.prometheus())
+#```
+#  If a server failed, the program exits with status 1.
+#```
+  if failed:
+    sys.exit(1)
 #```
 #  \end{enumerate}
 #
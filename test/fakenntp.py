@@ -0,0 +1,505 @@
+"""A scriptable fake NNTP server for tests and benchmarks.
+
+The server keeps its news groups in memory and speaks enough of RFC 3977 for
+news2mbox. Responses can be delayed by a fixed latency, which is applied per
+response and does not serialize pipelined commands, so the server behaves like
+a remote server with the given round trip time. The bandwidth of every
+connection and the number of connections can be limited, and connections
+can be made to break after a number of articles.
+
+Run as a script, the module serves synthetic groups until it is interrupted.
+"""
+import argparse
+import calendar
+import collections
+import fnmatch
+import heapq
+import itertools
+import random
+import socket
+import socketserver
+import threading
+import time
+import zlib
+
+
+def make_article(group, number, size=1000):
+    """Return the lines of a synthetic article of about `size` bytes."""
+    lines = [ b"From: poster%d@example.com" % (number % 17),
+              b"Newsgroups: " + group.encode(),
+              b"Subject: Article %d in %s" % (number, group.encode()),
+              b"Date: Fri, 16 Oct 2026 12:00:00 +0000",
+              b"Message-ID: <%d.%s@fake>" % (number, group.encode()),
+              b"" ]
+    body = b"Line of article %d, which is part of the body." % number
+    while sum(len(l) + 1 for l in lines) < size:
+        lines.append(body)
+    return lines
+
+
+def synthetic_group(name, count, size=1000, first=1, gaps=()):
+    """Return a dict mapping article numbers to articles for a group.
+
+    Articles are numbered from `first` to `first + count - 1`, numbers in
+    `gaps` are left out. `size` is either the size of all articles or a
+    tuple of the smallest and largest size, the sizes are then random but
+    the same for every call.
+    """
+    gaps = set(gaps)
+    if isinstance(size, tuple):
+        rng = random.Random(count)
+        sizes = { n : rng.randint(*size) for n in range(first, first + count) }
+    else:
+        sizes = collections.defaultdict(lambda: size)
+    return { n : make_article(name, n, sizes[n])
+             for n in range(first, first + count) if n not in gaps }
+
+
+def synthetic_groups(names, count, size=1000, gaps=0.0, crossposts=0.0,
+                     seed=0):
+    """Return a dict of synthetic groups for benchmarks.
+
+    Every group has `count` article numbers, a fraction `gaps` of which is
+    left out. A fraction `crossposts` of the articles of every group but the
+    first is a cross-post of an article of a previous group.
+    """
+    rng = random.Random(seed)
+    groups = {}
+    for i, name in enumerate(names):
+        numbers = range(1, count + 1)
+        groups[name] = synthetic_group(
+            name, count, size, gaps=rng.sample(numbers, int(count * gaps)))
+        if i == 0:
+            continue
+        targets = rng.sample(sorted(groups[name]),
+                             int(len(groups[name]) * crossposts))
+        for target in targets:
+            source = names[rng.randrange(i)]
+            crosspost(groups, source, rng.choice(sorted(groups[source])),
+                      name, target)
+    return groups
+
+
+def text_group(name, count, size=4000):
+    """Return a group with articles with bodies of random words.
+
+    Unlike the repetitive bodies of `synthetic_group`, these bodies compress
+    about as well as real text. The articles are the same for every call.
+    """
+    rng = random.Random(0)
+    words = [ "".join(rng.choice("etaoinshrdlucmfwyp") for i in
+                      range(rng.randint(2, 9))).encode() for j in range(5000) ]
+    group = {}
+    for n in range(1, count + 1):
+        lines = make_article(name, n, 0)
+        while sum(len(l) + 1 for l in lines) < size:
+            lines.append(b" ".join(rng.choice(words) for i in range(12)))
+        group[n] = lines
+    return group
+
+
+def header(lines, name):
+    """Return the value of a header of an article."""
+    for line in lines[:lines.index(b"")]:
+        key, sep, value = line.partition(b": ")
+        if key.lower() == name.lower():
+            return value
+    return b""
+
+
+def crosspost(groups, source, number, target, target_number):
+    """Cross-post an article of a group to another group."""
+    lines = list(groups[source][number])
+    for i, line in enumerate(lines):
+        if line.startswith(b"Newsgroups: "):
+            lines[i] = line + b"," + target.encode()
+    groups[source][number] = lines
+    groups[target][target_number] = lines
+
+
+def wildmat(pattern, name):
+    """Match a group name against a wildmat as defined by RFC 3977."""
+    matched = False
+    for p in pattern.split(","):
+        negated = p.startswith("!")
+        if fnmatch.fnmatchcase(name, p.lstrip("!")):
+            matched = not negated
+    return matched
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def setup(self):
+        super().setup()
+        self.group = None
+        self.queue = []
+        self.order = itertools.count()
+        self.cond = threading.Condition()
+        self.done = False
+        self.compress_after = None
+        self.deflate = None
+        self.inflate = None
+        self.inbuf = b""
+        self.pending = 0
+        self.received = 0
+        self.paced = time.monotonic()
+        self.writer = threading.Thread(target=self.write_responses)
+        self.writer.start()
+
+    def send(self, *lines):
+        """Queue response lines to be written after the server latency."""
+        data = b"".join(l + b"\r\n" for l in lines)
+        with self.cond:
+            self.pending += 1
+            due = time.monotonic() + self.server.latency
+            heapq.heappush(self.queue, (due, next(self.order), data))
+            self.cond.notify()
+
+    def write_responses(self):
+        while True:
+            with self.cond:
+                while not self.queue and not self.done:
+                    self.cond.wait()
+                if not self.queue:
+                    return
+                due, order, data = self.queue[0]
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.cond.wait(delay)
+                    continue
+                heapq.heappop(self.queue)
+                self.pending -= 1
+            if self.compress_after is not None and order > self.compress_after:
+                data = self.deflate.compress(data) + \
+                       self.deflate.flush(zlib.Z_SYNC_FLUSH)
+            with self.server.lock:
+                self.server.sent += len(data)
+            if self.server.bandwidth:
+                now = time.monotonic()
+                self.paced = max(self.paced, now) + \
+                             len(data) / self.server.bandwidth
+                time.sleep(max(0, self.paced - now))
+            try:
+                self.wfile.write(data)
+                self.wfile.flush()
+            except OSError:
+                return
+
+    def finish(self):
+        with self.cond:
+            self.done = True
+            self.cond.notify()
+        self.writer.join()
+        super().finish()
+
+    def readline(self):
+        """Read a command line, decompressing it after COMPRESS."""
+        if self.inflate is None:
+            return self.rfile.readline()
+        while b"\n" not in self.inbuf:
+            data = self.rfile.read1(2**16)
+            if not data:
+                return b""
+            self.inbuf += self.inflate.decompress(data)
+        line, sep, self.inbuf = self.inbuf.partition(b"\n")
+        return line + sep
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connections += 1
+            refused = bool(self.server.max_connections) and \
+                      self.server.connections > self.server.max_connections
+            self.server.refused += refused
+        try:
+            if refused:
+                self.send(b"400 too many connections")
+                return
+            if self.server.greeting is not None:
+                self.send(self.server.greeting)
+                return
+            self.send(b"200 fake news server ready")
+            self.serve()
+        finally:
+            with self.server.lock:
+                self.server.connections -= 1
+
+    def serve(self):
+        for line in iter(self.readline, b""):
+            words = line.decode().split()
+            if not words:
+                continue
+            command = words[0].upper()
+            with self.cond:
+                waited = self.pending == 0
+            with self.server.lock:
+                self.server.commands[command] += 1
+                self.server.round_trips += waited
+            if command == "QUIT":
+                self.send(b"205 bye")
+                return
+            if command == "ARTICLE":
+                self.received += 1
+                if self.broken():
+                    return
+            method = getattr(self, "do_" + command, None)
+            if method is None or command in self.server.disabled:
+                self.send(b"500 unknown command")
+            else:
+                method(*words[1:])
+
+    def broken(self):
+        """Break the connection if enough articles were requested.
+
+        The connection is dropped after the responses queued so far and
+        the drop response, if any, were sent, or it stalls until the server
+        is shut down. A dropped connection is closed like by a real server,
+        commands still received are discarded until the client closes it,
+        so that the responses sent are not lost by a reset.
+        """
+        server = self.server
+        if server.drop_after is not None and self.received > server.drop_after:
+            with server.lock:
+                server.drops += 1
+            if server.drop_response:
+                self.send(server.drop_response)
+            with self.cond:
+                self.done = True
+                self.cond.notify()
+            self.writer.join()
+            try:
+                self.request.shutdown(socket.SHUT_WR)
+                self.rfile.read()
+            except OSError:
+                pass
+            return True
+        if server.stall_after is not None and \
+           self.received > server.stall_after:
+            with server.lock:
+                server.stalls += 1
+            server.stopped.wait()
+            return True
+        return False
+
+    def do_CAPABILITIES(self, *args):
+        caps = [ b"VERSION 2", b"READER", b"OVER", b"AUTHINFO USER" ]
+        if "COMPRESS" not in self.server.disabled and self.inflate is None:
+            caps.append(b"COMPRESS DEFLATE")
+        self.send(b"101 capabilities", *caps, b".")
+
+    def do_COMPRESS(self, algorithm):
+        if algorithm.upper() != "DEFLATE" or self.inflate is not None:
+            self.send(b"502 compression not possible")
+            return
+        self.deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+        self.inflate = zlib.decompressobj(wbits=-zlib.MAX_WBITS)
+        self.send(b"206 compression active")
+        with self.cond:
+            self.compress_after = next(self.order) - 1
+
+    def do_DATE(self):
+        self.send(time.strftime("111 %Y%m%d%H%M%S", time.gmtime()).encode())
+
+    def do_MODE(self, *args):
+        self.send(b"201 reader mode")
+
+    def do_AUTHINFO(self, kind, *args):
+        if kind.upper() == "USER":
+            self.send(b"381 password required")
+        else:
+            self.send(b"281 authenticated")
+
+    def select(self, name):
+        """Select a group and return the response line, None if unknown."""
+        if name not in self.server.groups:
+            self.send(b"411 no such group")
+            return None
+        self.group = name
+        numbers = self.server.groups[name]
+        if numbers:
+            return b"211 %d %d %d %s" % (len(numbers), min(numbers),
+                                         max(numbers), name.encode())
+        return b"211 0 1 0 %s" % name.encode()
+
+    def do_GROUP(self, name):
+        resp = self.select(name)
+        if resp:
+            self.send(resp)
+
+    def do_LISTGROUP(self, name, spec="1-"):
+        resp = self.select(name)
+        if resp:
+            self.send(resp, *[ b"%d" % n for n, lines in self.articles(spec) ],
+                      b".")
+
+    def do_ARTICLE(self, number):
+        articles = self.server.groups.get(self.group, {})
+        lines = articles.get(int(number))
+        if lines is None:
+            self.send(b"423 no such article number")
+            return
+        message_id = header(lines, b"Message-ID")
+        self.send(b"220 %s %s" % (number.encode(), message_id),
+                  *[ b"." + l if l.startswith(b".") else l for l in lines ],
+                  b".")
+
+    def articles(self, spec):
+        """Return the numbers and articles of the current group in a range."""
+        articles = self.server.groups.get(self.group, {})
+        first, sep, last = spec.partition("-")
+        first = int(first)
+        last = int(last) if last else max(articles, default=0)
+        if not sep:
+            last = first
+        return [ (n, articles[n]) for n in sorted(articles)
+                 if first <= n <= last ]
+
+    def active(self, names):
+        """Return the lines of the active list for groups."""
+        lines = []
+        for name in sorted(names):
+            numbers = self.server.groups[name]
+            lines.append(b"%s %d %d y" % (name.encode(),
+                                          max(numbers, default=0),
+                                          min(numbers, default=1)))
+        return lines
+
+    def do_LIST(self, keyword="ACTIVE", *args):
+        if keyword.upper() == "ACTIVE":
+            lines = self.active(name for name in self.server.groups
+                                if not args or wildmat(args[0], name))
+            self.send(b"215 list of newsgroups follows", *lines, b".")
+        elif keyword.upper() == "OVERVIEW.FMT":
+            self.send(b"215 order of fields", b"Subject:", b"From:",
+                      b"Date:", b"Message-ID:", b"References:", b":bytes",
+                      b":lines", b"Xref:full", b".")
+        else:
+            self.send(b"501 unsupported keyword")
+
+    def do_NEWGROUPS(self, date, time_, *args):
+        since = calendar.timegm(time.strptime(date + time_, "%Y%m%d%H%M%S"))
+        lines = self.active(name for name in self.server.groups
+                            if self.server.created.get(name, 0) >= since)
+        self.send(b"231 list of new newsgroups follows", *lines, b".")
+
+    def do_OVER(self, spec):
+        articles = self.articles(spec)
+        if not articles:
+            self.send(b"423 no articles in that range")
+            return
+        fields = []
+        for n, lines in articles:
+            fields.append(b"\t".join([
+                b"%d" % n, header(lines, b"Subject"), header(lines, b"From"),
+                header(lines, b"Date"), header(lines, b"Message-ID"),
+                header(lines, b"References"),
+                b"%d" % sum(len(l) + 2 for l in lines),
+                b"%d" % (len(lines) - lines.index(b"") - 1),
+                b"Xref: fake " + b" ".join(
+                    b"%s:%d" % (g, n)
+                    for g in header(lines, b"Newsgroups").split(b",")) ]))
+        self.send(b"224 overview information follows", *fields, b".")
+
+
+class FakeNNTPServer(socketserver.ThreadingTCPServer):
+    """A fake NNTP server serving the given groups on a local port.
+
+    `groups` maps group names to dicts mapping article numbers to the lines
+    of the articles. `latency` is the delay in seconds of every response,
+    `bandwidth` the number of bytes per second sent on every connection.
+    Connections beyond `max_connections` are refused with status 400.
+    Commands in `disabled` are rejected as unknown, disabling COMPRESS also
+    removes it from the capabilities. NEWGROUPS lists the groups whose time
+    of creation in `created` is not older than the given time, groups not
+    in `created` are taken as created at the epoch. A connection is dropped
+    when more than `drop_after` ARTICLE commands were received on it, after
+    the responses to the previous commands and the response line
+    `drop_response`, if given, were sent. With `stall_after`, it stops
+    responding instead until the server is shut down. With `greeting`, every
+    connection is closed after this response line is sent as greeting.
+
+    The number of commands received is counted per command in `commands`,
+    the number of bytes sent in `sent`, the number of refused connections
+    in `refused` and the numbers of dropped and stalled connections in
+    `drops` and `stalls`. A command received while no response is pending
+    starts a round trip, as the client waited for the previous responses,
+    the round trips are counted in `round_trips`.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, groups, latency=0.0, disabled=(), bandwidth=None,
+                 max_connections=None, port=0, drop_after=None,
+                 stall_after=None, drop_response=None, greeting=None):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.groups = groups
+        self.latency = latency
+        self.disabled = set(disabled)
+        self.bandwidth = bandwidth
+        self.max_connections = max_connections
+        self.drop_after = drop_after
+        self.drop_response = drop_response
+        self.stall_after = stall_after
+        self.greeting = greeting
+        self.commands = collections.Counter()
+        self.sent = 0
+        self.round_trips = 0
+        self.connections = 0
+        self.refused = 0
+        self.drops = 0
+        self.stalls = 0
+        self.created = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, args=(0.01,),
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=1119)
+    parser.add_argument("--groups", type=int, default=10)
+    parser.add_argument("--articles", type=int, default=1000)
+    parser.add_argument("--size", type=int, default=4000)
+    parser.add_argument("--gaps", type=float, default=0.0)
+    parser.add_argument("--crossposts", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--bandwidth", type=float, default=None)
+    parser.add_argument("--max-connections", type=int, default=None)
+    parser.add_argument("--drop-after", type=int, default=None,
+                        help="drop connections after this many articles")
+    parser.add_argument("--stall-after", type=int, default=None,
+                        help="stall connections after this many articles")
+    args = parser.parse_args()
+
+    names = [ "fake.group%d" % i for i in range(args.groups) ]
+    groups = synthetic_groups(names, args.articles, args.size, args.gaps,
+                              args.crossposts)
+    server = FakeNNTPServer(groups, args.latency, bandwidth=args.bandwidth,
+                            max_connections=args.max_connections,
+                            port=args.port, drop_after=args.drop_after,
+                            stall_after=args.stall_after)
+    print("Serving %d groups on 127.0.0.1:%d" % (len(groups), server.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stopped.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
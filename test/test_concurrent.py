@@ -0,0 +1,100 @@
+import news2mbox
+from news2mbox import parse_shard, partition_configs, \
+                      read_articles_concurrently, shard_groups
+import argparse
+import pytest
+
+
+def servers(*groups):
+    return [ dict(server="news%d.server.com" % i, groups=list(g))
+             for i, g in enumerate(groups) ]
+
+
+def test_partition_disjoint():
+    configs = servers(["a"], ["b"], ["c"])
+    assert partition_configs(configs) == [ [c] for c in configs ]
+
+
+def test_partition_shared_groups():
+    configs = servers(["a"], ["b"], ["c", "a"], ["d", "b"], ["e"])
+    assert partition_configs(configs) == [
+        [ configs[0], configs[2] ],
+        [ configs[1], configs[3] ],
+        [ configs[4] ] ]
+
+
+def test_partition_transitive():
+    configs = servers(["a"], ["b"], ["a", "b"])
+    assert partition_configs(configs) == [ configs ]
+
+
+def fake_read_articles(config, status, out=None, checkpoint=None):
+    for g in config['groups']:
+        print('%s %s %d' % (config['server'], g, status.get(g, 0)), file=out)
+        status[g] = status.get(g, 0) + 1
+    if 'fail' in config['groups']:
+        raise EOFError(config['server'])
+    if 'abort' in config['groups']:
+        raise RuntimeError(config['server'])
+
+
+def test_concurrent_like_sequential(monkeypatch, capsys):
+    monkeypatch.setattr(news2mbox, 'read_articles', fake_read_articles)
+    configs = servers(["a"], ["b"], ["a", "c"], ["d"])
+
+    status = { "a" : 5 }
+    for config in configs:
+        fake_read_articles(config, status)
+    expected = capsys.readouterr().out, status
+
+    status = { "a" : 5 }
+    read_articles_concurrently(configs, status, 3)
+    assert (capsys.readouterr().out, status) == expected
+
+
+def test_concurrent_error(monkeypatch, capsys):
+    monkeypatch.setattr(news2mbox, 'read_articles', fake_read_articles)
+    configs = servers(["a"], ["fail"], ["b"], ["fail", "c"])
+
+    status = {}
+    assert read_articles_concurrently(configs, status, 2) == 2
+    out, err = capsys.readouterr()
+    assert out == 'news0.server.com a 0\nnews1.server.com fail 0\n' \
+                  'news2.server.com b 0\nnews3.server.com fail 1\n' \
+                  'news3.server.com c 0\n'
+    assert err == 'news2mbox: Reading from news1.server.com failed: ' \
+                  'news1.server.com\n' \
+                  'news2mbox: Reading from news3.server.com failed: ' \
+                  'news3.server.com\n'
+    assert status == { "a" : 1, "fail" : 2, "b" : 1, "c" : 1 }
+
+
+def test_concurrent_abort(monkeypatch, capsys):
+    monkeypatch.setattr(news2mbox, 'read_articles', fake_read_articles)
+    configs = servers(["a"], ["abort"], ["b"])
+
+    status = {}
+    with pytest.raises(RuntimeError):
+        read_articles_concurrently(configs, status, 2)
+    assert capsys.readouterr().out == 'news0.server.com a 0\n'
+    assert status == { "a" : 1, "abort" : 1, "b" : 1 }
+
+
+def test_shards():
+    configs = servers([ "g%d" % i for i in range(100) ],
+                      [ "g1", { "name" : "g2", "batch" : 10 } ])
+    for config in configs:
+        shards = [ shard_groups(config, (i, 3)) for i in range(1, 4) ]
+        assert sorted(map(str, sum(shards, []))) == \
+            sorted(map(str, config["groups"]))
+        assert shards == [ shard_groups(config, (i, 3)) for i in range(1, 4) ]
+    assert all(len(shard_groups(configs[0], (i, 3))) > 20
+               for i in range(1, 4))
+    assert shard_groups(configs[1], (1, 1)) == configs[1]["groups"]
+
+
+def test_parse_shard():
+    assert parse_shard("2/4") == (2, 4)
+    for value in [ "0/4", "5/4", "1", "a/b", "1/2/3" ]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_shard(value)
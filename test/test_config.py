@@ -130,3 +130,200 @@ def test_invalid_json_syntax():
             { "server" : news.server.com",
               "groups" : ["comp.lang.c"] }""",
             [])
+
+
+def test_connections():
+    assert_parsed_output("""
+        { "server"      : "news.server.com",
+          "connections" : 4,
+          "groups"      : ["comp.lang.python"] }""",
+        [ dict(server="news.server.com",
+               connections=4,
+               groups=[ "comp.lang.python" ]) ])
+
+
+def test_invalid_connections():
+    for value in [ '0', '-1', '"4"', 'true', '1.5' ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server"      : "news.server.com",
+                  "connections" : %s,
+                  "groups"      : ["comp.lang.c"] }""" % value,
+                [])
+
+
+def test_port_window():
+    assert_parsed_output("""
+        { "server" : "news.server.com",
+          "port"   : 1119,
+          "window" : 32,
+          "groups" : ["comp.lang.python"] }""",
+        [ dict(server="news.server.com",
+               port=1119,
+               window=32,
+               groups=[ "comp.lang.python" ]) ])
+
+
+def test_invalid_port_window():
+    for key, value in [ ('port', '0'), ('port', '65536'), ('port', '"119"'),
+                        ('window', '0'), ('window', 'false') ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server" : "news.server.com",
+                  "%s"     : %s,
+                  "groups" : ["comp.lang.c"] }""" % (key, value),
+                [])
+
+
+def test_group_options():
+    assert_parsed_output("""
+        { "server"       : "news.server.com",
+          "max_articles" : 1000,
+          "rate"         : 2.5,
+          "groups"       : [ "comp.lang.c",
+                             { "name"     : "comp.lang.python",
+                               "backfill" : true,
+                               "batch"    : 500 } ] }""",
+        [ dict(server="news.server.com",
+               max_articles=1000,
+               rate=2.5,
+               groups=[ "comp.lang.c",
+                        dict(name="comp.lang.python",
+                             backfill=True,
+                             batch=500) ]) ])
+
+
+def test_invalid_group_options():
+    for group in [ '{ "backfill" : true }', '{ "name" : 1 }', '1',
+                   '{ "name" : "comp.lang.c", "backfill" : 1 }',
+                   '{ "name" : "comp.lang.c", "max_articles" : 0 }',
+                   '{ "name" : "comp.lang.c", "server" : "x" }' ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server" : "news.server.com",
+                  "groups" : [ %s ] }""" % group,
+                [])
+    for key, value in [ ('rate', '0'), ('bandwidth', '-1'),
+                        ('bandwidth', '"1M"'), ('name', '"x"'),
+                        ('quiet', '1'), ('groups_ttl', '-1') ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server" : "news.server.com",
+                  "%s"     : %s,
+                  "groups" : ["comp.lang.c"] }""" % (key, value),
+                [])
+
+
+def test_compression_rotate():
+    assert_parsed_output("""
+        { "server"      : "news.server.com",
+          "compression" : "xz",
+          "groups"      : [ { "name"        : "comp.lang.c",
+                              "compression" : "gzip",
+                              "rotate"      : "month" },
+                            { "name"   : "comp.lang.python",
+                              "rotate" : 1000000 } ] }""",
+        [ dict(server="news.server.com",
+               compression="xz",
+               groups=[ dict(name="comp.lang.c",
+                             compression="gzip",
+                             rotate="month"),
+                        dict(name="comp.lang.python",
+                             rotate=1000000) ]) ])
+
+
+def test_invalid_compression_rotate():
+    for key, value in [ ('compression', '"zip"'), ('compression', 'true'),
+                        ('rotate', '"week"'), ('rotate', '0'),
+                        ('rotate', 'true'), ('format', '"mh"'),
+                        ('format', 'true') ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server" : "news.server.com",
+                  "%s"     : %s,
+                  "groups" : ["comp.lang.c"] }""" % (key, value),
+                [])
+
+
+def test_filter():
+    assert_parsed_output("""
+        { "server" : "news.server.com",
+          "filter" : { "max_bytes" : 100000 },
+          "groups" : [ { "name"   : "comp.lang.c",
+                         "filter" : { "subject"        : "(?i)buy now",
+                                      "from"           : "@spam\\\\.com",
+                                      "newsgroups"     : "^alt\\\\.binaries",
+                                      "max_crossposts" : 3 } } ] }""",
+        [ dict(server="news.server.com",
+               filter=dict(max_bytes=100000),
+               groups=[ dict(name="comp.lang.c",
+                             filter={ "subject" : "(?i)buy now",
+                                      "from" : "@spam\\.com",
+                                      "newsgroups" : "^alt\\.binaries",
+                                      "max_crossposts" : 3 }) ]) ])
+
+
+def test_invalid_filter():
+    for value in [ '"spam"', '{ "body" : "x" }', '{ "subject" : "(" }',
+                   '{ "from" : 1 }', '{ "max_bytes" : 0 }',
+                   '{ "max_crossposts" : true }' ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server" : "news.server.com",
+                  "filter" : %s,
+                  "groups" : ["comp.lang.c"] }""" % value,
+                [])
+
+
+def test_retention():
+    assert_parsed_output("""
+        { "server"    : "news.server.com",
+          "retention" : { "max_age" : 365 },
+          "groups"    : [ { "name"      : "comp.lang.c",
+                            "retention" : { "max_age"      : 0.5,
+                                            "max_messages" : 1000,
+                                            "max_bytes"    : 1000000 } } ] }""",
+        [ dict(server="news.server.com",
+               retention=dict(max_age=365),
+               groups=[ dict(name="comp.lang.c",
+                             retention=dict(max_age=0.5,
+                                            max_messages=1000,
+                                            max_bytes=1000000)) ]) ])
+
+
+def test_invalid_retention():
+    for value in [ '365', '{ "days" : 1 }', '{ "max_age" : 0 }',
+                   '{ "max_messages" : 1.5 }', '{ "max_bytes" : true }',
+                   '{ "max_age" : "1" }' ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server"    : "news.server.com",
+                  "retention" : %s,
+                  "groups"    : ["comp.lang.c"] }""" % value,
+                [])
+
+
+def test_reconnect_options():
+    assert_parsed_output("""
+        { "server"  : "news.server.com",
+          "timeout" : 30,
+          "retries" : 0,
+          "backoff" : 0.5,
+          "groups"  : ["comp.lang.python"] }""",
+        [ dict(server="news.server.com",
+               timeout=30,
+               retries=0,
+               backoff=0.5,
+               groups=[ "comp.lang.python" ]) ])
+
+
+def test_invalid_reconnect_options():
+    for key, value in [ ('timeout', '0'), ('timeout', '"60"'),
+                        ('retries', '-1'), ('retries', '1.5'),
+                        ('retries', 'true'), ('backoff', '-1') ]:
+        with pytest.raises(SyntaxError):
+            assert_parsed_output("""
+                { "server" : "news.server.com",
+                  "%s"     : %s,
+                  "groups" : ["comp.lang.c"] }""" % (key, value),
+                [])
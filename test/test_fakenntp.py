@@ -0,0 +1,75 @@
+from fakenntp import FakeNNTPServer, synthetic_group, synthetic_groups
+from news2mbox import connect, fetch_articles
+import itertools
+import nntplib
+import pytest
+import time
+
+
+def make_config(server):
+    return dict(server="127.0.0.1", port=server.port, ssl=False)
+
+
+def test_synthetic_groups():
+    names = [ "a", "b", "c" ]
+    groups = synthetic_groups(names, 100, (500, 5000), gaps=0.1,
+                              crossposts=0.2)
+    assert groups == synthetic_groups(names, 100, (500, 5000), gaps=0.1,
+                                      crossposts=0.2)
+    assert all(len(groups[g]) == 90 for g in names)
+    sizes = [ sum(len(l) + 1 for l in lines) for lines in groups["a"].values() ]
+    assert 500 <= min(sizes) < max(sizes) <= 5100
+    for g in names[1:]:
+        foreign = [ lines for lines in groups[g].values()
+                    if not lines[4].endswith(b".%s@fake>" % g.encode()) ]
+        assert len(foreign) == 18
+
+
+def test_max_connections():
+    with FakeNNTPServer({}, max_connections=1) as server:
+        with connect(make_config(server)):
+            with pytest.raises(nntplib.NNTPTemporaryError):
+                connect(make_config(server))
+        with connect(make_config(server)):
+            pass
+    assert server.refused == 1
+
+
+def test_bandwidth_round_trips():
+    groups = { "g" : synthetic_group("g", 10, size=2000) }
+    with FakeNNTPServer(groups, latency=0.01, bandwidth=100000) as server:
+        with connect(make_config(server)) as s:
+            s.group("g")
+            start = time.monotonic()
+            for n, info in fetch_articles(s, range(1, 11), 16):
+                pass
+            assert time.monotonic() - start >= 0.2
+    assert server.round_trips == 4
+
+
+def test_drop_after():
+    groups = { "g" : synthetic_group("g", 10) }
+    with FakeNNTPServer(groups, drop_after=4) as server:
+        with connect(make_config(server)) as s:
+            s.group("g")
+            articles = fetch_articles(s, range(1, 11), 16)
+            assert [ n for n, info in itertools.islice(articles, 4) ] == \
+                [ 1, 2, 3, 4 ]
+            with pytest.raises(EOFError):
+                next(articles)
+    assert server.drops == 1
+
+
+def test_drop_response():
+    groups = { "g" : synthetic_group("g", 10, gaps=[2]) }
+    with FakeNNTPServer(groups, drop_after=4,
+                        drop_response=b"400 session timed out") as server:
+        with connect(make_config(server)) as s:
+            s.group("g")
+            articles = fetch_articles(s, range(1, 11), 16)
+            assert [ info is None
+                     for n, info in itertools.islice(articles, 4) ] == \
+                [ False, True, False, False ]
+            with pytest.raises(nntplib.NNTPTemporaryError):
+                next(articles)
+    assert server.drops == 1
@@ -0,0 +1,881 @@
+from fakenntp import FakeNNTPServer, crosspost, synthetic_group
+from news2mbox import AsyncNNTPConnection, MboxIndex, MessageIndex, \
+                      NNTPLibConnection, RateLimiter, StatusDB, connect, \
+                      expand_groups, fetch_articles, file_lock, \
+                      make_checkpoint, read_active, read_articles, \
+                      read_articles_async, read_articles_concurrently, \
+                      read_group, read_status, run_daemon, stats, wildmats, \
+                      write_status
+import asyncio
+import bz2
+import json
+import nntplib
+import os
+import pytest
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+
+PROGRAM = os.path.join(os.path.dirname(__file__), "..", "python",
+                       "news2mbox.py")
+
+
+@pytest.fixture
+def outdir():
+    d = tempfile.mkdtemp()
+    yield d
+    shutil.rmtree(d)
+
+
+def make_config(server, outdir, groups, **kwargs):
+    return dict(server="127.0.0.1", port=server.port, ssl=False,
+                outdir=outdir, groups=groups, **kwargs)
+
+
+def read_mbox(outdir, group):
+    with open(os.path.join(outdir, group), "rb") as f:
+        return [ l for l in f.read().split(b"\n")
+                 if not l.startswith(b"From ") ]
+
+
+def test_read_articles(outdir, capsys):
+    groups = { "comp.lang.c" : synthetic_group("comp.lang.c", 5, gaps=[3]) }
+    with FakeNNTPServer(groups) as server:
+        status = {}
+        read_articles(make_config(server, outdir, ["comp.lang.c"]), status)
+
+    assert status == { "comp.lang.c" : 5 }
+    assert read_mbox(outdir, "comp.lang.c") == \
+        [ l for n in [1, 2, 4, 5] for l in groups["comp.lang.c"][n] ] + [ b"" ]
+    assert capsys.readouterr().out.splitlines() == [
+        "4 articles for comp.lang.c at 127.0.0.1.",
+        "reading article comp.lang.c: 1 of 4 flushed",
+        "reading article comp.lang.c: 2 of 4 flushed",
+        "reading article comp.lang.c: 3 of 4 flushed",
+        "reading article comp.lang.c: 4 of 4 flushed" ]
+    assert server.commands["ARTICLE"] == 4
+
+
+def test_read_articles_without_listgroup(outdir, capsys):
+    groups = { "comp.lang.c" : synthetic_group("comp.lang.c", 5, gaps=[3]) }
+    with FakeNNTPServer(groups, disabled=["LISTGROUP"]) as server:
+        status = {}
+        read_articles(make_config(server, outdir, ["comp.lang.c"]), status)
+
+    assert status == { "comp.lang.c" : 5 }
+    assert read_mbox(outdir, "comp.lang.c") == \
+        [ l for n in [1, 2, 4, 5] for l in groups["comp.lang.c"][n] ] + [ b"" ]
+    assert capsys.readouterr().out.splitlines() == [
+        "5 articles for comp.lang.c at 127.0.0.1.",
+        "reading article comp.lang.c: 1 of 5 flushed",
+        "reading article comp.lang.c: 2 of 5 flushed",
+        "reading article comp.lang.c: 3 of 5 not found.",
+        "reading article comp.lang.c: 4 of 5 flushed",
+        "reading article comp.lang.c: 5 of 5 flushed" ]
+
+
+def test_read_articles_incremental(outdir, capsys):
+    groups = { "comp.lang.c" : synthetic_group("comp.lang.c", 10) }
+    with FakeNNTPServer(groups) as server:
+        status = { "comp.lang.c" : 7 }
+        read_articles(make_config(server, outdir, ["comp.lang.c"]), status)
+        read_articles(make_config(server, outdir, ["comp.lang.c"]), status)
+
+    assert read_mbox(outdir, "comp.lang.c") == \
+        [ l for n in [8, 9, 10] for l in groups["comp.lang.c"][n] ] + [ b"" ]
+    assert capsys.readouterr().out.splitlines()[-1] == \
+        "news2mbox: No new articles for comp.lang.c at 127.0.0.1"
+
+
+def test_max_articles(outdir, capsys):
+    groups = { g : synthetic_group(g, 10) for g in [ "a", "b" ] }
+    with FakeNNTPServer(groups) as server:
+        status = {}
+        config = make_config(server, outdir,
+                             [ "a", dict(name="b", max_articles=2) ],
+                             max_articles=5)
+        read_articles(config, status)
+
+    assert status == { "a" : 10, "b" : 10 }
+    assert read_mbox(outdir, "a") == \
+        [ l for n in range(6, 11) for l in groups["a"][n] ] + [ b"" ]
+    assert read_mbox(outdir, "b") == \
+        [ l for n in [9, 10] for l in groups["b"][n] ] + [ b"" ]
+
+
+def test_backfill(outdir, capsys):
+    groups = { "g" : synthetic_group("g", 25, first=101, gaps=[105, 112]) }
+    checkpoints = []
+    with FakeNNTPServer(groups) as server:
+        status = {}
+        config = make_config(server, outdir,
+                             [ dict(name="g", backfill=True, batch=4) ],
+                             max_articles=10)
+        for run in range(4):
+            read_articles(config, status, checkpoint=lambda:
+                          checkpoints.append(status.get("g")))
+        assert server.commands["LISTGROUP"] == 8
+
+    assert checkpoints == [ None, 104, 108, 110, 110, 114, 118, 120,
+                            120, 124, 125 ]
+    assert read_mbox(outdir, "g") == \
+        [ l for n in sorted(groups["g"]) for l in groups["g"][n] ] + [ b"" ]
+    assert capsys.readouterr().out.splitlines()[-1] == \
+        "news2mbox: No new articles for g at 127.0.0.1"
+
+
+def test_rate_limiter():
+    async def take(limiter, amounts):
+        for amount in amounts:
+            await limiter.wait(amount)
+
+    limiter = RateLimiter(100)
+    start = time.monotonic()
+    asyncio.run(take(limiter, [ 1, 10, 1, 1 ]))
+    assert 0.12 <= time.monotonic() - start < 0.5
+
+
+class FailingConnection:
+    """A connection object whose connection breaks after some articles."""
+
+    def __init__(self, articles, fail_after):
+        self.articles_ = articles
+        self.fail_after = fail_after
+
+    async def group(self, name):
+        return len(self.articles_), min(self.articles_), max(self.articles_)
+
+    async def listgroup(self, name, first, last):
+        return [ n for n in sorted(self.articles_) if first <= n <= last ]
+
+    async def articles(self, numbers, window):
+        for n in numbers:
+            if n > self.fail_after:
+                raise EOFError
+            yield n, nntplib.ArticleInfo(n, "<%d@fake>" % n,
+                                         self.articles_[n])
+
+
+def test_read_group_aborted(outdir, capsys):
+    articles = synthetic_group("g", 10)
+    status = { "g" : 1 }
+    config = dict(server="fake", outdir=outdir)
+    with pytest.raises(EOFError):
+        asyncio.run(read_group(FailingConnection(articles, 4), config, "g",
+                               status))
+
+    assert status == { "g" : 4 }
+    assert read_mbox(outdir, "g") == \
+        [ l for n in [2, 3, 4] for l in articles[n] ] + [ b"" ]
+
+
+def test_read_group_checkpoints(outdir, capsys):
+    articles = synthetic_group("g", 10)
+    status = {}
+    config = dict(server="fake", outdir=outdir, checkpoint=3)
+    checkpoints = []
+
+    def checkpoint():
+        if "g" in status:
+            checkpoints.append((status["g"], len(read_mbox(outdir, "g"))))
+
+    with pytest.raises(EOFError):
+        asyncio.run(read_group(FailingConnection(articles, 8), config, "g",
+                               status, checkpoint=checkpoint))
+
+    assert status == { "g" : 8 }
+    assert checkpoints == [ (n, sum(len(articles[i]) for i in range(1, n + 1))
+                                + 1)
+                            for n in [3, 6] ]
+
+
+@pytest.mark.parametrize("window", [ 1, 3, 64 ])
+def test_fetch_articles_window(window):
+    groups = { "g" : synthetic_group("g", 20, gaps=[1, 7, 8, 20]) }
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, None, ["g"])
+        with connect(config) as s:
+            s.group("g")
+            articles = list(fetch_articles(s, range(1, 22), window))
+            assert s.group("g")[1] == 16
+
+    assert [ n for n, info in articles ] == list(range(1, 22))
+    assert [ n for n, info in articles if info is None ] == [ 1, 7, 8, 20, 21 ]
+    assert all(info.lines == groups["g"][n] for n, info in articles if info)
+
+
+def test_fetch_articles_abort():
+    groups = { "g" : synthetic_group("g", 20) }
+    with FakeNNTPServer(groups) as server:
+        with connect(make_config(server, None, ["g"])) as s:
+            s.group("g")
+            articles = fetch_articles(s, range(1, 21), 8)
+            next(articles)
+            articles.close()
+            assert s.group("g")[1] == 20
+
+
+def test_connection_pool(outdir, capsys):
+    names = [ "g%d" % i for i in range(6) ]
+    groups = { g : synthetic_group(g, 3) for g in names }
+    with FakeNNTPServer(groups) as server:
+        status = {}
+        read_articles(make_config(server, outdir, names), status)
+        sequential = capsys.readouterr().out
+        status = {}
+        os.mkdir(os.path.join(outdir, "pool"))
+        read_articles(make_config(server, os.path.join(outdir, "pool"),
+                                  names, connections=3),
+                      status)
+
+    assert capsys.readouterr().out == sequential
+    assert status == { g : 3 for g in names }
+
+
+def test_group_lock(outdir, capsys):
+    groups = { g : synthetic_group(g, 3) for g in [ "a", "b" ] }
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir, [ "a", "b" ])
+        statusfile = os.path.join(outdir, "status.json")
+        status = {}
+        with file_lock(os.path.join(outdir, ".a.lock")):
+            read_articles(config, status, checkpoint=make_checkpoint(
+                          statusfile, status))
+        assert "a is locked by another process" in capsys.readouterr().out
+        assert status == { "b" : 3 }
+
+        outdated = {}
+        read_articles(config, outdated, checkpoint=make_checkpoint(
+                      statusfile, outdated))
+        assert outdated == { "a" : 3, "b" : 3 }
+        assert server.commands["ARTICLE"] == 6
+
+        write_status(statusfile, { "a" : 3 })
+        reset = read_status(statusfile)
+        read_articles(config, reset, checkpoint=make_checkpoint(
+                      statusfile, reset))
+        assert server.commands["ARTICLE"] == 9
+
+    for g, runs in [ ("a", 1), ("b", 2) ]:
+        assert read_mbox(outdir, g) == \
+            [ l for n in range(1, 4) for l in groups[g][n] ] * runs + [ b"" ]
+
+
+def test_over():
+    groups = { "g" : synthetic_group("g", 5, gaps=[2]) }
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, None, ["g"])
+        with connect(config) as s:
+            s.group("g")
+            expected = asyncio.run(NNTPLibConnection(s).over(2, 5))
+
+        async def over():
+            conn = await AsyncNNTPConnection.open(config)
+            try:
+                await conn.group("g")
+                return await conn.over(2, 5)
+            finally:
+                await conn.quit()
+
+        assert asyncio.run(over()) == expected
+    assert [ n for n, fields in expected ] == [ 3, 4, 5 ]
+    assert expected[0][1]["message-id"] == "<3.g@fake>"
+
+
+def run_engine(engine, configs, status, capsys):
+    if engine == "asyncio":
+        asyncio.run(read_articles_async(configs, status))
+    else:
+        for config in configs:
+            read_articles(config, status)
+    return capsys.readouterr().out
+
+
+def test_asyncio_engine(capsys):
+    names = [ "g%d" % i for i in range(5) ]
+    groups = { g : synthetic_group(g, 30, gaps=[4, 5, 30]) for g in names }
+    results = []
+    with FakeNNTPServer(groups) as server:
+        for engine in [ "nntplib", "asyncio" ]:
+            d = tempfile.mkdtemp()
+            try:
+                configs = [ make_config(server, d, names[:3], connections=2,
+                                        window=4),
+                            make_config(server, d, names[2:]) ]
+                status = { "g1" : 20 }
+                out = run_engine(engine, configs, status, capsys)
+                results.append((out, status,
+                                { g : read_mbox(d, g) for g in names }))
+            finally:
+                shutil.rmtree(d)
+    assert results[0] == results[1]
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_reconnect(outdir, capsys, engine):
+    groups = { g : synthetic_group(g, 10) for g in [ "a", "b" ] }
+    stats.clear()
+    with FakeNNTPServer(groups, drop_after=4) as server:
+        config = make_config(server, outdir, [ "a", "b" ], backoff=0.01)
+        status = {}
+        if engine == "asyncio":
+            asyncio.run(read_articles_async([ config ], status))
+        else:
+            read_articles(config, status)
+        assert server.drops == 4
+        assert server.commands["ARTICLE"] == 20 + server.drops
+
+    assert status == { "a" : 10, "b" : 10 }
+    for g in groups:
+        assert read_mbox(outdir, g) == \
+            [ l for n in range(1, 11) for l in groups[g][n] ] + [ b"" ]
+    assert stats.summary()["servers"]["127.0.0.1:%d" % server.port] \
+        ["reconnects"] == 4
+    assert capsys.readouterr().err.count(
+        "failed: EOFError, reconnecting in 0.01 seconds") == 4
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_reconnect_400(outdir, capsys, engine):
+    groups = { "g" : synthetic_group("g", 8) }
+    with FakeNNTPServer(groups, drop_after=3,
+                        drop_response=b"400 session timed out") as server:
+        config = make_config(server, outdir, [ "g" ], backoff=0.01)
+        status = {}
+        out = run_engine(engine, [ config ], status, capsys)
+        assert server.drops == 2
+
+    assert status == { "g" : 8 }
+    assert read_mbox(outdir, "g") == \
+        [ l for n in range(1, 9) for l in groups["g"][n] ] + [ b"" ]
+    assert "not found" not in out
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_reconnect_timeout(outdir, capsys, engine):
+    groups = { "a" : synthetic_group("a", 10) }
+    stats.clear()
+    with FakeNNTPServer(groups, stall_after=6) as server:
+        config = make_config(server, outdir, [ "a" ], timeout=0.2,
+                             backoff=0.01)
+        status = {}
+        start = time.monotonic()
+        run_engine(engine, [ config ], status, capsys)
+        assert time.monotonic() - start < 2
+        assert server.stalls == 1
+
+    assert status == { "a" : 10 }
+    assert read_mbox(outdir, "a") == \
+        [ l for n in range(1, 11) for l in groups["a"][n] ] + [ b"" ]
+    assert stats.summary()["servers"]["127.0.0.1:%d" % server.port] \
+        ["reconnects"] == 1
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_failed_server(outdir, capsys, engine):
+    groups = { "a" : synthetic_group("a", 3) }
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with FakeNNTPServer(groups) as server:
+        configs = [ dict(make_config(server, outdir, [ "x" ], retries=2,
+                                     backoff=0.01), port=port),
+                    make_config(server, outdir, [ "a" ]) ]
+        status = {}
+        if engine == "asyncio":
+            failed = asyncio.run(read_articles_async(configs, status))
+        else:
+            failed = read_articles_concurrently(configs, status, 2)
+
+    assert failed == 1
+    assert status == { "a" : 3 }
+    out, err = capsys.readouterr()
+    assert "3 articles for a at 127.0.0.1." in out
+    assert err.count("reconnecting in") == 2
+    assert "Reading from 127.0.0.1 failed" in err.splitlines()[-1]
+
+
+def test_list_active(outdir, capsys):
+    names = [ "g%d" % i for i in range(4) ]
+    groups = { g : synthetic_group(g, 5) for g in names }
+    status = {}
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir, names + [ "unknown" ],
+                             cachedir=outdir)
+        with connect(config) as s:
+            assert asyncio.run(read_active(NNTPLibConnection(s), config)) == \
+                dict({ g : 5 for g in names }, unknown=None)
+
+        config["groups"] = names
+        read_articles(config, status)
+        groups["g2"][6] = groups["g2"][5]
+        server.commands.clear()
+        read_articles(config, status)
+        assert server.commands == { "CAPABILITIES" : 1, "LIST" : 1,
+                                    "LISTGROUP" : 1, "ARTICLE" : 1,
+                                    "QUIT" : 1 }
+        server.commands.clear()
+        read_articles(config, status)
+        assert server.commands == { "CAPABILITIES" : 1, "LIST" : 1,
+                                    "QUIT" : 1 }
+
+    assert status == { "g0" : 5, "g1" : 5, "g2" : 6, "g3" : 5 }
+    assert capsys.readouterr().out.splitlines()[-4:] == [
+        "news2mbox: No new articles for %s at 127.0.0.1" % g for g in names ]
+
+
+@pytest.mark.parametrize("disabled", [ (), ("LIST",) ])
+def test_status_not_decreased(outdir, capsys, disabled):
+    groups = { "g" : synthetic_group("g", 5) }
+    with FakeNNTPServer(groups, disabled=disabled) as server:
+        status = { "g" : 8 }
+        read_articles(make_config(server, outdir, [ "g" ]), status)
+        assert server.commands["ARTICLE"] == 0
+
+    assert status == { "g" : 8 }
+    assert capsys.readouterr().out.splitlines()[-1] == \
+        "news2mbox: No new articles for g at 127.0.0.1"
+
+
+def test_list_active_cache(outdir, capsys):
+    groups = { "g" : synthetic_group("g", 5) }
+    status = {}
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir, [ "g" ], cachedir=outdir,
+                             active_ttl=60)
+        read_articles(config, status)
+        server.commands.clear()
+        groups["g"][6] = groups["g"][5]
+        read_articles(config, status)
+        assert server.commands == {}
+        asyncio.run(read_articles_async([ config ], status))
+        assert server.commands == {}
+
+    assert status == { "g" : 5 }
+
+
+def test_wildmats():
+    groups = [ "comp.lang.%d" % i for i in range(100) ]
+    patterns = list(wildmats(groups, 100))
+    assert all(len(p) <= 100 for p in patterns)
+    assert ",".join(patterns).split(",") == groups
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_dedup(outdir, capsys, engine):
+    groups = { g : synthetic_group(g, 6) for g in [ "a", "b", "c" ] }
+    crosspost(groups, "a", 2, "b", 3)
+    crosspost(groups, "a", 4, "c", 6)
+    crosspost(groups, "b", 5, "c", 1)
+    with FakeNNTPServer(groups) as server:
+        configs = [ make_config(server, outdir, [ "a", "b", "c" ],
+                                dedup=True, cachedir=outdir) ]
+        run_engine(engine, configs, {}, capsys)
+        assert server.commands["ARTICLE"] == 18 - 3
+
+    for g in groups:
+        assert read_mbox(outdir, g) == \
+            [ l for n in range(1, 7) for l in groups[g][n] ] + [ b"" ]
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_dedup_empty_batches(outdir, capsys, engine):
+    groups = { "g" : synthetic_group("g", 12, gaps=range(4, 10)) }
+    with FakeNNTPServer(groups) as server:
+        configs = [ make_config(server, outdir, [ "g" ], dedup=True, batch=3,
+                                cachedir=outdir) ]
+        status = {}
+        run_engine(engine, configs, status, capsys)
+        assert server.commands["OVER"] == 4
+
+    assert status == { "g" : 12 }
+    assert read_mbox(outdir, "g") == \
+        [ l for n in [ 1, 2, 3, 10, 11, 12 ] for l in groups["g"][n] ] + \
+        [ b"" ]
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_dedup_maildir(outdir, capsys, engine):
+    groups = { g : synthetic_group(g, 6) for g in [ "a", "b", "c" ] }
+    crosspost(groups, "a", 2, "b", 3)
+    crosspost(groups, "a", 4, "c", 6)
+    with FakeNNTPServer(groups) as server:
+        configs = [ make_config(server, outdir,
+                                [ "a", "b", dict(name="c", format="mbox") ],
+                                format="maildir", dedup=True,
+                                cachedir=outdir) ]
+        run_engine(engine, configs, {}, capsys)
+        assert server.commands["ARTICLE"] == 18 - 2
+
+    links = 0
+    for g in "ab":
+        new = os.path.join(outdir, g, "new")
+        articles = []
+        for name in os.listdir(new):
+            path = os.path.join(new, name)
+            links += os.stat(path).st_nlink - 1
+            with open(path, "rb") as f:
+                articles.append(f.read())
+        assert sorted(articles) == \
+            sorted(b"\n".join(lines) + b"\n" for lines in groups[g].values())
+    assert links == 2
+    assert read_mbox(outdir, "c") == \
+        [ l for n in range(1, 7) for l in groups["c"][n] ] + [ b"" ]
+
+
+def test_mbox_index(outdir, capsys):
+    groups = { g : synthetic_group(g, 6, gaps=[2]) for g in [ "a", "b" ] }
+    crosspost(groups, "a", 4, "b", 5)
+    with FakeNNTPServer(groups) as server:
+        configs = [ make_config(server, outdir, [ "a", "b" ], dedup=True,
+                                index=True, cachedir=outdir) ]
+        run_engine("nntplib", configs, {}, capsys)
+
+    for g in groups:
+        with MboxIndex(os.path.join(outdir, g)) as index:
+            assert index.count == 5
+            for n, lines in groups[g].items():
+                article = b"\n".join(lines) + b"\n"
+                assert index.get(n) == article
+                assert index.get(lines[4][12:].decode()) == article
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_compress(outdir, capsys, engine):
+    groups = { g : synthetic_group(g, 20, size=4000, gaps=[3])
+               for g in [ "a", "b" ] }
+    sent = {}
+    for disabled in [ [ "COMPRESS" ], [] ]:
+        d = os.path.join(outdir, str(len(disabled)))
+        os.mkdir(d)
+        stats.clear()
+        with FakeNNTPServer(groups, disabled=disabled) as server:
+            run_engine(engine, [ make_config(server, d, [ "a", "b" ],
+                                             compress=True, window=4) ],
+                       {}, capsys)
+            assert server.commands["COMPRESS"] == 1 - len(disabled)
+            sent[len(disabled)] = server.sent
+        metrics = stats.summary()["servers"]["127.0.0.1:%d" % server.port]
+        if disabled:
+            assert "compressed_bytes" not in metrics
+        else:
+            assert 0 < metrics["compressed_bytes"] <= sent[0]
+            assert metrics["decompressed_bytes"] > 5 * sent[0]
+            assert metrics["decompress_seconds"] > 0
+        for g in groups:
+            assert read_mbox(d, g) == \
+                [ l for n in sorted(groups[g]) for l in groups[g][n] ] + \
+                [ b"" ]
+    assert sent[0] * 5 < sent[1]
+
+
+def test_compressed_rotated(outdir, capsys):
+    groups = { "g" : synthetic_group("g", 30, size=2000) }
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir,
+                             [ dict(name="g", compression="bz2",
+                                    rotate=200, batch=10) ])
+        read_articles(config, {}, checkpoint=lambda: None)
+
+    names = sorted(n for n in os.listdir(outdir) if n != ".g.lock")
+    assert names == [ "g.%04d.mbox.bz2" % n for n in range(1, 4) ]
+    data = b""
+    for name in names:
+        with bz2.open(os.path.join(outdir, name)) as f:
+            data += f.read()
+    assert [ l for l in data.split(b"\n") if not l.startswith(b"From ") ] \
+        == [ l for n in range(1, 31) for l in groups["g"][n] ] + [ b"" ]
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_stats(outdir, capsys, engine):
+    groups = { "comp.lang.c" : synthetic_group("comp.lang.c", 5, gaps=[3]) }
+    stats.clear()
+    with FakeNNTPServer(groups, disabled=["LISTGROUP"]) as server:
+        config = make_config(server, outdir, ["comp.lang.c"], quiet=True)
+        out = run_engine(engine, [ config ], {}, capsys)
+
+    assert out.splitlines() == [ "5 articles for comp.lang.c at 127.0.0.1." ]
+    summary = stats.summary()
+    name = "127.0.0.1:%d" % server.port
+    assert list(summary["servers"]) == [ name ]
+    server_stats = summary["servers"][name]
+    assert server_stats["connections"] == 1
+    assert server_stats["seconds"] >= server_stats["connect_seconds"] > 0
+    group = server_stats["groups"]["comp.lang.c"]
+    assert (group["articles"], group["missing"], group["round_trips"]) == \
+        (4, 1, 2)
+    assert group["bytes"] == sum(len(line) + 2
+                                 for lines in groups["comp.lang.c"].values()
+                                 for line in lines)
+    assert group["seconds"] >= group["transfer_seconds"] + \
+        group["write_seconds"] > 0
+
+    lines = stats.prometheus().splitlines()
+    assert "# TYPE news2mbox_group_articles gauge" in lines
+    assert 'news2mbox_group_articles{group="comp.lang.c",server="%s"} 4' \
+        % name in lines
+    assert 'news2mbox_server_connections{server="%s"} 1' % name in lines
+
+
+def test_daemon(outdir, capsys):
+    groups = { "busy" : synthetic_group("busy", 3),
+               "dead" : synthetic_group("dead", 2) }
+    status = {}
+    stats.clear()
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir, [ "busy", "dead" ],
+                             poll_min=0.2, poll_max=1, keepalive=0.05)
+
+        async def run():
+            stopping = asyncio.Event()
+            daemon = asyncio.ensure_future(
+                run_daemon([ config ], status, stopping=stopping))
+            await asyncio.sleep(0.3)
+            groups["busy"].update(synthetic_group("busy", 2, first=4))
+            await asyncio.sleep(0.8)
+            stopping.set()
+            await daemon
+
+        asyncio.run(run())
+        assert server.commands["DATE"] > 0
+        assert server.commands["QUIT"] == 1
+
+    assert status == { "busy" : 5, "dead" : 2 }
+    assert read_mbox(outdir, "busy") == \
+        [ l for n in range(1, 6) for l in groups["busy"][n] ] + [ b"" ]
+    out = capsys.readouterr().out.splitlines()
+    assert [ l for l in out if "articles for" in l ] == [
+        "3 articles for busy at 127.0.0.1.",
+        "2 articles for dead at 127.0.0.1.",
+        "2 articles for busy at 127.0.0.1." ]
+    assert stats.summary()["servers"]["127.0.0.1:%d" % server.port] \
+        ["connections"] == 1
+
+
+def test_daemon_missing_group(outdir, capsys):
+    groups = { "busy" : synthetic_group("busy", 3) }
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir, [ "gone", "busy" ],
+                             poll_min=0.5, poll_max=1)
+        unreachable = dict(config, port=port, groups=[ "other" ])
+
+        async def run():
+            stopping = asyncio.Event()
+            daemon = asyncio.ensure_future(
+                run_daemon([ config, unreachable ], {}, stopping=stopping))
+            await asyncio.sleep(0.3)
+            stopping.set()
+            await daemon
+
+        asyncio.run(run())
+        assert server.commands["QUIT"] == 1
+
+    assert read_mbox(outdir, "busy") == \
+        [ l for n in range(1, 4) for l in groups["busy"][n] ] + [ b"" ]
+    err = capsys.readouterr().err
+    assert "gone at 127.0.0.1: 411 no such group" in err
+    assert err.count("retrying") == 1
+    assert "retrying in 0.5 seconds" in err
+
+
+def test_daemon_greeting_rejected(outdir, capsys):
+    groups = { "busy" : synthetic_group("busy", 3) }
+    with FakeNNTPServer(groups) as server, \
+         FakeNNTPServer({}, greeting=b"502 access denied") as rejecting:
+        config = make_config(server, outdir, [ "busy" ], poll_min=0.5)
+        rejected = make_config(rejecting, outdir, [ "other" ], poll_min=0.5)
+
+        async def run():
+            stopping = asyncio.Event()
+            daemon = asyncio.ensure_future(
+                run_daemon([ rejected, config ], {}, stopping=stopping))
+            await asyncio.sleep(0.3)
+            stopping.set()
+            await daemon
+
+        asyncio.run(run())
+        assert server.commands["QUIT"] == 1
+
+    assert read_mbox(outdir, "busy") == \
+        [ l for n in range(1, 4) for l in groups["busy"][n] ] + [ b"" ]
+    err = capsys.readouterr().err
+    assert "502 access denied, retrying in 0.5 seconds" in err
+
+
+def test_status_db(outdir, capsys):
+    groups = { "comp.lang.c" : synthetic_group("comp.lang.c", 5) }
+    db = StatusDB(os.path.join(outdir, "status.db"))
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir, [ "comp.lang.c" ])
+        read_articles(config, db, checkpoint=db.checkpoint)
+        groups["comp.lang.c"][6] = groups["comp.lang.c"][5]
+        read_articles(config, db, checkpoint=db.checkpoint)
+        query = "SELECT updated FROM status WHERE grp = 'comp.lang.c'"
+        updated, = db.db.execute(query).fetchone()
+        read_articles(config, db, checkpoint=db.checkpoint)
+        db.checkpoint()
+        assert db.db.execute(query).fetchone()[0] > updated
+        assert server.commands["ARTICLE"] == 6
+    db.close()
+
+    db = StatusDB(os.path.join(outdir, "status.db"))
+    assert dict(db.server(config)) == { "comp.lang.c" : 6 }
+    assert dict(db.server(dict(config, port=1))) == {}
+    db.close()
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_kill_filter(outdir, capsys, engine):
+    groups = { "g" : synthetic_group("g", 8, size=(500, 3000)),
+               "spam" : {} }
+    crosspost(groups, "g", 4, "spam", 1)
+    big = { n for n, lines in groups["g"].items()
+            if sum(len(l) + 2 for l in lines) > 2000 }
+    rules = dict(subject="Article [12] ", max_crossposts=1, max_bytes=2000)
+    stats.clear()
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir,
+                             [ dict(name="g", filter=rules) ])
+        out = run_engine(engine, [ config ], {}, capsys)
+        passed = sorted(set(range(3, 9)) - big - { 4 })
+        assert server.commands["ARTICLE"] == len(passed)
+
+    assert read_mbox(outdir, "g") == \
+        [ l for n in passed for l in groups["g"][n] ] + [ b"" ]
+    assert "%d articles filtered for g at 127.0.0.1." % (8 - len(passed)) \
+        in out.splitlines()
+    group = stats.summary()["servers"]["127.0.0.1:%d" % server.port] \
+        ["groups"]["g"]
+    assert (group["filtered"], group["filtered_subject"],
+            group["filtered_max_crossposts"]) == (8 - len(passed), 2, 1)
+    assert group["filtered_max_bytes"] == len(big - { 1, 2, 4 })
+
+
+@pytest.mark.parametrize("engine", [ "nntplib", "asyncio" ])
+def test_kill_filter_backfill_gap(outdir, capsys, engine):
+    groups = { "g" : synthetic_group("g", 15, gaps=range(4, 11)) }
+    with FakeNNTPServer(groups) as server:
+        rules = dict(subject="Article 1 ")
+        config = make_config(server, outdir, [ dict(name="g", filter=rules) ],
+                             backfill=True, batch=3)
+        status = {}
+        run_engine(engine, [ config ], status, capsys)
+        assert server.commands["OVER"] == 5
+
+    assert status == { "g" : 15 }
+    assert read_mbox(outdir, "g") == \
+        [ l for n in [ 2, 3, 11, 12, 13, 14, 15 ] for l in groups["g"][n] ] + \
+        [ b"" ]
+
+
+def test_expand_groups(outdir):
+    names = [ "alt.test", "comp.lang.c", "comp.lang.java",
+              "comp.lang.javascript", "comp.lang.python", "sci.math" ]
+    groups = { g : synthetic_group(g, 3) for g in names }
+    entries = [ "comp.lang.*", "!comp.lang.java*", "comp.lang.javascript",
+                dict(name="sci.*", max_articles=2), "misc.explicit" ]
+    with FakeNNTPServer(groups) as server:
+        def expand(**kwargs):
+            config = make_config(server, outdir, list(entries),
+                                 cachedir=outdir, **kwargs)
+            expand_groups(config)
+            return config["groups"]
+
+        expected = [ "comp.lang.c", "comp.lang.javascript",
+                     "comp.lang.python", "misc.explicit",
+                     dict(name="sci.math", max_articles=2) ]
+        assert expand() == expected
+        assert server.commands["LIST"] == 1
+
+        groups["comp.lang.rust"] = synthetic_group("comp.lang.rust", 1)
+        server.created["comp.lang.rust"] = time.time()
+        assert expand() == expected
+        assert expand(groups_ttl=0) == expected[:3] + [ "comp.lang.rust" ] \
+            + expected[3:]
+        assert server.commands["LIST"] == 1
+        assert server.commands["NEWGROUPS"] == 1
+
+        entries[0] = "comp.*"
+        assert expand(groups_ttl=0)[:4] == [ "comp.lang.c",
+                                             "comp.lang.javascript",
+                                             "comp.lang.python",
+                                             "comp.lang.rust" ]
+        assert server.commands["LIST"] == 2
+
+        config = make_config(server, outdir, [ "comp.lang.c" ])
+        expand_groups(config)
+        assert config["groups"] == [ "comp.lang.c" ]
+
+
+def test_expand_groups_unreachable(outdir, capsys):
+    groups = { g : synthetic_group(g, 3) for g in [ "comp.a", "comp.b" ] }
+    with FakeNNTPServer(groups) as server:
+        config = make_config(server, outdir, [ "comp.*" ], cachedir=outdir,
+                             groups_ttl=0, retries=1, backoff=0.01)
+        expand_groups(dict(config))
+    config["groups"] = [ "comp.*" ]
+    expand_groups(config)
+    assert config["groups"] == [ "comp.a", "comp.b" ]
+    err = capsys.readouterr().err
+    assert "reconnecting in 0.01 seconds" in err
+    assert "Using the cached groups of 127.0.0.1" in err
+
+    config = dict(config, groups=[ "sci.*" ])
+    with pytest.raises(ConnectionRefusedError):
+        expand_groups(config)
+
+
+def test_main_unreachable_server(outdir):
+    groups = { "comp.a" : synthetic_group("comp.a", 3) }
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    with FakeNNTPServer(groups) as server:
+        configs = [ dict(make_config(server, outdir, [ "x.*" ]), port=port,
+                         retries=0),
+                    make_config(server, outdir, [ "comp.a" ]) ]
+        with open(os.path.join(outdir, "config.json"), "w") as f:
+            json.dump(configs, f)
+        proc = subprocess.run(
+            [ sys.executable, PROGRAM, "--config-dir", outdir, "--quiet" ],
+            capture_output=True, text=True)
+        assert server.commands["ARTICLE"] == 3
+
+    assert proc.returncode == 1
+    assert "Reading from 127.0.0.1 failed" in proc.stderr
+    assert "Traceback" not in proc.stderr
+    assert read_mbox(outdir, "comp.a") == \
+        [ l for n in range(1, 4) for l in groups["comp.a"][n] ] + [ b"" ]
+
+
+def test_message_index_validation(outdir):
+    mbox = os.path.join(outdir, "g")
+    with open(mbox, "wb") as f:
+        f.write(b"From x\nMessage-ID: <1@x>\n\nbody\n")
+    index = MessageIndex(os.path.join(outdir, "msgid.db"))
+    index.add("<1@x>", mbox, 7, 24)
+    index.add("<2@x>", mbox, 7, 24)
+    index.add("<3@x>", mbox, 7, 100)
+    assert index.lookup("<1@x>") == (mbox, 7, 24)
+    assert index.read(mbox, 7, 24) == b"Message-ID: <1@x>\n\nbody\n"
+    assert index.lookup("<2@x>") is None
+    assert index.lookup("<3@x>") is None
+    assert index.lookup("<4@x>") is None
+
+    with open(mbox, "ab") as f:
+        for header in [ b"Message-ID:<5@x>", b"message-id: \t <6@x>",
+                        b"Subject: <7@x>\nMessage-Id:  <7@x>  " ]:
+            f.write(b"From x\n" + header + b"\n\nbody\n")
+    offset = 31
+    for n, header in [ (5, 16), (6, 20), (7, 35) ]:
+        index.add("<%d@x>" % n, mbox, offset, header + 7)
+        assert index.lookup("<%d@x>" % n) == (mbox, offset, header + 7)
+        offset += header + 14
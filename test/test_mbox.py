@@ -0,0 +1,320 @@
+from news2mbox import COMPRESSIONS, INDEX_MAGIC, INDEX_RECORD, \
+                      CompressedMboxWriter, MaildirWriter, MboxIndex, \
+                      MboxWriter, compact_group, compact_mbox, mbox_full, \
+                      mbox_name, open_mbox, rebuild_index
+import bz2
+import email.utils
+import gzip
+import lzma
+import os
+import pytest
+import re
+import shutil
+import tempfile
+import time
+
+
+@pytest.fixture
+def mbox():
+    d = tempfile.mkdtemp()
+    yield os.path.join(d, "g")
+    shutil.rmtree(d)
+
+
+def read_messages(mbox):
+    with open(mbox, "rb") as f:
+        return re.split(rb"^From .*\n", f.read(), flags=re.MULTILINE)[1:]
+
+
+def test_escaping(mbox):
+    lines = [ b"Subject: From", b"", b"From here", b">From there",
+              b" From", b"From", b">>From the start" ]
+    with MboxWriter(mbox) as f:
+        offset, length = f.write("<1@x>", lines)
+
+    assert read_messages(mbox) == [
+        b"Subject: From\n\n>From here\n>>From there\n From\nFrom\n"
+        b">>>From the start\n" ]
+    with open(mbox, "rb") as f:
+        f.seek(offset)
+        assert f.read() == read_messages(mbox)[0]
+    assert length == len(read_messages(mbox)[0])
+
+
+@pytest.mark.parametrize("preallocate", [ 0, 100, 2**20 ])
+def test_append(mbox, preallocate):
+    articles = [ [ b"Message-ID: <%d@x>" % n, b"", b"x" * 70 * n ]
+                 for n in range(10) ]
+    locations = []
+    for chunk in [ articles[:4], articles[4:] ]:
+        with MboxWriter(mbox, preallocate) as f:
+            for lines in chunk:
+                locations.append(f.write(lines[0][12:].decode(), lines))
+            f.copy("<0@x>", b"copied\n")
+        assert f.end == os.path.getsize(mbox)
+
+    messages = [ b"\n".join(lines) + b"\n" for lines in articles ]
+    assert read_messages(mbox) == \
+        messages[:4] + [ b"copied\n" ] + messages[4:] + [ b"copied\n" ]
+    with open(mbox, "rb") as f:
+        for message, (offset, length) in zip(messages, locations):
+            f.seek(offset)
+            assert f.read(length) == message
+
+
+def test_trim_preallocated(mbox):
+    f = MboxWriter(mbox, 2**16)
+    f.write("<1@x>", [ b"a" ])
+    os.close(f.fd)
+    assert os.path.getsize(mbox) == 2**16
+
+    with MboxWriter(mbox, 2**16) as f:
+        f.write("<2@x>", [ b"b" ])
+    assert read_messages(mbox) == [ b"a\n", b"b\n" ]
+
+
+def make_articles(numbers):
+    return [ (n, [ b"Message-ID: <%d@x>" % n,
+                   b"Date: Fri, 16 Oct 2026 12:00:%02d +0000" % (n % 60),
+                   b"Xref: news g:%d h:%d" % (n, n + 1000),
+                   b"",
+                   b"From body %d" % n ])
+             for n in numbers ]
+
+
+def write_indexed(mbox, articles):
+    with MboxWriter(mbox, index=True) as f:
+        for n, lines in articles:
+            f.write("<%d@x>" % n, lines, n)
+
+
+def read_index(mbox):
+    with open(mbox + ".idx", "rb") as f:
+        data = f.read()
+    assert data[:len(INDEX_MAGIC)] == INDEX_MAGIC
+    return list(INDEX_RECORD.iter_unpack(data[len(INDEX_MAGIC):]))
+
+
+def test_index(mbox):
+    articles = make_articles([ 3, 5, 8, 13, 21 ])
+    write_indexed(mbox, articles[:2])
+    write_indexed(mbox, articles[2:])
+
+    with MboxIndex(mbox) as index:
+        assert index.covered == index.count == 5
+        for n, lines in articles:
+            article = b"\n".join(lines) + b"\n"
+            assert index.get(n) == article
+            assert index.get("<%d@x>" % n) == article
+        assert [ r[4] % 60 for r in read_index(mbox) ] == \
+            [ 3, 5, 8, 13, 21 ]
+        for key in [ 1, 4, 22, "<4@x>" ]:
+            assert index.get(key) is None
+
+
+def test_index_repair(mbox):
+    articles = make_articles(range(1, 11))
+    write_indexed(mbox, articles[:6])
+    records = read_index(mbox)
+    size = os.path.getsize(mbox)
+    write_indexed(mbox, articles[6:])
+    with open(mbox + ".idx", "r+b") as f:
+        f.truncate(len(INDEX_MAGIC) + 4 * INDEX_RECORD.size + 5)
+    os.truncate(mbox, size)
+
+    with MboxWriter(mbox, index=True):
+        pass
+    assert read_index(mbox) == records
+    with MboxIndex(mbox) as index:
+        assert index.get(6) == b"\n".join(articles[5][1]) + b"\n"
+        assert index.get("<7@x>") is None
+
+
+def test_rebuild_index(mbox):
+    write_indexed(mbox, make_articles(range(1, 30, 3)))
+    records = read_index(mbox)
+    with open(mbox + ".ids", "rb") as f:
+        ids = f.read()
+    rebuild_index(mbox)
+    assert read_index(mbox) == records
+    with open(mbox + ".ids", "rb") as f:
+        assert f.read() == ids
+
+
+@pytest.mark.parametrize("suffix", [ ".0002.mbox", ".2026-10.mbox" ])
+def test_rebuild_index_rotated(mbox, suffix):
+    write_indexed(mbox + suffix, make_articles(range(1, 30, 3)))
+    records = read_index(mbox + suffix)
+    rebuild_index(mbox + suffix)
+    assert read_index(mbox + suffix) == records
+    with MboxIndex(mbox + suffix) as index:
+        assert index.get(7).startswith(b"Message-ID: <7@x>\n")
+
+
+def decompress(name):
+    codec = { ".gz" : gzip, ".bz2" : bz2, ".xz" : lzma }
+    with codec[os.path.splitext(name)[1]].open(name, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("compression", sorted(COMPRESSIONS))
+def test_compressed(mbox, compression):
+    name = mbox + COMPRESSIONS[compression][0]
+    articles = make_articles(range(1, 8))
+    messages = [ b"\n".join(lines).replace(b"\nFrom", b"\n>From") + b"\n"
+                 for n, lines in articles ]
+    for chunk in [ articles[:4], articles[4:] ]:
+        with CompressedMboxWriter(name, compression) as f:
+            for n, lines in chunk:
+                assert f.write("<%d@x>" % n, lines, n) == \
+                    (None, len(messages[n - 1]))
+                if n == 2:
+                    f.sync()
+        assert not os.path.exists(name + ".synced")
+
+    with open(mbox, "wb") as f:
+        f.write(decompress(name))
+    assert read_messages(mbox) == messages
+
+
+def test_compressed_killed(mbox):
+    name = mbox + ".gz"
+    articles = make_articles(range(1, 4))
+    f = CompressedMboxWriter(name, "gzip")
+    f.write("<1@x>", articles[0][1], 1)
+    f.sync()
+    f.write("<2@x>", articles[1][1], 2)
+    f.append(f.compressor.flush(2))
+    os.close(f.fd)
+    assert os.path.exists(name + ".synced")
+
+    with CompressedMboxWriter(name, "gzip") as f:
+        f.write("<3@x>", articles[2][1], 3)
+    with open(mbox, "wb") as f:
+        f.write(decompress(name))
+    assert [ m.split(b"\n")[0] for m in read_messages(mbox) ] == \
+        [ b"Message-ID: <1@x>", b"Message-ID: <3@x>" ]
+
+
+def test_mbox_name(mbox):
+    outdir, g = os.path.split(mbox)
+    config = dict(outdir=outdir)
+    assert mbox_name(config, g) == mbox
+    assert mbox_name(dict(config, compression="xz"), g) == mbox + ".mbox.xz"
+    assert mbox_name(dict(config, rotate="month"), g) == \
+        mbox + time.strftime(".%Y-%m.mbox")
+
+    config = dict(config, compression="gzip", rotate=100)
+    names = []
+    for n in range(5):
+        with open_mbox(config, g) as f:
+            while not mbox_full(config, g, f):
+                f.write("<%d@x>" % n, [ b"x" * 50 ], n)
+                f.sync()
+            names.append(os.path.basename(f.name))
+    assert names == [ "g.%04d.mbox.gz" % n for n in range(1, 6) ]
+
+
+def read_maildir(path):
+    new = os.path.join(path, "new")
+    contents = []
+    for name in sorted(os.listdir(new)):
+        with open(os.path.join(new, name), "rb") as f:
+            contents.append(f.read())
+    return contents
+
+
+def test_maildir(mbox):
+    articles = make_articles(range(1, 4))
+    messages = [ b"\n".join(lines) + b"\n" for n, lines in articles ]
+    with open_mbox(dict(outdir=os.path.dirname(mbox), format="maildir"),
+                   "g") as f:
+        assert isinstance(f, MaildirWriter)
+        for n, lines in articles:
+            assert f.write("<%d@x>" % n, lines, n) == \
+                (0, len(messages[n - 1]))
+        assert len(os.listdir(os.path.join(mbox, "tmp"))) == 3
+        assert read_maildir(mbox) == []
+        f.sync()
+        assert os.listdir(os.path.join(mbox, "tmp")) == []
+        assert sorted(read_maildir(mbox)) == messages
+        location = f.name, 0, len(messages[2])
+
+    with MaildirWriter(mbox + ".2") as f:
+        f.copy("<1@x>", b"a\n>From b\n>>From c\n")
+        f.duplicate("<3@x>", location)
+    assert os.stat(location[0]).st_nlink == 2
+    assert sorted(read_maildir(mbox + ".2")) == \
+        sorted([ b"a\nFrom b\n>From c\n", messages[2] ])
+
+    with MboxWriter(mbox + ".mbox") as f:
+        offset, length = f.duplicate("<3@x>", location)
+    assert read_messages(mbox + ".mbox") == \
+        [ messages[2].replace(b"\nFrom", b"\n>From") ]
+    with MaildirWriter(mbox + ".3") as f:
+        f.duplicate("<3@x>", (mbox + ".mbox", offset, length))
+    assert read_maildir(mbox + ".3") == [ messages[2] ]
+    assert os.stat(location[0]).st_nlink == 2
+    assert not mbox_full(dict(format="maildir"), "g", f)
+
+
+def dated_articles(ages):
+    now = time.time()
+    return [ (n, [ b"Message-ID: <%d@x>" % (n % 8),
+                   b"Date: " + email.utils.formatdate(now - age * 86400)
+                                   .encode(),
+                   b"Xref: news g:%d" % n,
+                   b"",
+                   b"From body %d" % n ])
+             for n, age in enumerate(ages, 1) ]
+
+
+@pytest.mark.parametrize("retention, dedup, kept", [
+    (dict(max_age=15), False, list(range(6, 11))),
+    (dict(max_messages=3), False, [ 8, 9, 10 ]),
+    (dict(max_bytes=300), False, [ 9, 10 ]),
+    (dict(max_age=25, max_messages=4), True, [ 7, 8, 9, 10 ]),
+    ({}, True, list(range(1, 9))) ])
+def test_compact(mbox, retention, dedup, kept):
+    articles = dated_articles([ 30, 28, 26, 24, 20, 10, 8, 6, 4, 2 ])
+    write_indexed(mbox, articles)
+    messages = read_messages(mbox)
+    before = os.path.getsize(mbox)
+
+    result = compact_mbox(mbox, retention, dedup)
+    assert read_messages(mbox) == [ messages[n - 1] for n in kept ]
+    assert result == (10, len(kept), before, os.path.getsize(mbox))
+    with MboxIndex(mbox) as index:
+        assert index.count == len(kept)
+        assert index.get(kept[0]) == \
+            messages[kept[0] - 1].replace(b">From", b"From")
+    assert sorted(os.listdir(os.path.dirname(mbox))) == \
+        [ "g", "g.ids", "g.idx" ]
+
+
+def test_compact_unchanged(mbox):
+    with MboxWriter(mbox) as f:
+        for n, lines in dated_articles([ 3, 2, 1 ]):
+            f.write("<%d@x>" % n, lines, n)
+    inode = os.stat(mbox).st_ino
+    assert compact_mbox(mbox, dict(max_age=5, max_messages=3)) == \
+        (3, 3, os.path.getsize(mbox), os.path.getsize(mbox))
+    assert os.stat(mbox).st_ino == inode
+
+
+def test_compact_group(mbox, capsys):
+    outdir, g = os.path.split(mbox)
+    with MboxWriter(mbox) as f:
+        for n, lines in dated_articles([ 3, 2, 1 ]):
+            f.write("<%d@x>" % n, lines, n)
+    config = dict(server="news", outdir=outdir,
+                  groups=[ dict(name=g, retention=dict(max_messages=1)),
+                           dict(name="h", compression="gzip") ])
+    before = os.path.getsize(mbox)
+    compact_group(config, g)
+    compact_group(config, "h", dedup=True)
+    assert len(read_messages(mbox)) == 1
+    assert capsys.readouterr().out.splitlines() == [
+        "1 of 3 articles kept for g, %d bytes freed." %
+        (before - os.path.getsize(mbox)),
+        "news2mbox: The mailbox of h cannot be compacted" ]
@@ -0,0 +1,128 @@
+from news2mbox import StatusDB, make_checkpoint, read_status, write_status
+import os
+import pytest
+import shutil
+import tempfile
+import threading
+
+
+@pytest.fixture
+def statusfile():
+    d = tempfile.mkdtemp()
+    yield os.path.join(d, "status.json")
+    shutil.rmtree(d)
+
+
+def test_roundtrip(statusfile):
+    write_status(statusfile, { "comp.lang.c" : 12496, "comp.lang.python" : 8 })
+    assert read_status(statusfile) == { "comp.lang.c" : 12496,
+                                        "comp.lang.python" : 8 }
+    assert os.listdir(os.path.dirname(statusfile)) == [ "status.json" ]
+
+
+def test_missing(statusfile):
+    assert read_status(statusfile) == {}
+
+
+def test_invalid(statusfile):
+    with open(statusfile, "w") as f:
+        f.write('{ "comp.lang.c" : "12" }')
+    assert read_status(statusfile) == {}
+
+
+def test_interrupted_write_keeps_old_status(statusfile, monkeypatch):
+    write_status(statusfile, { "comp.lang.c" : 1 })
+
+    def broken_dump(*args, **kwargs):
+        raise KeyboardInterrupt
+    monkeypatch.setattr("json.dump", broken_dump)
+
+    with pytest.raises(KeyboardInterrupt):
+        write_status(statusfile, { "comp.lang.c" : 2 })
+    monkeypatch.undo()
+    assert read_status(statusfile) == { "comp.lang.c" : 1 }
+
+
+def test_checkpoint(statusfile):
+    status = { "comp.lang.c" : 1 }
+    checkpoint = make_checkpoint(statusfile, status)
+    checkpoint()
+    status["comp.lang.c"] = 2
+    assert read_status(statusfile) == { "comp.lang.c" : 1 }
+    checkpoint()
+    assert read_status(statusfile) == { "comp.lang.c" : 2 }
+
+
+def test_checkpoint_merge(statusfile):
+    write_status(statusfile, { "a" : 1, "b" : 1 })
+    first = read_status(statusfile)
+    second = read_status(statusfile)
+    checkpoint1 = make_checkpoint(statusfile, first)
+    checkpoint2 = make_checkpoint(statusfile, second)
+    first["a"] = 2
+    checkpoint1()
+    second["b"] = 3
+    second["c"] = 1
+    checkpoint2()
+    assert read_status(statusfile) == { "a" : 2, "b" : 3, "c" : 1 }
+    first["a"] = 4
+    checkpoint1()
+    assert read_status(statusfile) == { "a" : 4, "b" : 3, "c" : 1 }
+    assert first == { "a" : 4, "b" : 3, "c" : 1 }
+
+
+def test_status_db_migration(statusfile):
+    write_status(statusfile, { "a" : 5, "b" : 7, "c" : 9 })
+    configs = [ dict(server="news1", groups=[ "a" ]),
+                dict(server="news2", port=1119, groups=[ "a", "[b-z]" ]) ]
+    path = os.path.join(os.path.dirname(statusfile), "status.db")
+    db = StatusDB(path, statusfile, configs)
+    assert dict(db.server(configs[0])) == { "a" : 5 }
+    assert dict(db.server(configs[1])) == { "a" : 5, "b" : 7, "c" : 9 }
+    db.close()
+
+    write_status(statusfile, { "a" : 1 })
+    db = StatusDB(path, statusfile, configs)
+    assert dict(db.server(configs[0])) == { "a" : 5 }
+    db.close()
+
+
+def test_status_db_checkpoint(statusfile):
+    path = os.path.join(os.path.dirname(statusfile), "status.db")
+    config1 = dict(server="news1", groups=[ "g" ])
+    config2 = dict(server="news2", groups=[ "g" ])
+    db = StatusDB(path)
+    other = StatusDB(path)
+    db.server(config1)["g"] = 1
+    db.server(config2)["g"] = 2
+    assert db.server(config1).get("g") == 1
+    assert other.server(config1).get("g") is None
+    db.checkpoint()
+    assert other.server(config1)["g"] == 1
+    assert other.server(config2)["g"] == 2
+    del db.server(config2)["g"]
+    db.close()
+    assert dict(other.server(config2)) == {}
+    other.close()
+
+
+def test_status_db_concurrent(statusfile):
+    path = os.path.join(os.path.dirname(statusfile), "status.db")
+    config = dict(server="news", groups=[])
+
+    def worker(g):
+        db = StatusDB(path)
+        for n in range(1, 51):
+            db.server(config)[g] = n
+            db.checkpoint()
+        db.close()
+
+    threads = [ threading.Thread(target=worker, args=("g%d" % i,))
+                for i in range(4) ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    db = StatusDB(path)
+    assert dict(db.server(config)) == { "g%d" % i : 50 for i in range(4) }
+    db.close()